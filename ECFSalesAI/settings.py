@@ -64,6 +64,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'ai_app.metrics.MetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'ECFSalesAI.urls'
@@ -94,6 +95,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # The web workers and the run_jobs workers write concurrently
+        'OPTIONS': {'timeout': 20},
     }
 }
 
@@ -1,9 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from ai_app.metrics import metrics_view
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('ai_app/', include('ai_app.urls')),
     path('copilot/', include('copilot.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -0,0 +1,44 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from decouple import config
+from django.utils import timezone
+
+from .models import StageArtifact
+
+# Bump to invalidate every stored artifact, e.g. after changing a stage's prompt
+ARTIFACTS_VERSION = config("ARTIFACTS_VERSION", default="1")
+
+ARTIFACT_MAX_AGE = timedelta(seconds=config("ARTIFACT_MAX_AGE_SECONDS", default=7 * 24 * 3600, cast=int))
+
+
+class ArtifactStore:
+    """
+    Checkpoints of one project's pipeline stages. A stage whose inputs hash to the stored
+    value gets the stored output back instead of running again.
+    """
+
+    def __init__(self, pipeline, project_id):
+        self.pipeline = pipeline
+        self.project_id = str(project_id)
+
+    def input_hash(self, stage, inputs):
+        data = json.dumps({"version": ARTIFACTS_VERSION, "stage": stage, "inputs": inputs},
+                          sort_keys=True, default=str)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def load(self, stage, input_hash):
+        """Return (found, output) for the stage computed from these inputs."""
+        artifact = StageArtifact.objects.filter(
+            pipeline=self.pipeline, project_id=self.project_id, stage=stage, input_hash=input_hash,
+            updated_at__gte=timezone.now() - ARTIFACT_MAX_AGE).first()
+        if artifact is None:
+            return False, None
+        return True, artifact.output
+
+    def save(self, stage, input_hash, output):
+        StageArtifact.objects.update_or_create(
+            pipeline=self.pipeline, project_id=self.project_id, stage=stage,
+            defaults={"input_hash": input_hash, "output": output},
+        )
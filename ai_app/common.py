@@ -1,34 +1,65 @@
 import re
 import time
+import asyncio
+import hashlib
+import functools
+import threading
 import logging
-import requests
+import httpx
 import openai
 import base64
 from io import BytesIO
 from decouple import config
 
+from .html_extract import compact_text, estimate_tokens, extract_main_content
+from .llm_cache import chat_completion
+from .metrics import record_token_usage, span
+from .sqlite_cache import open_cache
+
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 
 
 def log_execution_time(func):
+    """Log the wall-clock time of each call and record it as a ``function`` span."""
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        execution_time = end_time - start_time
-        logging.info(f"{func.__name__}() took {execution_time:.4f} seconds to complete")
-        return result
+        with span("function", func.__name__, log=True):
+            return func(*args, **kwargs)
     return wrapper
 
 
-def gpt_response(client, prompt):
-    response = client.chat.completions.create(
-        model=config("MODEL_NAME"),
-        # max_tokens=10000,
-        messages=[{"role": "user", "content": prompt}]
-    )
-    result = response.choices[0].message.content.strip()
-    return result
+class TokenRateLimiter:
+    """
+    Tokens-per-minute budget shared by all threads of the process (a continuously
+    refilled token bucket). ``acquire`` blocks until the requested tokens are available.
+    """
+
+    def __init__(self, tokens_per_minute):
+        self.capacity = tokens_per_minute
+        self.tokens = tokens_per_minute
+        self.updated_at = time.monotonic()
+        self._condition = threading.Condition()
+
+    def acquire(self, tokens):
+        tokens = min(tokens, self.capacity)
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.capacity / 60)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                self._condition.wait((tokens - self.tokens) * 60 / self.capacity)
+
+
+# Budget for the vision (page OCR) calls, matched to the deployment's TPM quota
+vision_rate_limiter = TokenRateLimiter(config("OCR_TOKENS_PER_MINUTE", default=30000, cast=int))
+
+
+def gpt_response(client, prompt, use_cache=True):
+    result = chat_completion(client, [{"role": "user", "content": prompt}], use_cache=use_cache)
+    return result.strip()
 
 
 def summarize_text_with_gpt(client, text):
@@ -44,34 +75,105 @@ def summarize_text_with_gpt(client, text):
         return f"Error during summarization: {str(e)}"
 
 
+_summary_cache = None
+
+
+def get_summary_cache():
+    """Per-URL summary memo shared by the workers (created lazily, Django settings must be loaded)."""
+    global _summary_cache
+    if _summary_cache is None:
+        _summary_cache = open_cache(
+            "llm_cache.sqlite3", "url_summaries",
+            ttl_seconds=config("URL_SUMMARY_TTL_SECONDS", default=30 * 24 * 3600, cast=int),
+            max_entries=config("URL_SUMMARY_MAX_ENTRIES", default=2000, cast=int),
+        )
+    return _summary_cache
+
+
+def extract_urls(input_text):
+    """Unique URLs of the text in order of appearance, without trailing punctuation."""
+    urls = re.findall(r'(https?://\S+)', input_text)
+    return list(dict.fromkeys(url.rstrip('.,;:)]}>"\'') for url in urls))
+
+
+# Text that summarize_url writes instead of a summary when a page could not be summarised
+SUMMARY_ERROR_MARKERS = ("Error retrieving content from", "Error during summarization")
+
+
+def summaries_complete(summaries):
+    """True when none of the URL summaries is an error message."""
+    return not any(marker in summaries for marker in SUMMARY_ERROR_MARKERS)
+
+
+async def summarize_url(http_client, semaphore, client, url):
+    """
+    Summary of one URL. A memoised summary younger than URL_SUMMARY_FRESH_SECONDS is used
+    without fetching; an older one is reused when the page content hash has not changed.
+    """
+    cache = get_summary_cache()
+    cached = await asyncio.to_thread(cache.get, url)
+    fresh_seconds = config("URL_SUMMARY_FRESH_SECONDS", default=24 * 3600, cast=int)
+    if cached and time.time() - cached["fetched_at"] < fresh_seconds:
+        return f"Summary for {url}:\n{cached['summary']}\n\n"
+
+    try:
+        async with semaphore:
+            with span("url_fetch", "get"):
+                response = await http_client.get(url)
+        if response.status_code != 200:
+            return ""
+
+        if "html" in response.headers.get("content-type", "html"):
+            content, stats = extract_main_content(response.text)
+        else:
+            content = compact_text(response.text)
+            stats = {"original_tokens": estimate_tokens(response.text), "tokens": estimate_tokens(content)}
+        logging.info(f"{url}: {stats['original_tokens']} -> {stats['tokens']} tokens "
+                     f"({stats['original_tokens'] - stats['tokens']} saved)")
+        if not content:
+            return ""
+
+        content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        if cached and cached["content_hash"] == content_hash:
+            summary = cached["summary"]
+        else:
+            async with semaphore:
+                summary = await asyncio.to_thread(summarize_text_with_gpt, client, content)
+            if summary.startswith("Error during summarization"):
+                return f"Summary for {url}:\n{summary}\n\n"
+
+        await asyncio.to_thread(cache.set, url, {
+            "summary": summary, "content_hash": content_hash, "fetched_at": time.time()})
+        return f"Summary for {url}:\n{summary}\n\n"
+    except Exception as e:
+        return f"Error retrieving content from {url}: {str(e)}\n\n"
+
+
+async def summarize_urls(client, urls):
+    semaphore = asyncio.Semaphore(config("URL_SUMMARY_CONCURRENCY", default=5, cast=int))
+    async with httpx.AsyncClient(timeout=10, follow_redirects=True) as http_client:
+        return await asyncio.gather(*(summarize_url(http_client, semaphore, client, url) for url in urls))
+
+
 @log_execution_time
 def get_summaries_from_text(client, input_text):
     """
-    Extracts URLs from the provided input_text, browses each URL to retrieve content,
-    summarizes each content using GPT (via gpt_response), and appends all summaries into one text variable.
+    Extracts URLs from the provided input_text, fetches them, reduces each page to its
+    main article text and summarizes them concurrently (at most URL_SUMMARY_CONCURRENCY
+    requests at a time), then appends all summaries into one text variable.
+    Summaries are memoised per URL and page content hash.
 
     :param client: GPT client to be used for summarization.
     :param input_text: A string containing one or more URLs.
     :return: A string that contains the combined summaries of all URLs.
     """
-    # Regex pattern to extract URLs
-    urls = re.findall(r'(https?://\S+)', input_text)
-    urls = set(urls)
-    final_summary = ""
-
-    for url in urls:
-        try:
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                content = response.text
-                summary = summarize_text_with_gpt(client, content)
-                final_summary += f"Summary for {url}:\n{summary}\n\n"
-            # else:
-            #     final_summary += f"Could not retrieve content from {url}. HTTP status code: {response.status_code}\n\n"
-        except Exception as e:
-            final_summary += f"Error retrieving content from {url}: {str(e)}\n\n"
-
-    return final_summary
+    urls = extract_urls(input_text)
+    if not urls:
+        return ""
+
+    summaries = asyncio.run(summarize_urls(client, urls))
+    return "".join(summaries)
+
 
 class CommonUtils:
 
@@ -79,26 +181,16 @@ class CommonUtils:
         pass
 
     @staticmethod
-    def gpt_response(client, prompt):
-        response =client.chat.completions.create(
-            model=config("MODEL_NAME"),
-            # max_tokens=10000,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        result = response.choices[0].message.content.strip()
-        return result
+    def gpt_response(client, prompt, use_cache=True):
+        result = chat_completion(client, [{"role": "user", "content": prompt}], use_cache=use_cache)
+        return result.strip()
 
     @staticmethod
     @log_execution_time
-    def gpt_response_json(client, prompt):
-        response = client.chat.completions.create(
-            model=config("MODEL_NAME"),
-            # max_tokens=10000,
-            messages=[{"role": "user", "content": prompt}],
-            response_format = {"type": "json_object"}
-        )
-        result = response.choices[0].message.content.strip()
-        return result
+    def gpt_response_json(client, prompt, use_cache=True):
+        result = chat_completion(client, [{"role": "user", "content": prompt}],
+                                 response_format={"type": "json_object"}, use_cache=use_cache)
+        return result.strip()
 
     @staticmethod
     def load_prompt_without_remarks(questionnaire_content, copilot_response, unique_services):
@@ -130,28 +222,38 @@ class CommonUtils:
     @staticmethod
     @log_execution_time
     def send_image_to_gpt(client, image, prompt):
-        # Convert image to base64
+        # Convert image to base64, JPEG by default (OCR_IMAGE_FORMAT / OCR_IMAGE_QUALITY)
+        image_format = config("OCR_IMAGE_FORMAT", default="JPEG").upper()
         image_bytes = BytesIO()
-        image.save(image_bytes, format='PNG')
+        if image_format == "JPEG":
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(image_bytes, format="JPEG", quality=config("OCR_IMAGE_QUALITY", default=85, cast=int),
+                       optimize=True)
+        else:
+            image.save(image_bytes, format='PNG', optimize=True)
         image_bytes.seek(0)
         base64_image = base64.b64encode(image_bytes.read()).decode('utf-8')
+        mime_type = "image/jpeg" if image_format == "JPEG" else "image/png"
 
-        response = client.chat.completions.create(
-            model=config("MODEL_NAME"),
-            # max_tokens=10000,
-            messages=[
-                {"role": "system",
-                 "content": "You are an expert at extracting data from scanned MCQ and free-text questionnaires."},
-                {"role": "user", "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {
-                        "url": f"data:image/png;base64,{base64_image}",
-                        "detail": "high"
-                    }},
-                ]}
-            ],
-            # response_format={"type": "json_object"}
-        )
+        with span("openai", "vision"):
+            response = client.chat.completions.create(
+                model=config("MODEL_NAME"),
+                # max_tokens=10000,
+                messages=[
+                    {"role": "system",
+                     "content": "You are an expert at extracting data from scanned MCQ and free-text questionnaires."},
+                    {"role": "user", "content": [
+                        {"type": "text", "text": prompt},
+                        {"type": "image_url", "image_url": {
+                            "url": f"data:{mime_type};base64,{base64_image}",
+                            "detail": config("OCR_IMAGE_DETAIL", default="high")
+                        }},
+                    ]}
+                ],
+                # response_format={"type": "json_object"}
+            )
+        record_token_usage("vision", getattr(response, "usage", None))
 
         result = response.choices[0].message.content.strip()
         return result
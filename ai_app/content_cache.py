@@ -0,0 +1,165 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from decouple import config
+from django.conf import settings
+
+from .graph_client import graph_client
+
+
+class ItemNotFound(Exception):
+    """The drive item does not exist (any more)."""
+
+
+class ContentCache:
+    """
+    Cache of SharePoint file content keyed by drive item, validated with cTag/eTag.
+
+    Content lives in a size-bounded in-memory LRU backed by a disk tier, so it survives
+    restarts and is shared by all workers on the instance. A caller that already knows
+    the item's current tag (e.g. from a listing) gets a hit with no request at all;
+    otherwise the content is revalidated with a conditional GET and only downloaded
+    again when SharePoint does not answer 304 Not Modified.
+    """
+
+    def __init__(self, directory=None, max_memory_bytes=None, max_disk_bytes=None):
+        self.directory = Path(directory or config(
+            "CONTENT_CACHE_DIR", default=str(Path(settings.BASE_DIR) / ".cache" / "content")))
+        self.max_memory_bytes = max_memory_bytes or config(
+            "CONTENT_CACHE_MEMORY_MB", default=64, cast=int) * 1024 * 1024
+        self.max_disk_bytes = max_disk_bytes or config(
+            "CONTENT_CACHE_DISK_MB", default=1024, cast=int) * 1024 * 1024
+        self._memory = OrderedDict()  # key -> (tag, content)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+    def get_content(self, drive_id, item_id, tag=None, access_token=None):
+        """
+        Return the bytes of a drive item.
+
+        :param tag: The item's current cTag/eTag when the caller already knows it.
+        """
+        key = f"{drive_id}/{item_id}"
+        cached = self._get(key)
+        if cached and tag and cached[0] == tag:
+            return cached[1]
+
+        headers = {}
+        if cached and cached[0]:
+            headers["If-None-Match"] = cached[0]
+
+        url = f"/drives/{drive_id}/items/{item_id}/content"
+        response = graph_client.get(url, headers=headers, access_token=access_token)
+        if response.status_code == 304 and cached:
+            return cached[1]
+        if response.status_code == 404:
+            self.invalidate(drive_id, item_id)
+            raise ItemNotFound(f"Item {item_id} was not found in drive {drive_id}")
+        if response.status_code != 200:
+            raise Exception(f"Failed to download item {item_id}: {response.status_code}")
+
+        new_tag = tag or response.headers.get("ETag", "")
+        self._put(key, new_tag, response.content)
+        return response.content
+
+    def invalidate(self, drive_id, item_id):
+        key = f"{drive_id}/{item_id}"
+        with self._lock:
+            entry = self._memory.pop(key, None)
+            if entry:
+                self._memory_bytes -= len(entry[1])
+        for path in self._disk_paths(key):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                self._memory.move_to_end(key)
+                return entry
+
+        entry = self._read_disk(key)
+        if entry:
+            self._put_memory(key, *entry)
+        return entry
+
+    def _put(self, key, tag, content):
+        self._put_memory(key, tag, content)
+        try:
+            self._write_disk(key, tag, content)
+        except OSError as e:
+            logging.warning(f"Unable to write content cache entry {key}: {e}")
+
+    def _put_memory(self, key, tag, content):
+        if len(content) > self.max_memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous:
+                self._memory_bytes -= len(previous[1])
+            self._memory[key] = (tag, content)
+            self._memory_bytes += len(content)
+            while self._memory_bytes > self.max_memory_bytes:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _disk_paths(self, key):
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.directory / f"{name}.bin", self.directory / f"{name}.json"
+
+    def _read_disk(self, key):
+        content_path, meta_path = self._disk_paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            content = content_path.read_bytes()
+        except (OSError, ValueError):
+            return None
+
+        if meta.get("key") != key or meta.get("size") != len(content):
+            return None
+        os.utime(content_path)  # mtime doubles as the disk tier's LRU clock
+        return meta.get("tag", ""), content
+
+    def _write_disk(self, key, tag, content):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        content_path, meta_path = self._disk_paths(key)
+        self._atomic_write(content_path, content)
+        meta = {"key": key, "tag": tag, "size": len(content)}
+        self._atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+        self._evict_disk()
+
+    def _atomic_write(self, path, data):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def _evict_disk(self):
+        files = []
+        for path in self.directory.glob("*.bin"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # removed by another worker
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            path.with_suffix(".json").unlink(missing_ok=True)
+            total -= size
+
+
+content_cache = ContentCache()
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from decouple import config
+
+from .copilot_utils import initiate_conversation, initiate_session_copilot, refresh_directline_token
+
+
+class Conversation:
+    """A started Direct Line conversation and its token."""
+
+    def __init__(self, conv_id, token, expires_in_sec):
+        self.conv_id = conv_id
+        self.token = token
+        self.expires_at = time.time() + expires_in_sec
+
+    def ttl(self):
+        return self.expires_at - time.time()
+
+
+class ConversationPool:
+    """
+    Pool of pre-started Copilot Studio (Direct Line) conversations.
+
+    ``lease`` hands out a ready conversation, so a query only pays for sending the
+    message and receiving the answer. Conversations are single-use; a background
+    thread (started on the first lease) replaces leased ones and refreshes the tokens
+    of idle conversations before they expire. When the pool is empty a conversation is
+    started inline, exactly as before.
+    """
+
+    def __init__(self, size=None, refresh_margin_seconds=None, min_ttl_seconds=60):
+        self.size = size if size is not None else config("COPILOT_POOL_SIZE", default=2, cast=int)
+        self.refresh_margin_seconds = refresh_margin_seconds or config(
+            "COPILOT_TOKEN_REFRESH_MARGIN_SECONDS", default=300, cast=int)
+        self.min_ttl_seconds = min_ttl_seconds
+        self._ready = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def lease(self):
+        """Take a conversation out of the pool (starting one inline if none is ready)."""
+        if self.size <= 0:
+            return self._start_conversation()
+
+        self._ensure_started()
+        conversation = None
+        with self._lock:
+            while self._ready:
+                candidate = self._ready.popleft()
+                if candidate.ttl() > self.min_ttl_seconds:
+                    conversation = candidate
+                    break
+        self._wake.set()
+
+        if conversation is None:
+            logging.info("Copilot conversation pool is empty, starting a conversation inline")
+            conversation = self._start_conversation()
+        return conversation
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._maintain, name="copilot-pool", daemon=True)
+                self._thread.start()
+
+    def _maintain(self):
+        while True:
+            try:
+                self._refresh_expiring()
+                self._fill()
+            except Exception as e:
+                logging.warning(f"Copilot conversation pool maintenance failed: {e}")
+            self._wake.wait(timeout=self.refresh_margin_seconds / 2)
+            self._wake.clear()
+
+    def _fill(self):
+        while True:
+            with self._lock:
+                if len(self._ready) >= self.size:
+                    return
+            conversation = self._start_conversation()
+            with self._lock:
+                self._ready.append(conversation)
+
+    def _refresh_expiring(self):
+        with self._lock:
+            expiring = [conversation for conversation in self._ready
+                        if conversation.ttl() < self.refresh_margin_seconds]
+
+        for conversation in expiring:
+            try:
+                conversation.token, expires_in_sec = refresh_directline_token(conversation.token)
+                conversation.expires_at = time.time() + expires_in_sec
+            except Exception as e:
+                logging.info(f"Dropping Copilot conversation {conversation.conv_id}: {e}")
+                with self._lock:
+                    if conversation in self._ready:
+                        self._ready.remove(conversation)
+
+    def _start_conversation(self):
+        session = initiate_session_copilot()
+        if not session:
+            raise Exception("Unable to generate a Direct Line token")
+        (conv_id, token, expires_in_sec), _ = session
+        initiate_conversation(token)
+        return Conversation(conv_id, token, expires_in_sec)
+
+
+conversation_pool = ConversationPool()
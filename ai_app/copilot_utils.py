@@ -1,40 +1,47 @@
 import requests
 import time
 import json
+import logging
+import re
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from decouple import config
 from .common import log_execution_time
+from .metrics import span
+from .sqlite_cache import open_cache
+from .token_provider import get_access_token
 
-def get_access_token():
-    """
-    Generate an access token using client credentials flow.
-    """
-    tenant_id = config("TENANT_ID")
-    url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
-    data = {
-        'grant_type': 'client_credentials',
-        'client_id': config("CLIENT_ID"),
-        'client_secret':config("CLIENT_SECRET"),
-        'scope': 'https://graph.microsoft.com/.default',
-    }
-    response = requests.post(url, data=data)
-    if response.status_code == 200:
-        return response.json().get('access_token')
-    else:
-        raise Exception(f"Unable to get access token \n Error: {response.text}")
+DIRECTLINE_URL = "https://directline.botframework.com/v3/directline"
+USER_ID = "user1"
+
+SOLUTION_PLAYS_PROMPT = """
+    Solution plays: {solution_plays}
+    Give all helpful MS Docs learning links along with Technical Topics name related to these Solution plays
+    Make sure to add helpful links of relevant docs
+"""
+
+SOLUTION_PLAY_PROMPT = """
+    Solution play: {solution_play}
+    Give all helpful MS Docs learning links along with Technical Topics name related to this Solution play
+    Make sure to add helpful links of relevant docs
+"""
+
+_answer_cache = None
 
 
 # 1st step
 def initiate_session_copilot():
     """Initiates a session with an agent on copilot Studio"""
     try:
-        url = "https://directline.botframework.com/v3/directline/tokens/generate"
+        url = f"{DIRECTLINE_URL}/tokens/generate"
         direct_client_secret = config("DIRECT_CLIENT_SECRET")
 
         headers = {
             'Authorization': f'Bearer {direct_client_secret}'
         }
 
-        response = requests.request("POST", url, headers=headers)
+        with span("directline", "generate_token"):
+            response = requests.request("POST", url, headers=headers)
         response_json = response.json()
         if response.status_code == 200:
             conv_id = response_json["conversationId"]
@@ -50,11 +57,12 @@ def initiate_session_copilot():
 # 2nd step
 def initiate_conversation(token):
     try:
-        url = "https://directline.botframework.com/v3/directline/conversations"
+        url = f"{DIRECTLINE_URL}/conversations"
         headers = {
             'Authorization': f'Bearer {token}'
         }
-        response = requests.request("POST", url, headers=headers)
+        with span("directline", "start_conversation"):
+            response = requests.request("POST", url, headers=headers)
         response_json = response.json()
         if response.status_code == 201:
             return True
@@ -63,96 +71,232 @@ def initiate_conversation(token):
         raise e
 
 
+def refresh_directline_token(token):
+    """Extend a Direct Line conversation token; returns (token, expires_in_sec)."""
+    url = f"{DIRECTLINE_URL}/tokens/refresh"
+    headers = {
+        'Authorization': f'Bearer {token}'
+    }
+    with span("directline", "refresh_token"):
+        response = requests.request("POST", url, headers=headers)
+    if response.status_code != 200:
+        raise Exception(f"Failed to refresh the Direct Line token: {response.status_code}")
+    response_json = response.json()
+    return response_json["token"], response_json["expires_in"]
+
+
 # 3rd step
 def send_user_msg(token, conv_id, message, entra_id_access_token):
+    """Post the user's message; returns the activity id the bot's replies will refer to."""
     try:
-        url = f"https://directline.botframework.com/v3/directline/conversations/{conv_id}/activities"
+        url = f"{DIRECTLINE_URL}/conversations/{conv_id}/activities"
         headers = {
             'Authorization': f'Bearer {token}',
             "User.AccessToken":f'Bearer {entra_id_access_token}'
         }
+        # Direct Line only keeps our from.id (and so lets us skip the echo) with a lowercase "from"
         body = {
             "type": "message",
-            "From": {"id": "user1"},
-            "Activity": {"From": {"id": "user1"}},
+            "from": {"id": USER_ID},
             "text": f"{message}"
         }
-        response = requests.request("POST", url, json=body, headers=headers)
+        with span("directline", "send_message"):
+            response = requests.request("POST", url, json=body, headers=headers)
         response_json = response.json()
-        if response.status_code == 200:
-            return True
-        return False
+        if response.status_code == 200 and response_json.get("id"):
+            return response_json["id"]
+        raise Exception(f"Failed to send the message to Copilot: {response.status_code} {response.text}")
 
     except Exception as e:
         raise e
 
 
-# def get_response_from_bot(token, entra_id_access_token, conv_id):
-#     try:
-#         url = f"https://directline.botframework.com/v3/directline/conversations/{conv_id}/activities"
-#         headers = {
-#             'Authorization': f'Bearer {token}',
-#             # "User.AccessToken": f'Bearer {entra_id_access_token}'
-#         }
-#         requests.request("GET", url, headers=headers)
-#         time.sleep(4)
-#         response = requests.request("GET", url, headers=headers)
-#         time.sleep(3)
-#         response = requests.request("GET", url, headers=headers)
-#         time.sleep(3)
-#         if response.status_code == 200:
-#             time.sleep(2)
-#             activities = response.json().get('activities', [])
-#             print(len(activities))
-#             print(json.dumps(activities))
-#             if activities:
-#                 bot_response = str(activities[-2]["text"])
-#                 print(bot_response)
-#                 return bot_response, True
-#
-#         return "", False
-#     except Exception as e:
-#         raise e
-
-
-def get_response_from_bot(token, entra_id_access_token, conv_id):
+@log_execution_time
+def get_response_from_bot(token, entra_id_access_token, conv_id, activity_id=None, deadline_seconds=None):
+    """
+    Poll the conversation with the Direct Line ``watermark`` so every request only returns
+    new activities, and return as soon as the bot has answered the message ``activity_id``
+    (matched on ``replyToId``).
+
+    Polling starts at COPILOT_POLL_INITIAL_SECONDS and backs off up to COPILOT_POLL_MAX_SECONDS
+    while nothing new arrives. Once an answer is in, trailing bot messages are awaited for
+    COPILOT_SETTLE_SECONDS at most; an endOfConversation activity ends the wait at once.
+    The longest reply is the answer (follow-up prompts from the bot are short).
+    """
     try:
-        url = f"https://directline.botframework.com/v3/directline/conversations/{conv_id}/activities"
+        url = f"{DIRECTLINE_URL}/conversations/{conv_id}/activities"
         headers = {
             'Authorization': f'Bearer {token}',
-            # "User.AccessToken": f'Bearer {entra_id_access_token}'
         }
+        deadline = time.monotonic() + (deadline_seconds or config(
+            "COPILOT_RESPONSE_DEADLINE_SECONDS", default=60, cast=float))
+        initial_delay = config("COPILOT_POLL_INITIAL_SECONDS", default=0.5, cast=float)
+        max_delay = config("COPILOT_POLL_MAX_SECONDS", default=3, cast=float)
+        settle_seconds = config("COPILOT_SETTLE_SECONDS", default=1.0, cast=float)
 
-        attempts = 0
-        while attempts < 10:
-            print(attempts)
-            response = requests.request("GET", url, headers=headers)
-            time.sleep(3)  # Pause between requests
-            if response.status_code == 200:
-                activities = response.json().get('activities', [])
-                if len(activities) == 9:
-                    bot_response = str(activities[-2]["text"])
-                    print(bot_response)
-                    return bot_response, True
-            attempts += 1
-
-        # If the desired condition is not met within 10 attempts
-        return "", False
+        watermark = None
+        replies = []
+        last_reply_at = None
+        delay = initial_delay
+
+        with requests.Session() as session:
+            while time.monotonic() < deadline:
+                params = {"watermark": watermark} if watermark else None
+                with span("directline", "poll"):
+                    response = session.get(url, headers=headers, params=params, timeout=10)
+                if response.status_code == 200:
+                    response_json = response.json()
+                    watermark = response_json.get("watermark", watermark)
+                    # Skip the echo of our own message, by sender and by id
+                    activities = [activity for activity in response_json.get("activities", [])
+                                  if activity.get("from", {}).get("id") != USER_ID
+                                  and (activity_id is None or activity.get("id") != activity_id)]
+
+                    if activities:
+                        delay = initial_delay
+                    for activity in activities:
+                        if activity.get("type") == "endOfConversation":
+                            return _pick_reply(replies)
+                        if activity_id and activity.get("replyToId") != activity_id:
+                            continue
+                        if activity.get("type") == "message" and activity.get("text"):
+                            replies.append(str(activity["text"]))
+                            last_reply_at = time.monotonic()
+                        elif activity.get("type") == "typing" and last_reply_at:
+                            last_reply_at = time.monotonic()  # more is coming
+
+                if last_reply_at and time.monotonic() - last_reply_at >= settle_seconds:
+                    return _pick_reply(replies)
+
+                time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+                delay = min(delay * 1.5, max_delay)
+
+        logging.warning(f"No complete bot response for conversation {conv_id} before the deadline")
+        return _pick_reply(replies)
     except Exception as e:
         raise e
 
 
+def _pick_reply(replies):
+    if not replies:
+        return "", False
+    return max(replies, key=len), True
+
+
 @log_execution_time
 def complete_process(message):
     try:
-        response_list, success = initiate_session_copilot()
-        conv_id, token, expires_in_sec = response_list[0], response_list[1], response_list[2]
-        conv_started = initiate_conversation(token)
+        from .copilot_pool import conversation_pool
+
+        # A pre-started conversation, so only the send and receive round trips remain
+        conversation = conversation_pool.lease()
         entra_id_access_token = get_access_token()
-        send_user_msg(token, conv_id, message, entra_id_access_token)
-        time.sleep(3)
-        bot_response, success = get_response_from_bot(token, entra_id_access_token, conv_id)
-        return bot_response, True
+        activity_id = send_user_msg(conversation.token, conversation.conv_id, message, entra_id_access_token)
+        if not activity_id:
+            # Without it the bot's answer cannot be told apart from the echoed question
+            return "Copilot did not return an activity id for the message", False
+        bot_response, success = get_response_from_bot(conversation.token, entra_id_access_token,
+                                                       conversation.conv_id, activity_id)
+        return bot_response, success
+
+    except Exception as e:
+        return str(e), False
+
+
+def get_answer_cache():
+    """Per solution play Copilot answers shared by the workers (created lazily)."""
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = open_cache(
+            "llm_cache.sqlite3", "copilot_answers",
+            ttl_seconds=config("COPILOT_ANSWER_TTL_SECONDS", default=7 * 24 * 3600, cast=int),
+            max_entries=config("COPILOT_ANSWER_MAX_ENTRIES", default=1000, cast=int),
+        )
+    return _answer_cache
+
+
+def parse_solution_plays(solution_plays):
+    """The list of plays from the {"SolutionPlays": [...]} JSON returned by gpt_response_for_sp."""
+    try:
+        data = json.loads(solution_plays) if isinstance(solution_plays, str) else solution_plays
+    except ValueError:
+        return [solution_plays]
+    if isinstance(data, dict):
+        data = data.get("SolutionPlays", next(iter(data.values()), []))
+    if isinstance(data, str):
+        data = [data]
+    return list(dict.fromkeys(str(play).strip() for play in data or [] if str(play).strip()))
+
+
+def get_solution_play_answer(solution_play):
+    """Copilot answer for one solution play, reused across projects until it expires."""
+    key = " ".join(solution_play.lower().split())
+    cached = get_answer_cache().get(key)
+    if cached is not None:
+        return cached
 
+    bot_response, success = complete_process(SOLUTION_PLAY_PROMPT.format(solution_play=solution_play))
+    if success and bot_response:
+        get_answer_cache().set(key, bot_response)
+    return bot_response if success else ""
+
+
+def merge_copilot_answers(solution_plays, answers):
+    """One section per play; lines whose links all appeared in an earlier section are dropped."""
+    seen_links = set()
+    sections = []
+    for solution_play, answer in zip(solution_plays, answers):
+        lines = []
+        for line in (answer or "").splitlines():
+            links = {_normalize_link(link) for link in re.findall(r'https?://[^\s)\]>"\']+', line)}
+            if links and links <= seen_links:
+                continue
+            seen_links |= links
+            lines.append(line)
+        if any(line.strip() for line in lines):
+            sections.append(f"{solution_play}:\n" + "\n".join(lines))
+    return "\n\n".join(sections)
+
+
+def _normalize_link(link):
+    return link.rstrip('.,;:').split("#")[0].rstrip("/").lower()
+
+
+@log_execution_time
+def complete_process_for_solution_plays(solution_plays, failed_plays=None):
+    """
+    Ask Copilot for the MS Docs links of the solution plays.
+
+    With COPILOT_FANOUT (default on) every play gets its own conversation, at most
+    COPILOT_FANOUT_CONCURRENCY at a time, and the short answers are merged, instead of
+    one long answer for all plays. Returns (bot_response, success) like complete_process;
+    success is False when no play got an answer. Plays without an answer are logged and,
+    when ``failed_plays`` is a list, appended to it.
+    """
+    plays = parse_solution_plays(solution_plays)
+    if not config("COPILOT_FANOUT", default=True, cast=bool) or len(plays) <= 1:
+        bot_response, success = complete_process(SOLUTION_PLAYS_PROMPT.format(solution_plays=solution_plays))
+        if not success and failed_plays is not None:
+            failed_plays.extend(plays)
+        return bot_response, success
+
+    try:
+        concurrency = config("COPILOT_FANOUT_CONCURRENCY", default=4, cast=int)
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="copilot-play") as executor:
+            # Each query runs in a copy of the caller's context (metrics endpoint label)
+            futures = [executor.submit(contextvars.copy_context().run, get_solution_play_answer, play)
+                       for play in plays]
+            answers = [future.result() for future in futures]
     except Exception as e:
+        if failed_plays is not None:
+            failed_plays.extend(plays)
         return str(e), False
+
+    failed = [play for play, answer in zip(plays, answers) if not answer]
+    if failed:
+        logging.warning(f"No Copilot answer for {len(failed)} of {len(plays)} solution plays: {', '.join(failed)}")
+        if failed_plays is not None:
+            failed_plays.extend(failed)
+    if len(failed) == len(plays):
+        return "Copilot did not answer any solution play", False
+    return merge_copilot_answers(plays, answers), True
@@ -1,33 +1,81 @@
-import json
+import threading
+
+from decouple import config
+
+from .price_catalog import get_price_catalog
+from .price_store import PriceStore
+from .price_table import PriceTable
+from .service_resolver import ServiceResolver
+
+price_store = PriceStore()
+
+
+def get_price_source(file_path="cost_estimation.json"):
+    """
+    The full price store once ingest_azure_prices has populated it, otherwise the
+    catalog of the bundled price file.
+    """
+    if config("PRICE_STORE_ENABLED", default=True, cast=bool) and price_store.status()[0]:
+        return price_store
+    return get_price_catalog(file_path)
+
+
+# Service price tables kept per process; each holds one service's rows of the price source
+PRICE_TABLE_MAX_SERVICES = config("PRICE_TABLE_MAX_SERVICES", default=32, cast=int)
+
+_derived = {}  # key -> (price source, store run, value)
+_derived_lock = threading.Lock()
+
+
+def _per_source(key, build, file_path, max_entries=None):
+    """
+    ``build(source)`` for the current price source, built once and rebuilt only when the
+    catalog file changes or a new ingestion run completes. With ``max_entries`` the
+    oldest entries of the same kind (``key[0]``) are dropped beyond that number.
+    """
+    source = get_price_source(file_path)
+    run = price_store.status()[1] if source is price_store else None
+    with _derived_lock:
+        cached = _derived.pop(key, None)
+        if cached is None or cached[0] is not source or cached[1] != run:
+            cached = (source, run, build(source))
+        _derived[key] = cached  # most recently used last
+        if max_entries is not None:
+            same_kind = [other for other in _derived if other[0] == key[0]]
+            for other in same_kind[:max(len(same_kind) - max_entries, 0)]:
+                del _derived[other]
+        return cached[2]
+
+
+def get_service_resolver(file_path="cost_estimation.json"):
+    """The service-name resolver over the current price source's vocabulary."""
+    return _per_source(("resolver",), ServiceResolver.from_source, file_path)
+
+
+def get_price_table(service_name, file_path="cost_estimation.json"):
+    """
+    The columnar table of one service's prices in the current price source. Only services
+    being priced are loaded, and at most PRICE_TABLE_MAX_SERVICES tables are kept, so a
+    worker's memory is bounded by the largest services it prices rather than the store.
+    """
+    return _per_source(("price_table", service_name), lambda source: PriceTable.from_source(source, service_name),
+                       file_path, max_entries=PRICE_TABLE_MAX_SERVICES)
 
 
 def get_service_app_records(file_path="cost_estimation.json",
                             concerned_regions=["East US", "East US 2", "Central US"],
                             service_name="Azure App Service"):
     """
-    Reads a JSON file (cost_estimation.json) and retrieves records for the specified service
+    Looks up, in the ingested price store (or the catalog of cost_estimation.json), the records for the specified service
     (default "Azure App Service") that belong to one of the concerned regions.
 
-    :param file_path: Path to the JSON file.
+    :param file_path: Path to the JSON file used when the price store has not been ingested.
     :param concerned_regions: List of region strings (e.g. ["East US", "East US 2", "Central US"]).
     :param service_name: The service to filter by (default "Azure App Service").
     :return: List of filtered records.
     """
-    # Normalize concerned regions for comparison (e.g. "East US" -> "eastus")
-    normalized_regions = {region.replace(" ", "").lower() for region in concerned_regions}
-
-    matching_records = []
-
-    with open(file_path, "r") as f:
-        data = json.load(f)  # Load entire JSON into memory
-
-        # Ensure "Items" key exists and is a list
-        for item in data.get("Items", []):
-            if item.get("serviceName") == service_name and item.get("armRegionName", "").replace(" ",
-                                                                                                 "").lower() in normalized_regions:
-                matching_records.append(item)
-
-    return matching_records
+    # Indexed lookups: the SQLite price store, or the JSON catalog parsed once per process
+    return get_price_source(file_path).find(service_name=service_name, regions=concerned_regions)
 
 
 # Example usage
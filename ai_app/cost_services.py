@@ -0,0 +1,90 @@
+import hashlib
+import json
+import logging
+
+import jsonschema
+from decouple import config
+
+from .sqlite_cache import open_cache
+
+# Bump to invalidate cached services lists, e.g. after changing the cost estimation prompt
+COST_SERVICES_VERSION = config("COST_SERVICES_VERSION", default="1")
+
+# A questionnaire naming at least this many catalog services skips the LLM call
+COST_SERVICES_MIN_NAMED = config("COST_SERVICES_MIN_NAMED", default=3, cast=int)
+
+SERVICES_LIST_SCHEMA = {
+    "type": "object",
+    "required": ["servicesList"],
+    "properties": {
+        "servicesList": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["serviceName"],
+                "properties": {
+                    "serviceName": {"type": "string", "minLength": 1},
+                    "skuName": {"type": ["string", "null"]},
+                    "region": {"type": ["string", "null"]},
+                    "tier": {"type": ["string", "null"]},
+                },
+            },
+        },
+    },
+}
+
+_services_cache = None
+
+
+def get_services_cache():
+    """Services lists per questionnaire shared by the workers (created lazily)."""
+    global _services_cache
+    if _services_cache is None:
+        _services_cache = open_cache(
+            "llm_cache.sqlite3", "cost_services",
+            ttl_seconds=config("COST_SERVICES_TTL_SECONDS", default=7 * 24 * 3600, cast=int),
+            max_entries=config("COST_SERVICES_MAX_ENTRIES", default=1000, cast=int),
+        )
+    return _services_cache
+
+
+def questionnaire_hash(questionnaire_content, resolver_version=""):
+    data = f"{COST_SERVICES_VERSION}\n{resolver_version}\n{questionnaire_content}"
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def parse_services_list(content):
+    """The servicesList of the model's JSON response, validated against SERVICES_LIST_SCHEMA."""
+    try:
+        data = json.loads(content)
+        jsonschema.validate(data, SERVICES_LIST_SCHEMA)
+    except json.JSONDecodeError as e:
+        raise Exception(f"Services list is not valid JSON: {e}")
+    except jsonschema.ValidationError as e:
+        raise Exception(f"Services list does not match the schema: {e.message}")
+    return data["servicesList"]
+
+
+def get_services_list(questionnaire_content, resolver, ask_model):
+    """
+    The services to price for a questionnaire, cached by its content hash and the
+    resolver's version (its catalog vocabulary and matching rules).
+
+    Services the questionnaire names verbatim are found by ``resolver.find_mentions``;
+    when there are at least COST_SERVICES_MIN_NAMED of them they are used as they are,
+    otherwise ``ask_model(named_services)`` returns the (validated) list.
+    """
+    key = questionnaire_hash(questionnaire_content, resolver.version)
+    services_objects = get_services_cache().get(key)
+    if services_objects is not None:
+        return services_objects
+
+    named_services = resolver.find_mentions(questionnaire_content)
+    if len(named_services) >= COST_SERVICES_MIN_NAMED:
+        logging.info(f"Questionnaire names {len(named_services)} services, skipping the services list request")
+        services_objects = [{"serviceName": service} for service in named_services]
+    else:
+        services_objects = ask_model(named_services)
+
+    get_services_cache().set(key, services_objects)
+    return services_objects
@@ -309,7 +309,7 @@ def generate_openai_response(placeholders, access_token, project_id, initial_for
             Example of desired JSON output: {{"Placeholder1": "Actual Value 1", "Placeholder2": "More Info Here"}}
         """
 
-    response_dict = eval(CommonUtils.gpt_response_json(client, prompt))
+    response_dict = eval(CommonUtils.gpt_response_json(client, prompt, use_cache=False))
     response_dict = {key: str(val) for key,val in response_dict.items()}
     return response_dict
 
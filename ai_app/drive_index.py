@@ -0,0 +1,133 @@
+import logging
+import re
+import threading
+from datetime import timedelta
+
+from decouple import config
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .graph_client import graph_client
+from .models import DriveDeltaState, DriveItemIndex
+
+# Incremental delta syncs are cheap, so refresh the index before a lookup once it is this old
+INDEX_MAX_AGE = timedelta(seconds=config("DRIVE_INDEX_MAX_AGE_SECONDS", default=60, cast=int))
+
+_sync_locks = {}
+_sync_locks_guard = threading.Lock()
+
+
+def parse_project_id(file_name, delimiter):
+    """
+    Extract the project id from names like 'Discovery Questionnaire-70.docx' (delimiter '-').
+    Returns None when the name does not carry one.
+    """
+    split_name_list = file_name.split(delimiter)
+    if len(split_name_list) < 2:
+        return None
+    numbers = re.findall(r"\d+", split_name_list[1])
+    if not numbers:
+        return None
+    return str(int(numbers[0]))
+
+
+def sync_drive(drive_id, delimiter, access_token=None):
+    """
+    Bring the index for one drive up to date using Graph delta queries.
+
+    The first sync walks the whole drive (following @odata.nextLink); later syncs resume
+    from the stored deltaLink and only receive changed or deleted items.
+    """
+    with _lock_for(drive_id):
+        state, _ = DriveDeltaState.objects.get_or_create(drive_id=drive_id)
+        url = state.delta_link or f"/drives/{drive_id}/root/delta"
+
+        while url:
+            response = graph_client.get(url, access_token=access_token)
+            if response.status_code == 410:
+                # The delta token expired, start over from a full enumeration
+                logging.info(f"Delta token for drive {drive_id} expired, resyncing")
+                DriveItemIndex.objects.filter(drive_id=drive_id).delete()
+                url = f"/drives/{drive_id}/root/delta"
+                continue
+            if response.status_code != 200:
+                raise Exception(f"Failed to sync drive {drive_id}: {response.text}")
+
+            page = response.json()
+            _apply_changes(drive_id, delimiter, page.get("value", []))
+
+            url = page.get("@odata.nextLink")
+            if "@odata.deltaLink" in page:
+                state.delta_link = page["@odata.deltaLink"]
+                state.save()
+
+
+def _apply_changes(drive_id, delimiter, items):
+    with transaction.atomic():
+        for item in items:
+            if "deleted" in item:
+                DriveItemIndex.objects.filter(drive_id=drive_id, item_id=item["id"]).delete()
+                continue
+
+            if "file" not in item or not item.get("name"):
+                continue
+
+            project_id = parse_project_id(item["name"], delimiter)
+            if project_id is None:
+                continue
+
+            last_modified = parse_datetime(item.get("lastModifiedDateTime", "") or "")
+            existing = DriveItemIndex.objects.filter(drive_id=drive_id, project_id=project_id).first()
+            if (existing and existing.item_id != item["id"] and existing.last_modified and last_modified
+                    and existing.last_modified > last_modified):
+                # Keep the most recently modified file when several belong to one project
+                continue
+
+            # A renamed file may have moved to another project
+            DriveItemIndex.objects.filter(drive_id=drive_id, item_id=item["id"]).exclude(
+                project_id=project_id).delete()
+
+            DriveItemIndex.objects.update_or_create(
+                drive_id=drive_id,
+                project_id=project_id,
+                defaults={
+                    "item_id": item["id"],
+                    "name": item["name"],
+                    "etag": item.get("eTag", ""),
+                    "ctag": item.get("cTag", ""),
+                    "last_modified": last_modified,
+                },
+            )
+
+
+class ProjectFileNotFound(Exception):
+    """The drive has no file for the project, even after a sync."""
+
+
+def lookup(drive_id, project_id, delimiter, access_token=None):
+    """
+    Return the DriveItemIndex entry for a project.
+
+    The drive is only synced when the index is older than DRIVE_INDEX_MAX_AGE_SECONDS or
+    the project is missing, and then only the changes since the last deltaLink are read.
+    Raises ProjectFileNotFound when the drive has no file for the project.
+    """
+    project_id = str(int(project_id))
+    state = DriveDeltaState.objects.filter(drive_id=drive_id).first()
+    if state is None or not state.delta_link or timezone.now() - state.synced_at > INDEX_MAX_AGE:
+        sync_drive(drive_id, delimiter, access_token=access_token)
+
+    entry = DriveItemIndex.objects.filter(drive_id=drive_id, project_id=project_id).first()
+    if entry is None:
+        sync_drive(drive_id, delimiter, access_token=access_token)
+        entry = DriveItemIndex.objects.filter(drive_id=drive_id, project_id=project_id).first()
+
+    if entry is None:
+        raise ProjectFileNotFound(f"No file found in drive {drive_id} for project ID: {project_id}")
+    return entry
+
+
+def _lock_for(drive_id):
+    with _sync_locks_guard:
+        return _sync_locks.setdefault(drive_id, threading.Lock())
@@ -0,0 +1,293 @@
+import email.utils
+import logging
+import random
+import time
+
+import requests
+from decouple import config
+from requests.adapters import HTTPAdapter
+
+from .metrics import span
+from .token_provider import GRAPH_SCOPE, token_provider
+
+GRAPH_BASE_URL = "https://graph.microsoft.com/v1.0"
+
+# Graph throttling / transient unavailability, both come with a Retry-After header
+RETRY_STATUS_CODES = {429, 503}
+
+# Graph accepts at most 20 sub-requests per $batch call
+MAX_BATCH_SIZE = 20
+
+
+class GraphClient:
+    """
+    Pooled, keep-alive HTTP client for Microsoft Graph (and SharePoint download URLs).
+
+    One client is shared by the whole process so TCP/TLS connections are reused across
+    calls. Every call gets a timeout, 429/503 responses are retried honouring Graph's
+    ``Retry-After`` header, and a 401 triggers one retry with a freshly issued token.
+    Set ``GRAPH_HTTP2=True`` to use httpx with HTTP/2 when ``h2`` is installed.
+    """
+
+    def __init__(self, base_url=GRAPH_BASE_URL, timeout=None, max_retries=None,
+                 pool_size=None, http2=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout or config("GRAPH_TIMEOUT_SECONDS", default=60, cast=float)
+        self.max_retries = max_retries if max_retries is not None else config(
+            "GRAPH_MAX_RETRIES", default=4, cast=int)
+        self.max_retry_after = config("GRAPH_MAX_RETRY_AFTER_SECONDS", default=60, cast=float)
+        pool_size = pool_size or config("GRAPH_POOL_SIZE", default=20, cast=int)
+        http2 = http2 if http2 is not None else config("GRAPH_HTTP2", default=False, cast=bool)
+
+        self.is_httpx = False
+        self._session = None
+        if http2:
+            self._session = self._build_httpx_client(pool_size)
+        if self._session is None:
+            self._session = self._build_requests_session(pool_size)
+
+    @staticmethod
+    def _build_requests_session(pool_size):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _build_httpx_client(self, pool_size):
+        try:
+            import httpx
+            import h2  # noqa: F401  (httpx silently needs it for http2=True)
+        except ImportError:
+            logging.warning("GRAPH_HTTP2 is enabled but httpx[http2] is not installed, using requests")
+            return None
+
+        self.is_httpx = True
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        return httpx.Client(http2=True, limits=limits, follow_redirects=True)
+
+    def url(self, path):
+        """Turn a Graph path like '/drives/{id}/items/{id}' into an absolute URL."""
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, headers=None, params=None, json=None, data=None,
+                timeout=None, access_token=None, authenticate=True):
+        """
+        Send a request and return the response (requests or httpx, same basic interface).
+
+        :param access_token: Token to send; the shared token provider is used when omitted.
+        :param authenticate: False for pre-authenticated URLs such as downloadUrl.
+        """
+        with span("graph", method.upper()):
+            return self._request(method, path, headers, params, json, data, timeout, access_token, authenticate)
+
+    def _request(self, method, path, headers, params, json, data, timeout, access_token, authenticate):
+        url = self.url(path)
+        refreshed_token = False
+        attempt = 0
+
+        while True:
+            request_headers = dict(headers or {})
+            if authenticate:
+                token = access_token or token_provider.get_token(GRAPH_SCOPE)
+                request_headers["Authorization"] = f"Bearer {token}"
+
+            response = self._send(method, url, request_headers, params, json, data,
+                                  timeout or self.timeout)
+
+            if response.status_code == 401 and authenticate and not refreshed_token:
+                # The caller's token may have expired during a long pipeline run
+                token_provider.invalidate(GRAPH_SCOPE)
+                access_token = None
+                refreshed_token = True
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                delay = self._retry_delay(response, attempt)
+                logging.info(f"Graph returned {response.status_code} for {method} {url}, "
+                             f"retrying in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            return response
+
+    def _send(self, method, url, headers, params, json, data, timeout):
+        if self.is_httpx:
+            kwargs = {"headers": headers, "params": params, "json": json, "timeout": timeout}
+            if isinstance(data, (bytes, bytearray, str)):
+                kwargs["content"] = data
+            elif data is not None:
+                kwargs["data"] = data
+            return self._session.request(method, url, **kwargs)
+
+        return self._session.request(method, url, headers=headers, params=params, json=json,
+                                     data=data, timeout=timeout)
+
+    def _retry_delay(self, response, attempt):
+        retry_after = response.headers.get("Retry-After")
+        delay = None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                # Retry-After may also be an HTTP date
+                try:
+                    delay = email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    delay = None
+        if delay is None:
+            delay = (2 ** attempt) + random.uniform(0, 1)
+        return min(max(delay, 0), self.max_retry_after)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request("PATCH", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def batch(self):
+        """Start a new ``$batch`` request, see :class:`GraphBatch`."""
+        return GraphBatch(self)
+
+
+class BatchResponse:
+    """One sub-response of a Graph ``$batch`` call, shaped like a regular HTTP response."""
+
+    def __init__(self, payload):
+        self.id = payload.get("id")
+        self.status_code = payload.get("status")
+        self.headers = payload.get("headers") or {}
+        self.body = payload.get("body")
+
+    @property
+    def ok(self):
+        return self.status_code is not None and 200 <= self.status_code < 300
+
+    def json(self):
+        return self.body
+
+    @property
+    def text(self):
+        return str(self.body)
+
+
+class GraphBatch:
+    """
+    Collects Graph sub-requests and sends them as JSON ``$batch`` calls of up to 20.
+
+    Requests chained with ``depends_on`` are always packed into the same batch (Graph
+    only resolves ``dependsOn`` inside one batch) and run in order; everything else
+    runs in parallel on the Graph side. Throttled sub-requests are retried.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._requests = []
+
+    def __len__(self):
+        return len(self._requests)
+
+    def add(self, method, path, body=None, headers=None, depends_on=None):
+        """Queue a sub-request and return its id, used to read the result or as a dependency."""
+        request_id = str(len(self._requests) + 1)
+        sub_request = {"id": request_id, "method": method, "url": self._relative_url(path)}
+
+        if body is not None:
+            sub_request["body"] = body
+            headers = {"Content-Type": "application/json", **(headers or {})}
+        if headers:
+            sub_request["headers"] = headers
+        if depends_on:
+            sub_request["dependsOn"] = [depends_on] if isinstance(depends_on, str) else list(depends_on)
+
+        self._requests.append(sub_request)
+        return request_id
+
+    def execute(self, access_token=None):
+        """Send all queued sub-requests and return ``{request_id: BatchResponse}``."""
+        results = {}
+        pending = list(self._requests)
+        attempt = 0
+
+        while pending:
+            for chunk in self._chunks(pending):
+                response = self.client.post("/$batch", json={"requests": chunk}, access_token=access_token)
+                if response.status_code != 200:
+                    raise Exception(f"Graph batch request failed: {response.text}")
+                for payload in response.json().get("responses", []):
+                    results[payload["id"]] = BatchResponse(payload)
+
+            # 424 = a dependency failed, usually because it was throttled itself
+            retry_ids = {request_id for request_id, result in results.items()
+                         if result.status_code in RETRY_STATUS_CODES | {424}}
+            if not retry_ids or attempt >= self.client.max_retries:
+                break
+
+            delays = [self.client._retry_delay(results[request_id], attempt) for request_id in retry_ids
+                      if results[request_id].status_code in RETRY_STATUS_CODES]
+            time.sleep(max(delays, default=0))
+            pending = [self._without_finished_dependencies(r, retry_ids) for r in self._requests
+                       if r["id"] in retry_ids]
+            attempt += 1
+
+        return results
+
+    def _relative_url(self, path):
+        url = self.client.url(path)
+        return url[len(self.client.base_url):] if url.startswith(self.client.base_url) else url
+
+    @staticmethod
+    def _without_finished_dependencies(sub_request, retry_ids):
+        sub_request = dict(sub_request)
+        depends_on = [d for d in sub_request.get("dependsOn", []) if d in retry_ids]
+        if depends_on:
+            sub_request["dependsOn"] = depends_on
+        else:
+            sub_request.pop("dependsOn", None)
+        return sub_request
+
+    @staticmethod
+    def _chunks(sub_requests):
+        # Group dependency chains together, then pack the groups into batches of 20
+        group_of = {}
+        groups = []
+        for sub_request in sub_requests:
+            group = []
+            for dependency in sub_request.get("dependsOn", []):
+                dependency_group = group_of.get(dependency)
+                if dependency_group is None or dependency_group is group:
+                    continue
+                # Merge chains that meet in this request
+                group.extend(dependency_group)
+                groups = [g for g in groups if g is not dependency_group]
+                for merged in dependency_group:
+                    group_of[merged["id"]] = group
+            groups.append(group)
+            group.append(sub_request)
+            group_of[sub_request["id"]] = group
+
+        chunk = []
+        for group in groups:
+            if len(group) > MAX_BATCH_SIZE:
+                raise ValueError(f"A chain of dependent requests cannot exceed {MAX_BATCH_SIZE} requests")
+            if len(chunk) + len(group) > MAX_BATCH_SIZE:
+                yield chunk
+                chunk = []
+            chunk.extend(group)
+        if chunk:
+            yield chunk
+
+
+graph_client = GraphClient()
@@ -0,0 +1,132 @@
+import hashlib
+import math
+import re
+
+import lxml.html
+from lxml import etree
+from decouple import config
+
+# Elements that never carry article text
+BOILERPLATE_TAGS = ["script", "style", "noscript", "nav", "header", "footer", "aside", "form", "iframe",
+                    "svg", "button", "template", "select", "input"]
+
+BOILERPLATE_ROLES = {"navigation", "banner", "contentinfo", "complementary", "search", "dialog"}
+
+# Whole words of class/id values used for navigation, feedback and cookie widgets (MS Learn
+# and common CMSes); "share-button" matches, "sharepoint-limits" and "protocol" do not
+BOILERPLATE_PATTERN = re.compile(
+    r"\b(?:breadcrumbs?|sidebar|side-nav|navbar|nav-bar|toc|table-of-contents|feedback|cookie|consent|"
+    r"footer|header|banner|share|social|related|recommended|advert|promo|skip-link|visually-hidden)\b",
+    re.IGNORECASE,
+)
+
+# Headings and sections get their ids from their own text, so only their class is checked
+TEXT_ID_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6", "section"}
+
+MAIN_CONTENT_XPATHS = ["//main", "//article", "//*[@role='main']", "//*[@id='main']", "//*[@id='content']"]
+
+BLOCK_TAGS = {"p", "li", "pre", "blockquote", "td", "th", "dt", "dd", "h1", "h2", "h3", "h4", "h5", "h6"}
+
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+
+
+def estimate_tokens(text):
+    """Rough token count of a text (about four characters per token for English)."""
+    return math.ceil(len(text) / 4)
+
+
+def compact_text(text, max_tokens=None):
+    """Collapse whitespace, drop repeated lines and cap the text at max_tokens."""
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    return _join_blocks(lines, max_tokens)
+
+
+def extract_main_content(html, max_tokens=None):
+    """
+    Reduce an HTML page to the text of its main article.
+
+    Scripts, navigation and other boilerplate are removed, the main content element is
+    selected (``<main>``/``<article>``, or the body as a fallback), repeated blocks are
+    dropped and the result is capped at max_tokens (HTML_MAX_TOKENS).
+    Returns (text, stats) where stats holds the estimated tokens before and after.
+    """
+    original_tokens = estimate_tokens(html)
+    try:
+        document = lxml.html.document_fromstring(html)
+    except (ValueError, etree.ParserError):
+        text = compact_text(html, max_tokens)
+        return text, _stats(original_tokens, text)
+
+    for element in list(document.iter(*BOILERPLATE_TAGS)):
+        element.drop_tree()
+    root = _main_content_element(document)
+    _strip_boilerplate(root)
+
+    blocks = []
+    for element in root.iter(*BLOCK_TAGS):
+        if any(ancestor.tag in BLOCK_TAGS for ancestor in element.iterancestors()):
+            continue  # the text is already part of the outer block
+        block = " ".join(element.text_content().split())
+        if element.tag in HEADING_TAGS and block:
+            block = "#" * int(element.tag[1]) + " " + block
+        blocks.append(block)
+
+    if not any(blocks):
+        blocks = [" ".join(line.split()) for line in root.text_content().splitlines()]
+
+    text = _join_blocks(blocks, max_tokens)
+    return text, _stats(original_tokens, text)
+
+
+def _strip_boilerplate(root):
+    """Drop navigation/feedback widgets inside the main content element (never the element itself)."""
+    for element in list(root.iterdescendants()):
+        if not isinstance(element.tag, str):
+            continue
+        if element.get("role") in BOILERPLATE_ROLES or element.get("hidden") is not None \
+                or element.get("aria-hidden") == "true":
+            element.drop_tree()
+            continue
+        markers = element.get("class", "").split()
+        if element.tag not in TEXT_ID_TAGS and element.get("id"):
+            markers.append(element.get("id"))
+        if any(BOILERPLATE_PATTERN.search(marker) for marker in markers):
+            element.drop_tree()
+
+
+def _main_content_element(document):
+    candidates = []
+    for xpath in MAIN_CONTENT_XPATHS:
+        candidates.extend(document.xpath(xpath))
+    if not candidates:
+        return document.body if document.find("body") is not None else document
+    return max(candidates, key=lambda element: len(element.text_content()))
+
+
+def _join_blocks(blocks, max_tokens=None):
+    max_tokens = max_tokens or config("HTML_MAX_TOKENS", default=3000, cast=int)
+    seen = set()
+    kept = []
+    tokens = 0
+    for block in blocks:
+        if len(block) < 3:
+            continue
+        fingerprint = hashlib.sha1(block.lower().encode("utf-8")).digest()
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+
+        block_tokens = estimate_tokens(block) + 1
+        if tokens + block_tokens > max_tokens:
+            remaining = (max_tokens - tokens) * 4
+            if remaining > 100:
+                kept.append(block[:remaining].rsplit(" ", 1)[0] + " ...")
+            break
+        kept.append(block)
+        tokens += block_tokens
+    return "\n".join(kept)
+
+
+def _stats(original_tokens, text):
+    tokens = estimate_tokens(text)
+    return {"original_tokens": original_tokens, "tokens": tokens, "saved_tokens": max(original_tokens - tokens, 0)}
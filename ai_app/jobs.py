@@ -0,0 +1,210 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from decouple import config
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .metrics import current_endpoint
+from .models import Job
+from .status_writer import status_writer
+
+# Job kind -> function(job) returning a JSON-serialisable result
+JOB_HANDLERS = {
+    "wbs": "ai_app.views.run_wbs_job",
+    "sow": "ai_app.views.run_sow_job",
+    "discovery_questionnaire": "ai_app.views.run_discovery_questionnaire_job",
+}
+
+HEARTBEAT_SECONDS = config("JOB_HEARTBEAT_SECONDS", default=30, cast=int)
+
+# A running job whose worker has not sent a heartbeat for this long is considered dead
+STALE_AFTER = timedelta(seconds=config("JOB_STALE_SECONDS", default=300, cast=int))
+
+MAX_ATTEMPTS = config("JOB_MAX_ATTEMPTS", default=2, cast=int)
+
+# Identical requests arriving this soon after a job succeeded get its result instead of a new run
+RESULT_MEMO = timedelta(seconds=config("JOB_RESULT_MEMO_SECONDS", default=120, cast=int))
+
+
+def enqueue(kind, payload):
+    """
+    Queue a job for the run_jobs workers, unless an identical request (same kind and
+    payload) is already queued or running, or succeeded less than JOB_RESULT_MEMO_SECONDS
+    ago; that job is returned instead, so double submits and retries share one execution.
+    Returns (job, created).
+    """
+    if kind not in JOB_HANDLERS:
+        raise Exception(f"Unknown job kind: {kind}")
+
+    dedup_key = request_key(kind, payload)
+    # A job left RUNNING by a killed request or worker must not absorb new requests
+    requeue_stale(dedup_key)
+    existing = find_duplicate(dedup_key)
+    if existing:
+        logging.info(f"Attached request to {existing}")
+        return existing, False
+
+    try:
+        with transaction.atomic():
+            job = Job.objects.create(kind=kind, payload=payload, dedup_key=dedup_key)
+    except IntegrityError:
+        # An identical request was queued between the lookup and the insert
+        existing = find_duplicate(dedup_key)
+        if existing is None:
+            raise
+        return existing, False
+
+    logging.info(f"Queued {job}")
+    return job, True
+
+
+def request_key(kind, payload):
+    data = json.dumps({"kind": kind, "payload": payload}, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def find_duplicate(dedup_key):
+    """The active job for the key, or one that succeeded within the result memo window."""
+    active = Job.objects.filter(dedup_key=dedup_key, status__in=[Job.QUEUED, Job.RUNNING]).first()
+    if active:
+        return active
+    memo_since = timezone.now() - RESULT_MEMO
+    return Job.objects.filter(dedup_key=dedup_key, status=Job.SUCCEEDED,
+                              finished_at__gte=memo_since).order_by("-finished_at").first()
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_next(worker):
+    """
+    Atomically take the oldest queued job. The conditional UPDATE makes the claim safe
+    between worker processes on any database, SQLite included.
+    """
+    for job_pk in Job.objects.filter(status=Job.QUEUED).order_by("created_at").values_list("pk", flat=True)[:5]:
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=job_pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, started_at=now, heartbeat_at=now, progress="Started",
+            attempts=F("attempts") + 1)
+        if claimed:
+            return Job.objects.get(pk=job_pk)
+    return None
+
+
+def run_now(job):
+    """Run a queued job in the calling process (JOB_QUEUE_ENABLED=False, the default)."""
+    now = timezone.now()
+    claimed = Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+        status=Job.RUNNING, worker=worker_name(), started_at=now, heartbeat_at=now, progress="Started",
+        attempts=F("attempts") + 1)
+    if claimed:
+        run_job(job)
+    job.refresh_from_db()
+    return job
+
+
+def wait_for(job, poll_seconds=None, timeout_seconds=None):
+    """
+    Run or wait for a job in the calling process until it has finished, for requests
+    attached to an identical job without a run_jobs worker. A queued job is run here; a
+    running one is polled, and taken over if its runner stops sending heartbeats.
+    Returns the job, still unfinished if JOB_WAIT_SECONDS passed.
+    """
+    poll_seconds = poll_seconds or config("JOB_POLL_SECONDS", default=1.0, cast=float)
+    timeout_seconds = timeout_seconds or config("JOB_WAIT_SECONDS", default=3600, cast=int)
+    deadline = time.monotonic() + timeout_seconds
+    while True:
+        job.refresh_from_db()
+        if job.status == Job.QUEUED:
+            job = run_now(job)
+            continue
+        if job.status in (Job.SUCCEEDED, Job.FAILED) or time.monotonic() >= deadline:
+            return job
+        requeue_stale(job.dedup_key)
+        time.sleep(poll_seconds)
+
+
+def run_job(job):
+    """Execute a claimed job and record its result or error."""
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job.pk, stop_heartbeat), daemon=True)
+    heartbeat.start()
+    endpoint = current_endpoint.set(f"job:{job.kind}")
+    try:
+        handler = import_string(JOB_HANDLERS[job.kind])
+        result = handler(job)
+        # The job is only done once its project status has reached SharePoint
+        if not status_writer.flush():
+            logging.warning(f"{job}: project status updates are still pending")
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.SUCCEEDED, result=result, error="", progress="Done", finished_at=timezone.now())
+        logging.info(f"Finished {job}")
+    except Exception as e:
+        logging.error(f"{job} failed: {e}\n{traceback.format_exc()}")
+        Job.objects.filter(pk=job.pk).update(status=Job.FAILED, error=str(e), finished_at=timezone.now())
+    finally:
+        current_endpoint.reset(endpoint)
+        stop_heartbeat.set()
+        heartbeat.join()
+
+
+def requeue_stale(dedup_key=None):
+    """
+    Put jobs of dead workers back in the queue, or fail them after JOB_MAX_ATTEMPTS.
+
+    :param dedup_key: Only recover the job of this request key.
+    """
+    cutoff = timezone.now() - STALE_AFTER
+    stale = Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=cutoff)
+    if dedup_key is not None:
+        stale = stale.filter(dedup_key=dedup_key)
+    for job in stale:
+        if job.attempts >= MAX_ATTEMPTS:
+            updated = Job.objects.filter(pk=job.pk, status=Job.RUNNING, heartbeat_at__lt=cutoff).update(
+                status=Job.FAILED, error=f"Worker {job.worker} stopped responding", finished_at=timezone.now())
+        else:
+            updated = Job.objects.filter(pk=job.pk, status=Job.RUNNING, heartbeat_at__lt=cutoff).update(
+                status=Job.QUEUED, worker="", progress="Requeued")
+        if updated:
+            logging.warning(f"Recovered stale {job} from worker {job.worker}")
+
+
+def work(stop_event=None, poll_seconds=None):
+    """Worker loop: claim and run jobs until stop_event is set."""
+    poll_seconds = poll_seconds or config("JOB_POLL_SECONDS", default=1.0, cast=float)
+    worker = worker_name()
+    last_recovery = 0
+    logging.info(f"Job worker {worker} started")
+
+    while not (stop_event and stop_event.is_set()):
+        if time.monotonic() - last_recovery > STALE_AFTER.total_seconds() / 2:
+            requeue_stale()
+            last_recovery = time.monotonic()
+
+        job = claim_next(worker)
+        if job is None:
+            connection.close()
+            time.sleep(poll_seconds)
+            continue
+
+        run_job(job)
+        connection.close()
+
+
+def _heartbeat(job_pk, stop_event):
+    try:
+        while not stop_event.wait(HEARTBEAT_SECONDS):
+            Job.objects.filter(pk=job_pk, status=Job.RUNNING).update(heartbeat_at=timezone.now())
+    finally:
+        connection.close()
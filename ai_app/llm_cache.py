@@ -0,0 +1,63 @@
+import hashlib
+import json
+import logging
+
+from decouple import config
+
+from .metrics import LLM_CACHE_REQUESTS, record_token_usage, span
+from .sqlite_cache import open_cache
+
+_cache = None
+
+
+def get_llm_cache():
+    """The process-wide prompt/response cache (created lazily, Django settings must be loaded)."""
+    global _cache
+    if _cache is None:
+        _cache = open_cache(
+            "llm_cache.sqlite3", "chat_completions",
+            ttl_seconds=config("LLM_CACHE_TTL_SECONDS", default=7 * 24 * 3600, cast=int),
+            max_entries=config("LLM_CACHE_MAX_ENTRIES", default=5000, cast=int),
+        )
+    return _cache
+
+
+def cache_key(model, messages, response_format=None):
+    """Hash of everything that determines the completion for a deterministic call."""
+    payload = {
+        "model": model,
+        "deployment": config("DEPLOYMENT_NAME", default=""),
+        "messages": messages,
+        "response_format": response_format,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def chat_completion(client, messages, response_format=None, use_cache=True):
+    """
+    Run a chat completion and return the message content, serving byte-identical
+    requests from the persistent cache. Pass ``use_cache=False`` for calls that must
+    stay non-deterministic (final document generation).
+    """
+    model = config("MODEL_NAME")
+    use_cache = use_cache and config("LLM_CACHE_ENABLED", default=True, cast=bool)
+    key = cache_key(model, messages, response_format) if use_cache else None
+
+    if use_cache:
+        cached = get_llm_cache().get(key)
+        LLM_CACHE_REQUESTS.labels("hit" if cached is not None else "miss").inc()
+        if cached is not None:
+            logging.info(f"LLM cache hit ({get_llm_cache().stats()})")
+            return cached
+
+    kwargs = {"model": model, "messages": messages}
+    if response_format is not None:
+        kwargs["response_format"] = response_format
+    with span("openai", "chat"):
+        response = client.chat.completions.create(**kwargs)
+    record_token_usage("chat", getattr(response, "usage", None))
+    content = response.choices[0].message.content
+
+    if use_cache and content is not None:
+        get_llm_cache().set(key, content)
+    return content
@@ -0,0 +1,59 @@
+import hashlib
+import time
+from pathlib import Path
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from ai_app.html_extract import extract_main_content
+
+DEFAULT_FIXTURES_DIR = Path(__file__).resolve().parents[2] / "testdata" / "html"
+
+
+class Command(BaseCommand):
+    help = "Benchmark main-content extraction (tokens saved, time) against saved HTML pages."
+
+    def add_arguments(self, parser):
+        parser.add_argument("fixtures_dir", nargs="?", default=str(DEFAULT_FIXTURES_DIR),
+                            help="Directory of saved .html pages (the test fixtures by default)")
+        parser.add_argument("--save", nargs="*", default=[], metavar="URL",
+                            help="Download these pages into fixtures_dir before benchmarking")
+        parser.add_argument("--max-tokens", type=int, default=None, help="Override HTML_MAX_TOKENS")
+        parser.add_argument("--show", action="store_true", help="Print the extracted text of every page")
+
+    def handle(self, *args, **options):
+        fixtures_dir = Path(options["fixtures_dir"])
+        fixtures_dir.mkdir(parents=True, exist_ok=True)
+
+        for url in options["save"]:
+            response = requests.get(url, timeout=30)
+            response.raise_for_status()
+            name = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
+            (fixtures_dir / f"{name}.html").write_text(f"<!-- {url} -->\n{response.text}", encoding="utf-8")
+            self.stdout.write(f"Saved {url} as {name}.html")
+
+        pages = sorted(fixtures_dir.glob("*.html"))
+        if not pages:
+            raise CommandError(f"No .html files in {fixtures_dir}")
+
+        total_original = total_tokens = 0
+        total_time = 0.0
+        self.stdout.write(f"{'page':40} {'original':>10} {'extracted':>10} {'saved':>7} {'ms':>8}")
+        for page in pages:
+            html = page.read_text(encoding="utf-8", errors="replace")
+            start = time.perf_counter()
+            text, stats = extract_main_content(html, max_tokens=options["max_tokens"])
+            elapsed = time.perf_counter() - start
+
+            total_original += stats["original_tokens"]
+            total_tokens += stats["tokens"]
+            total_time += elapsed
+            saved = 100 * stats["saved_tokens"] / max(stats["original_tokens"], 1)
+            self.stdout.write(f"{page.name[:40]:40} {stats['original_tokens']:>10} {stats['tokens']:>10} "
+                              f"{saved:>6.1f}% {elapsed * 1000:>8.1f}")
+            if options["show"]:
+                self.stdout.write(text + "\n")
+
+        saved = 100 * (total_original - total_tokens) / max(total_original, 1)
+        self.stdout.write(f"{'total':40} {total_original:>10} {total_tokens:>10} {saved:>6.1f}% "
+                          f"{total_time * 1000:>8.1f}")
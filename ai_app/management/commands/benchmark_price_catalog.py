@@ -0,0 +1,56 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from ai_app.price_catalog import PriceCatalog
+
+REGIONS = ["East US", "East US 2", "Central US"]
+
+
+def legacy_lookup(file_path, service_name, concerned_regions):
+    """The previous get_service_app_records: parse the whole file and scan it for every service."""
+    normalized_regions = {region.replace(" ", "").lower() for region in concerned_regions}
+    with open(file_path, "r") as f:
+        data = json.load(f)
+    return [item for item in data.get("Items", [])
+            if item.get("serviceName") == service_name
+            and item.get("armRegionName", "").replace(" ", "").lower() in normalized_regions]
+
+
+class Command(BaseCommand):
+    help = "Compare the indexed price catalog with parsing and scanning the price file on every lookup."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--file", default="cost_estimation.json", help="Price file (Azure retail prices JSON)")
+        parser.add_argument("--services", nargs="*", default=None,
+                            help="Service names to look up (default: every service in the file)")
+        parser.add_argument("--repeat", type=int, default=5, help="Repetitions of the lookup set")
+
+    def handle(self, *args, **options):
+        file_path = options["file"]
+
+        start = time.perf_counter()
+        catalog = PriceCatalog.from_file(file_path)
+        build_time = time.perf_counter() - start
+        services = options["services"] or catalog.service_names()
+        lookups = len(services) * options["repeat"]
+
+        start = time.perf_counter()
+        for _ in range(options["repeat"]):
+            legacy_results = [legacy_lookup(file_path, service, REGIONS) for service in services]
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(options["repeat"]):
+            catalog_results = [catalog.find(service_name=service, regions=REGIONS) for service in services]
+        catalog_time = time.perf_counter() - start
+
+        if legacy_results != catalog_results:
+            self.stderr.write("The catalog results differ from the legacy lookup")
+
+        self.stdout.write(f"{len(catalog.items)} records, {len(services)} services, {lookups} lookups")
+        self.stdout.write(f"catalog load + index: {build_time * 1000:.1f} ms (once per process)")
+        self.stdout.write(f"legacy:  {legacy_time * 1000 / lookups:.3f} ms per lookup")
+        self.stdout.write(f"catalog: {catalog_time * 1000 / lookups:.4f} ms per lookup")
+        self.stdout.write(f"speed-up per lookup: {legacy_time / max(catalog_time, 1e-9):.0f}x")
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ai_app.price_catalog import PriceCatalog
+from ai_app.service_resolver import ServiceResolver
+
+# Names as the LLM writes them: exact, abbreviated, misspelt and unknown
+SAMPLE_NAMES = ["Azure App Service", "App Service", "VMs", "Applicaton Gateway", "Azure SQL Databse",
+                "Redis Cache Premium", "NAT Gateway", "Private Link", "Azure Kubernetes Service", "Key Vault"]
+
+
+class Command(BaseCommand):
+    help = "Time building the service resolver and resolving names, cold and memoised."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--file", default="cost_estimation.json", help="Price file (Azure retail prices JSON)")
+        parser.add_argument("--names", nargs="*", default=None,
+                            help="Names to resolve (default: a sample plus every service and product name)")
+        parser.add_argument("--repeat", type=int, default=20, help="Repetitions of the memoised lookups")
+
+    def handle(self, *args, **options):
+        catalog = PriceCatalog.from_file(options["file"])
+
+        start = time.perf_counter()
+        resolver = ServiceResolver.from_source(catalog)
+        build_time = time.perf_counter() - start
+
+        names = options["names"] or list(dict.fromkeys(
+            SAMPLE_NAMES + [product for _, product, _ in catalog.vocabulary() if product]
+            + catalog.service_names()))
+
+        start = time.perf_counter()
+        matches = [resolver.resolve(name) for name in names]
+        cold_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(options["repeat"]):
+            for name in names:
+                resolver.resolve(name)
+        memo_time = time.perf_counter() - start
+
+        resolved = sum(1 for match in matches if match)
+        self.stdout.write(f"{len(names)} names, {resolved} resolved")
+        self.stdout.write(f"build: {build_time * 1000:.1f} ms (once per price source)")
+        self.stdout.write(f"cold:  {cold_time * 1e6 / len(names):.1f} us per name")
+        self.stdout.write(f"memo:  {memo_time * 1e6 / (len(names) * options['repeat']):.2f} us per name")
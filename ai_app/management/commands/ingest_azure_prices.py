@@ -0,0 +1,114 @@
+import random
+import time
+
+import requests
+from decouple import config
+from django.core.management.base import BaseCommand, CommandError
+
+from ai_app.price_store import RETAIL_PRICES_URL, STORE_CURRENCY, PriceStore, new_run_id
+
+
+class Command(BaseCommand):
+    help = ("Page through the Azure Retail Prices API (following NextPageLink) into the SQLite price store. "
+            "Once the store holds a complete run, later runs only request prices whose effectiveStartDate "
+            "is on or after the day that run started. Prices are only replaced by ones with a newer "
+            "effectiveStartDate, and after a --full run meters the API no longer returns are removed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default=config("RETAIL_PRICES_URL", default=RETAIL_PRICES_URL),
+                            help="Retail Prices API endpoint (point it at a local fixture server for tests)")
+        parser.add_argument("--filter", default=None, help="OData $filter, e.g. \"serviceFamily eq 'Compute'\"")
+        parser.add_argument("--currency", default=None,
+                            help=f"currencyCode; only {STORE_CURRENCY}, the currency the estimates read, is accepted")
+        parser.add_argument("--store", default=None, help="Path of the SQLite store (PRICE_STORE_PATH)")
+        parser.add_argument("--max-pages", type=int, default=None, help="Stop after this many pages")
+        parser.add_argument("--resume", action="store_true", help="Continue an interrupted run from its last page")
+        parser.add_argument("--full", action="store_true",
+                            help="Fetch the whole catalog and remove retired meters instead of refreshing "
+                                 "incrementally by effectiveStartDate")
+
+    def handle(self, *args, **options):
+        if options["currency"] and options["currency"].upper() != STORE_CURRENCY:
+            # Other currencies would overwrite the USD rows, which share the same meter keys
+            raise CommandError(f"The price store only holds {STORE_CURRENCY} prices, not {options['currency']}")
+        store = PriceStore(options["store"])
+        conn = store.connect()
+        session = requests.Session()
+        try:
+            if options["resume"] and store.get_meta(conn, "resume_link"):
+                url, params = store.get_meta(conn, "resume_link"), None
+                run_id = store.get_meta(conn, "resume_run")
+                run_started = store.get_meta(conn, "resume_started")
+                catalog_wide = store.get_meta(conn, "resume_catalog_wide") == "1"
+                complete_sweep = store.get_meta(conn, "resume_complete_sweep") == "1"
+                self.stdout.write(f"Resuming run {run_id}")
+            else:
+                url, params = options["url"], {}
+                run_id = new_run_id()
+                run_started = time.strftime("%Y-%m-%dT00:00:00Z", time.gmtime())
+                catalog_wide = not options["filter"]
+                filters = [f"({options['filter']})"] if options["filter"] else []
+                refreshed_since = None if options["full"] else store.get_meta(conn, "last_run_started")
+                if refreshed_since:
+                    # Unchanged meters keep their stored price, so only newer prices are needed
+                    filters.append(f"effectiveStartDate ge {refreshed_since}")
+                    self.stdout.write(f"Fetching prices effective since {refreshed_since} (--full for all)")
+                if filters:
+                    params["$filter"] = " and ".join(filters)
+                if options["currency"]:
+                    params["currencyCode"] = options["currency"]
+                complete_sweep = not filters
+
+            pages = items = written = 0
+            started = time.time()
+            while url:
+                page = self.fetch(session, url, params)
+                params = None  # NextPageLink already carries the query
+                with conn:
+                    written += store.upsert(conn, page.get("Items", []), run_id)
+                    url = page.get("NextPageLink")
+                    store.set_meta(conn, "resume_link", url or "")
+                    store.set_meta(conn, "resume_run", run_id)
+                    store.set_meta(conn, "resume_started", run_started)
+                    store.set_meta(conn, "resume_catalog_wide", "1" if catalog_wide else "0")
+                    store.set_meta(conn, "resume_complete_sweep", "1" if complete_sweep else "0")
+
+                pages += 1
+                items += len(page.get("Items", []))
+                if pages % 50 == 0:
+                    self.stdout.write(f"{pages} pages, {items} prices ({time.time() - started:.0f}s)")
+                if options["max_pages"] and pages >= options["max_pages"] and url:
+                    self.stdout.write(f"Stopped after {pages} pages; continue with --resume")
+                    return
+
+            with conn:
+                removed = store.delete_unseen(conn, run_id) if complete_sweep else 0
+                store.set_meta(conn, "last_run", run_id)
+                store.set_meta(conn, "resume_link", "")
+                if catalog_wide:
+                    store.set_meta(conn, "last_run_started", run_started)
+
+            self.stdout.write(f"Ingested {items} prices from {pages} pages in {time.time() - started:.0f}s: "
+                              f"{written} rows written, {removed} retired meters removed")
+        finally:
+            conn.close()
+            session.close()
+
+    def fetch(self, session, url, params, max_attempts=6):
+        for attempt in range(max_attempts):
+            try:
+                response = session.get(url, params=params, timeout=60)
+            except requests.RequestException as e:
+                if attempt == max_attempts - 1:
+                    raise CommandError(f"Failed to fetch {url}: {e}")
+                time.sleep(2 ** attempt + random.random())
+                continue
+
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code in (429, 500, 502, 503, 504) and attempt < max_attempts - 1:
+                retry_after = response.headers.get("Retry-After")
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+                time.sleep(delay + random.random())
+                continue
+            raise CommandError(f"Retail Prices API returned {response.status_code}: {response.text[:500]}")
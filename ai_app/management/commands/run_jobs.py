@@ -0,0 +1,52 @@
+import multiprocessing
+import signal
+import threading
+
+from decouple import config
+from django.core.management.base import BaseCommand
+
+
+def _worker_process():
+    import django
+
+    django.setup()
+
+    from ai_app.jobs import work
+
+    # Finish the current job on SIGTERM, then exit
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *args: stop_event.set())
+    work(stop_event)
+
+
+class Command(BaseCommand):
+    help = ("Run worker processes that execute queued generation jobs (WBS, SOW, discovery questionnaire). "
+            "Only needed with JOB_QUEUE_ENABLED=True, which makes those endpoints answer 202 with a job id; "
+            "the deploy workflow does not start it, so enable the flag only where this command runs.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None,
+                            help="Number of worker processes (JOB_WORKERS, default 2)")
+
+    def handle(self, *args, **options):
+        workers = options["workers"] or config("JOB_WORKERS", default=2, cast=int)
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=_worker_process, name=f"job-worker-{i}") for i in range(workers)]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Started {workers} job worker(s)")
+
+        def stop(*args):
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+
+        signal.signal(signal.SIGTERM, stop)
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            stop()
+            for process in processes:
+                process.join()
@@ -0,0 +1,113 @@
+import contextvars
+import hmac
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from decouple import config
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import REGISTRY, multiprocess
+
+# Latencies range from cached lookups to multi-minute generations
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+# Endpoint (view name, or job:<kind> in the workers) the current work is attributed to
+current_endpoint = contextvars.ContextVar("current_endpoint", default="none")
+
+SPAN_SECONDS = Histogram(
+    "ecf_span_seconds", "Duration of pipeline stages, upstream calls and timed functions",
+    ["endpoint", "kind", "name"], buckets=LATENCY_BUCKETS)
+SPAN_ERRORS = Counter(
+    "ecf_span_errors_total", "Spans that ended with an exception",
+    ["endpoint", "kind", "name"])
+HTTP_REQUEST_SECONDS = Histogram(
+    "ecf_http_request_seconds", "Duration of HTTP requests served",
+    ["endpoint", "method", "status"], buckets=LATENCY_BUCKETS)
+LLM_TOKENS = Counter(
+    "ecf_llm_tokens_total", "Azure OpenAI tokens used, from response.usage",
+    ["endpoint", "operation", "type"])
+LLM_CACHE_REQUESTS = Counter(
+    "ecf_llm_cache_requests_total", "Prompt cache lookups",
+    ["result"])
+
+
+@contextmanager
+def span(kind, name, log=False):
+    """
+    Time a block as a span: ``kind`` is stage, graph, openai, directline, url_fetch or
+    function. The duration lands in ecf_span_seconds for the current endpoint and an
+    exception also counts in ecf_span_errors_total.
+    """
+    endpoint = current_endpoint.get()
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        SPAN_ERRORS.labels(endpoint, kind, name).inc()
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        SPAN_SECONDS.labels(endpoint, kind, name).observe(duration)
+        if log:
+            logging.info(f"{name}() took {duration:.4f} seconds to complete")
+
+
+def record_token_usage(operation, usage):
+    """Count the prompt and completion tokens of an OpenAI response's ``usage``."""
+    if usage is None:
+        return
+    endpoint = current_endpoint.get()
+    LLM_TOKENS.labels(endpoint, operation, "prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+    LLM_TOKENS.labels(endpoint, operation, "completion").inc(getattr(usage, "completion_tokens", 0) or 0)
+
+
+def metrics_view(request):
+    """
+    Prometheus exposition of all metrics (merged over processes with PROMETHEUS_MULTIPROC_DIR).
+
+    The app is public, so scrapers must send ``Authorization: Bearer <METRICS_TOKEN>``;
+    without METRICS_TOKEN set the endpoint answers 404.
+    """
+    from django.http import HttpResponse, HttpResponseNotFound
+
+    token = config("METRICS_TOKEN", default="")
+    if not token:
+        return HttpResponseNotFound()
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        response = HttpResponse("Unauthorized", status=401)
+        response["WWW-Authenticate"] = "Bearer"
+        return response
+
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+class MetricsMiddleware:
+    """Times every request and attributes the spans it produces to the resolved view."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = current_endpoint.set("unresolved")
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            match = getattr(request, "resolver_match", None)
+            endpoint = match.view_name if match and match.view_name else "unresolved"
+            HTTP_REQUEST_SECONDS.labels(endpoint, request.method, str(status)).observe(time.perf_counter() - start)
+            current_endpoint.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        current_endpoint.set(match.view_name if match and match.view_name else "unresolved")
+        return None
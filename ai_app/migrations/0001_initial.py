@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriveDeltaState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('drive_id', models.CharField(max_length=255, unique=True)),
+                ('delta_link', models.TextField(blank=True, default='')),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DriveItemIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('drive_id', models.CharField(max_length=255)),
+                ('project_id', models.CharField(max_length=64)),
+                ('item_id', models.CharField(max_length=255)),
+                ('name', models.CharField(max_length=512)),
+                ('etag', models.CharField(blank=True, default='', max_length=255)),
+                ('ctag', models.CharField(blank=True, default='', max_length=255)),
+                ('download_url', models.TextField(blank=True, default='')),
+                ('download_url_fetched_at', models.DateTimeField(blank=True, null=True)),
+                ('last_modified', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['drive_id', 'item_id'], name='drive_item_idx')],
+                'constraints': [models.UniqueConstraint(fields=('drive_id', 'project_id'), name='unique_drive_project')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_app', '0003_job_dedup_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StageArtifact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pipeline', models.CharField(max_length=64)),
+                ('project_id', models.CharField(max_length=64)),
+                ('stage', models.CharField(max_length=64)),
+                ('input_hash', models.CharField(max_length=64)),
+                ('output', models.JSONField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('pipeline', 'project_id', 'stage'), name='unique_stage_artifact')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:17
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_app', '0004_stageartifact'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='driveitemindex',
+            name='download_url',
+        ),
+        migrations.RemoveField(
+            model_name='driveitemindex',
+            name='download_url_fetched_at',
+        ),
+    ]
@@ -1,3 +1,124 @@
+import uuid
+
 from django.db import models
 
-# Create your models here.
+
+class DriveItemIndex(models.Model):
+    """
+    Local index of SharePoint drive files by project, kept current with Graph delta queries.
+    """
+    drive_id = models.CharField(max_length=255)
+    project_id = models.CharField(max_length=64)
+    item_id = models.CharField(max_length=255)
+    name = models.CharField(max_length=512)
+    etag = models.CharField(max_length=255, blank=True, default="")
+    ctag = models.CharField(max_length=255, blank=True, default="")
+    last_modified = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["drive_id", "project_id"], name="unique_drive_project"),
+        ]
+        indexes = [
+            models.Index(fields=["drive_id", "item_id"], name="drive_item_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.drive_id}/{self.project_id} -> {self.name}"
+
+
+class DriveDeltaState(models.Model):
+    """
+    Last Graph deltaLink per drive, so the next sync only fetches what changed.
+    """
+    drive_id = models.CharField(max_length=255, unique=True)
+    delta_link = models.TextField(blank=True, default="")
+    synced_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.drive_id} synced at {self.synced_at}"
+
+
+class Job(models.Model):
+    """
+    A long-running generation request, executed by the ``run_jobs`` worker processes.
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    job_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    kind = models.CharField(max_length=64)
+    # Hash of kind + payload, identical requests share one job while it is queued or running
+    dedup_key = models.CharField(max_length=64, blank=True, default="")
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.CharField(max_length=255, blank=True, default="")
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=255, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["dedup_key"], condition=models.Q(status__in=["queued", "running"]),
+                                    name="unique_active_job"),
+        ]
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="job_status_idx"),
+            models.Index(fields=["dedup_key", "finished_at"], name="job_dedup_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.job_id} ({self.status})"
+
+    def set_progress(self, progress):
+        """Record the step the job has reached (visible on the status endpoint)."""
+        self.progress = progress[:255]
+        Job.objects.filter(pk=self.pk).update(progress=self.progress)
+
+    def as_dict(self):
+        return {
+            "job_id": str(self.job_id),
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "attempts": self.attempts,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class StageArtifact(models.Model):
+    """
+    Output of a pipeline stage for a project, with the hash of the inputs it was computed from.
+    """
+    pipeline = models.CharField(max_length=64)
+    project_id = models.CharField(max_length=64)
+    stage = models.CharField(max_length=64)
+    input_hash = models.CharField(max_length=64)
+    output = models.JSONField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["pipeline", "project_id", "stage"], name="unique_stage_artifact"),
+        ]
+
+    def __str__(self):
+        return f"{self.pipeline}/{self.project_id}/{self.stage}"
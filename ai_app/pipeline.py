@@ -0,0 +1,121 @@
+import contextvars
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from decouple import config
+from django.db import connection
+
+from .metrics import span
+
+
+class Pipeline:
+    """
+    Runs named stages as a dependency graph on a thread pool.
+
+    Each stage is called with the results of the stages it depends on as keyword
+    arguments (``stage name -> result``). Independent branches run concurrently, so the
+    wall-clock time approaches the critical path. Per-stage timings are recorded in
+    ``timings`` and logged when the run finishes. ``on_stage_done(name)`` is called from
+    the calling thread as each stage completes (e.g. to report job progress).
+
+    Stages added with ``checkpoint=True`` are looked up in ``artifacts`` (an ArtifactStore)
+    first: when their inputs hash to the stored value the stored output is used and the
+    stage does not run. Their output must be JSON-serialisable. ``checkpoint`` may also be
+    a predicate that decides whether an output is worth keeping.
+    """
+
+    def __init__(self, name, max_workers=None, on_stage_done=None, artifacts=None):
+        self.name = name
+        self.on_stage_done = on_stage_done
+        self.artifacts = artifacts
+        self.max_workers = max_workers or config("PIPELINE_MAX_WORKERS", default=4, cast=int)
+        self.stages = {}
+        self.checkpointed = {}  # stage -> optional predicate on the output
+        self.reused = set()
+        self.timings = {}
+
+    def add(self, name, func, depends_on=(), checkpoint=False):
+        """Register a stage; dependencies must already be registered."""
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' is already defined")
+        for dependency in depends_on:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dependency}'")
+        self.stages[name] = (func, tuple(depends_on))
+        if checkpoint:
+            self.checkpointed[name] = checkpoint if callable(checkpoint) else None
+        return self
+
+    def run(self):
+        """Run every stage and return ``{stage name: result}``; the first failure is re-raised."""
+        results = {}
+        remaining = dict(self.stages)
+        running = {}
+        started_at = time.time()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{self.name}-stage") as executor:
+            try:
+                while remaining or running:
+                    for name, (func, depends_on) in list(remaining.items()):
+                        if all(dependency in results for dependency in depends_on):
+                            kwargs = {dependency: results[dependency] for dependency in depends_on}
+                            # Each stage runs in a copy of the caller's context (metrics endpoint label)
+                            future = executor.submit(contextvars.copy_context().run, self._run_stage,
+                                                     name, func, kwargs, started_at)
+                            running[future] = name
+                            del remaining[name]
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        results[name] = future.result()
+                        if self.on_stage_done:
+                            self.on_stage_done(name)
+            except BaseException:
+                for future in running:
+                    future.cancel()
+                raise
+            finally:
+                self._log_timings(time.time() - started_at)
+
+        return results
+
+    def _run_stage(self, name, func, kwargs, started_at):
+        stage_start = time.time()
+        try:
+            with span("stage", f"{self.name}.{name}"):
+                return self._run_checkpointed(name, func, kwargs)
+        finally:
+            self.timings[name] = (stage_start - started_at, time.time() - stage_start)
+            # Stage threads must not leak DB connections
+            connection.close()
+
+    def _run_checkpointed(self, name, func, kwargs):
+        if self.artifacts is None or name not in self.checkpointed:
+            return func(**kwargs)
+
+        input_hash = self.artifacts.input_hash(name, kwargs)
+        try:
+            found, output = self.artifacts.load(name, input_hash)
+        except Exception as e:
+            logging.warning(f"[{self.name}] unable to load the {name} checkpoint: {e}")
+            found, output = False, None
+        if found:
+            self.reused.add(name)
+            return output
+
+        output = func(**kwargs)
+        keep = self.checkpointed[name]
+        if keep is None or keep(output):
+            try:
+                self.artifacts.save(name, input_hash, output)
+            except Exception as e:
+                logging.warning(f"[{self.name}] unable to save the {name} checkpoint: {e}")
+        return output
+
+    def _log_timings(self, total):
+        for name, (offset, duration) in sorted(self.timings.items(), key=lambda item: item[1][0]):
+            reused = " (reused checkpoint)" if name in self.reused else ""
+            logging.info(f"[{self.name}] {name} started at +{offset:.2f}s and took {duration:.2f}s{reused}")
+        logging.info(f"[{self.name}] pipeline took {total:.2f} seconds to complete")
@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+from collections import defaultdict
+
+
+def normalize_region(region):
+    """'East US' and 'eastus' both become 'eastus'."""
+    return (region or "").replace(" ", "").lower()
+
+
+class PriceCatalog:
+    """
+    Azure retail price records held in memory with hash indexes on serviceName,
+    normalised armRegionName, skuName and type, so a filtered lookup only touches the
+    records of its most selective filter instead of scanning the whole price sheet.
+    Results keep the order of the price sheet and are copies, so callers cannot alter the
+    shared catalog.
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self.by_service = defaultdict(list)
+        self.by_region = defaultdict(list)
+        self.by_sku = defaultdict(list)
+        self.by_type = defaultdict(list)
+        for position, item in enumerate(items):
+            self.by_service[item.get("serviceName")].append(position)
+            self.by_region[normalize_region(item.get("armRegionName"))].append(position)
+            self.by_sku[item.get("skuName")].append(position)
+            self.by_type[item.get("type")].append(position)
+
+    @classmethod
+    def from_file(cls, file_path):
+        with open(file_path, "r") as f:
+            data = json.load(f)
+        return cls(data.get("Items", []))
+
+    def find(self, service_name=None, regions=None, sku_name=None, price_type=None):
+        """
+        Records matching every given filter (None means no filter on that field).
+
+        :param regions: Region names in any spelling ('East US', 'eastus').
+        """
+        candidates = []
+        if service_name is not None:
+            candidates.append(self.by_service.get(service_name, []))
+        if sku_name is not None:
+            candidates.append(self.by_sku.get(sku_name, []))
+        if price_type is not None:
+            candidates.append(self.by_type.get(price_type, []))
+        normalized_regions = None
+        if regions is not None:
+            normalized_regions = {normalize_region(region) for region in regions}
+            region_positions = []
+            for region in normalized_regions:
+                region_positions.extend(self.by_region.get(region, []))
+            candidates.append(sorted(region_positions))
+
+        if not candidates:
+            return [dict(item) for item in self.items]
+
+        # Walk the smallest posting list and check the remaining filters directly
+        positions = min(candidates, key=len)
+        matches = []
+        for position in positions:
+            item = self.items[position]
+            if service_name is not None and item.get("serviceName") != service_name:
+                continue
+            if sku_name is not None and item.get("skuName") != sku_name:
+                continue
+            if price_type is not None and item.get("type") != price_type:
+                continue
+            if normalized_regions is not None and normalize_region(item.get("armRegionName")) not in normalized_regions:
+                continue
+            matches.append(dict(item))
+        return matches
+
+    def service_names(self):
+        return [name for name in self.by_service if name]
+
+    def vocabulary(self):
+        """Distinct (serviceName, productName, skuName) combinations."""
+        return list(dict.fromkeys(
+            (item.get("serviceName"), item.get("productName"), item.get("skuName")) for item in self.items))
+
+    def table_rows(self, service_name):
+        """Column values of a service's records for PriceTable.from_rows."""
+        return [(item.get("serviceName"), normalize_region(item.get("armRegionName")), item.get("skuName"),
+                 item.get("type"), item.get("unitOfMeasure"), item.get("unitPrice", item.get("retailPrice")),
+                 item.get("tierMinimumUnits"))
+                for item in (self.items[position] for position in self.by_service.get(service_name, []))]
+
+
+_catalogs = {}  # absolute path -> (mtime, PriceCatalog)
+_catalogs_lock = threading.Lock()
+
+
+def get_price_catalog(file_path="cost_estimation.json"):
+    """
+    The catalog for a price file, parsed once per process and reloaded only when the
+    file's modification time changes.
+    """
+    path = os.path.abspath(file_path)
+    mtime = os.path.getmtime(path)
+    with _catalogs_lock:
+        cached = _catalogs.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        catalog = PriceCatalog.from_file(path)
+        _catalogs[path] = (mtime, catalog)
+        return catalog
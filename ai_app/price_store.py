@@ -0,0 +1,177 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+from decouple import config
+
+from .price_catalog import normalize_region
+from .sqlite_cache import _ClosingConnection, default_cache_path
+
+RETAIL_PRICES_URL = "https://prices.azure.com/api/retail/prices"
+
+# How long PriceStore.status() trusts its last look at the database
+PRICE_STORE_RECHECK_SECONDS = config("PRICE_STORE_RECHECK_SECONDS", default=30, cast=float)
+
+# Rows are not keyed by currency and the estimates read them as USD, so the store only holds USD prices
+STORE_CURRENCY = "USD"
+
+# One row per meter and price variant; a newer effectiveStartDate replaces the stored price
+KEY_COLUMNS = ["meter_id", "sku_id", "type", "reservation_term", "tier_minimum_units"]
+VALUE_COLUMNS = ["effective_start_date", "service_name", "arm_region_name", "sku_name", "product_name",
+                 "record"]
+
+
+def default_store_path():
+    return config("PRICE_STORE_PATH", default=default_cache_path("azure_prices.sqlite3"))
+
+
+class PriceStore:
+    """
+    The full Azure retail price catalog in an indexed SQLite table.
+
+    Rows are keyed by meter and price variant (sku, price type, reservation term and
+    tier). ``upsert`` only replaces a stored price with one whose effectiveStartDate is
+    the same or newer, so repeated ingestions are incremental. Lookups use the
+    (service_name, arm_region_name) index and stay in the millisecond range for the
+    whole catalog. ``find`` has the same interface as PriceCatalog.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_store_path()
+        self._initialized = False
+        self._status = None
+        self._status_checked_at = 0
+
+    def exists(self):
+        """True when the store has been populated by ingest_azure_prices."""
+        if not os.path.exists(self.path):
+            return False
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM prices LIMIT 1").fetchone() is not None
+
+    def status(self):
+        """
+        (populated, last_run) of the store, read from the database at most once every
+        PRICE_STORE_RECHECK_SECONDS so per-lookup callers do not open a connection each time.
+        """
+        if self._status is None or time.monotonic() - self._status_checked_at >= PRICE_STORE_RECHECK_SECONDS:
+            populated = self.exists()
+            self._status = (populated, self.last_run() if populated else None)
+            self._status_checked_at = time.monotonic()
+        return self._status
+
+    def find(self, service_name=None, regions=None, sku_name=None, price_type=None):
+        clauses, params = [], []
+        if service_name is not None:
+            clauses.append("service_name = ?")
+            params.append(service_name)
+        if regions is not None:
+            normalized_regions = sorted({normalize_region(region) for region in regions})
+            clauses.append(f"arm_region_name IN ({', '.join('?' * len(normalized_regions))})")
+            params.extend(normalized_regions)
+        if sku_name is not None:
+            clauses.append("sku_name = ?")
+            params.append(sku_name)
+        if price_type is not None:
+            clauses.append("type = ?")
+            params.append(price_type)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT record FROM prices {where} ORDER BY rowid", params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def service_names(self):
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute("SELECT DISTINCT service_name FROM prices ORDER BY service_name")]
+
+    def vocabulary(self):
+        """Distinct (serviceName, productName, skuName) combinations."""
+        with self._connect() as conn:
+            return conn.execute("SELECT DISTINCT service_name, product_name, sku_name FROM prices").fetchall()
+
+    def table_rows(self, service_name):
+        """Column values of a service's stored prices for PriceTable.from_rows, read without decoding the records."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT service_name, arm_region_name, sku_name, type, json_extract(record, '$.unitOfMeasure'), "
+                "coalesce(json_extract(record, '$.unitPrice'), json_extract(record, '$.retailPrice')), "
+                "tier_minimum_units FROM prices WHERE service_name = ?", (service_name,)).fetchall()
+
+    def last_run(self):
+        """Id of the last complete ingestion run, which identifies the store's contents."""
+        with self._connect() as conn:
+            return self.get_meta(conn, "last_run")
+
+    def upsert(self, conn, items, run_id):
+        """Write one page of API items; returns the number of rows written."""
+        columns = KEY_COLUMNS + VALUE_COLUMNS + ["seen_run"]
+        newer = "excluded.effective_start_date >= prices.effective_start_date"
+        updates = ", ".join(f"{column} = CASE WHEN {newer} THEN excluded.{column} ELSE prices.{column} END"
+                            for column in VALUE_COLUMNS)
+        sql = (f"INSERT INTO prices ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+               f"ON CONFLICT ({', '.join(KEY_COLUMNS)}) DO UPDATE SET {updates}, seen_run = excluded.seen_run")
+
+        before = conn.total_changes
+        conn.executemany(sql, [self._row(item) + [run_id] for item in items])
+        return conn.total_changes - before
+
+    def delete_unseen(self, conn, run_id):
+        """Drop meters that a complete ingestion run no longer returned (retired prices)."""
+        return conn.execute("DELETE FROM prices WHERE seen_run != ?", (run_id,)).rowcount
+
+    def get_meta(self, conn, key, default=None):
+        row = conn.execute("SELECT value FROM price_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO price_meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _row(self, item):
+        return [
+            item.get("meterId", ""),
+            item.get("skuId", ""),
+            item.get("type", ""),
+            item.get("reservationTerm") or "",
+            float(item.get("tierMinimumUnits") or 0),
+            item.get("effectiveStartDate", ""),
+            item.get("serviceName", ""),
+            normalize_region(item.get("armRegionName")),
+            item.get("skuName", ""),
+            item.get("productName", ""),
+            json.dumps(item),
+        ]
+
+    def connect(self):
+        """A connection for a long ingestion run (the caller commits and closes it)."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            self._initialize(conn)
+        return conn
+
+    def _connect(self):
+        return _ClosingConnection(self.connect())
+
+    def _initialize(self, conn):
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS prices ("
+            "meter_id TEXT NOT NULL, sku_id TEXT NOT NULL, type TEXT NOT NULL, reservation_term TEXT NOT NULL, "
+            "tier_minimum_units REAL NOT NULL, effective_start_date TEXT NOT NULL, service_name TEXT NOT NULL, "
+            "arm_region_name TEXT NOT NULL, sku_name TEXT NOT NULL, product_name TEXT NOT NULL, "
+            "record TEXT NOT NULL, seen_run TEXT NOT NULL, "
+            f"PRIMARY KEY ({', '.join(KEY_COLUMNS)}))")
+        conn.execute("CREATE INDEX IF NOT EXISTS prices_service_region ON prices (service_name, arm_region_name)")
+        conn.execute("CREATE INDEX IF NOT EXISTS prices_sku ON prices (sku_name)")
+        conn.execute("CREATE INDEX IF NOT EXISTS prices_type ON prices (type)")
+        conn.execute("CREATE TABLE IF NOT EXISTS price_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.commit()
+        self._initialized = True
+
+
+def new_run_id():
+    # The suffix keeps two runs started in the same second apart for delete_unseen
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
@@ -0,0 +1,154 @@
+import re
+
+import numpy as np
+from decouple import config
+
+from .price_catalog import normalize_region
+
+HOURS_PER_MONTH = config("HOURS_PER_MONTH", default=730, cast=float)
+
+# '1 Hour', '100 Hours', '1/Hour' -> hours covered by one unit of the price
+HOURLY_UNIT = re.compile(r"^\s*(\d+)\s*(?:/\s*)?hours?\s*$", re.IGNORECASE)
+
+SUMMARY_PRICE_TYPES = ("Consumption",)
+
+
+def _categorical(values):
+    """(categories, codes) for a list of strings, with codes indexing into categories."""
+    categories, codes = np.unique(np.array(values, dtype=object).astype(str), return_inverse=True)
+    return categories, codes.astype(np.int32)
+
+
+class PriceTable:
+    """
+    Azure retail price records held column-wise: serviceName, normalised armRegionName,
+    skuName, type and unitOfMeasure as categorical codes, retailPrice and
+    tierMinimumUnits as float arrays. Grouped statistics are computed with array
+    operations instead of looping over the records.
+    """
+
+    def __init__(self, services, regions, skus, types, units, unit_price, tier_minimum):
+        self.services, self.service_codes = services
+        self.regions, self.region_codes = regions
+        self.skus, self.sku_codes = skus
+        self.types, self.type_codes = types
+        self.units, self.unit_codes = units
+        self.unit_price = unit_price
+        self.tier_minimum = tier_minimum
+
+    @classmethod
+    def from_records(cls, records):
+        return cls.from_rows([
+            (record.get("serviceName"), normalize_region(record.get("armRegionName")), record.get("skuName"),
+             record.get("type"), record.get("unitOfMeasure"), record.get("unitPrice", record.get("retailPrice")),
+             record.get("tierMinimumUnits"))
+            for record in records
+        ])
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        :param rows: (serviceName, normalised armRegionName, skuName, type, unitOfMeasure,
+            unit price, tierMinimumUnits) tuples, as returned by a price source's table_rows().
+        """
+        columns = list(zip(*rows)) or [()] * 7
+        return cls(
+            *(_categorical([value or "" for value in column]) for column in columns[:5]),
+            np.array([float(value or 0) for value in columns[5]], dtype=np.float64),
+            np.array([float(value or 0) for value in columns[6]], dtype=np.float64),
+        )
+
+    @classmethod
+    def from_source(cls, source, service_name):
+        """The table of a service's prices in a PriceCatalog or PriceStore."""
+        return cls.from_rows(source.table_rows(service_name))
+
+    def __len__(self):
+        return len(self.unit_price)
+
+    def unit_hours(self):
+        """Hours covered by one unit of each row's price, NaN when the unit is not time-based."""
+        hours = np.full(len(self.units), np.nan)
+        for code, unit in enumerate(self.units):
+            match = HOURLY_UNIT.match(unit)
+            if match:
+                hours[code] = float(match.group(1))
+        return hours[self.unit_codes]
+
+    def summarize(self, service_names=None, regions=None, price_types=SUMMARY_PRICE_TYPES,
+                  hours_per_month=HOURS_PER_MONTH):
+        """
+        Min, median and max unit price per service, SKU, region and unit of measure,
+        over the base tier (tierMinimumUnits 0) of the given price types, optionally
+        restricted to some services and regions (None means all). Hour-based prices also
+        get a monthly projection at ``hours_per_month``.
+        """
+        mask = self.tier_minimum == 0
+        if service_names is not None:
+            mask &= np.isin(self.services, list(service_names))[self.service_codes]
+        if regions is not None:
+            mask &= np.isin(self.regions, [normalize_region(region) for region in regions])[self.region_codes]
+        if price_types is not None:
+            mask &= np.isin(self.types, list(price_types))[self.type_codes]
+        rows = np.flatnonzero(mask)
+        if rows.size == 0:
+            return []
+
+        # One integer key per (service, sku, region, unit) combination
+        key = self.service_codes[rows].astype(np.int64)
+        for codes, categories in ((self.sku_codes, self.skus), (self.region_codes, self.regions),
+                                  (self.unit_codes, self.units)):
+            key = key * len(categories) + codes[rows]
+        _, group = np.unique(key, return_inverse=True)
+
+        # Sort by group, then price, so each group is a contiguous ascending run
+        order = np.lexsort((self.unit_price[rows], group))
+        rows, group = rows[order], group[order]
+        prices = self.unit_price[rows]
+        starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+        counts = np.diff(np.r_[starts, len(rows)])
+        ends = starts + counts - 1
+
+        minimum = prices[starts]
+        maximum = prices[ends]
+        median = (prices[starts + (counts - 1) // 2] + prices[starts + counts // 2]) / 2
+        hourly_median = median / self.unit_hours()[rows[starts]]
+        monthly = np.round(hourly_median * hours_per_month, 2)
+
+        first = rows[starts]
+        service = self.services[self.service_codes[first]]
+        sku = self.skus[self.sku_codes[first]]
+        region = self.regions[self.region_codes[first]]
+        unit = self.units[self.unit_codes[first]]
+        return [
+            {
+                "serviceName": str(service[i]),
+                "skuName": str(sku[i]),
+                "armRegionName": str(region[i]),
+                "unitOfMeasure": str(unit[i]),
+                "meters": int(counts[i]),
+                "minUnitPrice": float(minimum[i]),
+                "medianUnitPrice": float(median[i]),
+                "maxUnitPrice": float(maximum[i]),
+                "monthlyEstimate": None if np.isnan(monthly[i]) else float(monthly[i]),
+            }
+            for i in range(len(starts))
+        ]
+
+
+def summarize_costs(records, service_table=None):
+    """
+    The compact cost summary written to the WBS for a list of raw price records. Given
+    ``service_table`` (service name -> that service's shared PriceTable, e.g.
+    get_price_table), the summary is taken from those tables for the services and regions
+    of ``records`` instead of building a table from the records.
+    """
+    if not records:
+        return []
+    if service_table is None:
+        return PriceTable.from_records(records).summarize()
+    regions = {record.get("armRegionName") for record in records}
+    summary = []
+    for service_name in sorted({record.get("serviceName") or "" for record in records}):
+        summary.extend(service_table(service_name).summarize(regions=regions))
+    return summary
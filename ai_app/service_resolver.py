@@ -0,0 +1,265 @@
+import hashlib
+import re
+import threading
+from collections import Counter, defaultdict, namedtuple
+
+from decouple import config
+
+SERVICE_MATCH_MIN_SCORE = config("SERVICE_MATCH_MIN_SCORE", default=0.6, cast=float)
+
+# Added to a fuzzy candidate whose service offers the SKU given with the name
+SERVICE_MATCH_SKU_BONUS = config("SERVICE_MATCH_SKU_BONUS", default=0.15, cast=float)
+
+# A bare SKU name ('Standard', 'Private Link') says little about the service, so it scores below the threshold
+SKU_ONLY_SCORE = 0.5
+
+# Query and entry words whose trigram Dice similarity reaches this count as the same word
+WORD_MATCH_MIN_SCORE = 0.5
+
+ServiceMatch = namedtuple("ServiceMatch", ["service_name", "score", "matched", "source"])
+
+# Words the LLM adds or drops freely; "Azure App Service" and "App Service" are the same
+NOISE_WORDS = {"azure", "microsoft", "ms"}
+
+# Common names and abbreviations (normalised) -> catalog serviceName
+SYNONYMS = {
+    "vm": "Virtual Machines",
+    "vms": "Virtual Machines",
+    "virtual machine": "Virtual Machines",
+    "compute": "Virtual Machines",
+    "vmss": "Virtual Machines",
+    "virtual machine scale sets": "Virtual Machines",
+    "web app": "Azure App Service",
+    "web apps": "Azure App Service",
+    "app services": "Azure App Service",
+    "app service plan": "Azure App Service",
+    "apim": "API Management",
+    "app gateway": "Application Gateway",
+    "appgw": "Application Gateway",
+    "waf": "Application Gateway",
+    "sql": "SQL Database",
+    "sql db": "SQL Database",
+    "sql server": "SQL Database",
+    "sql mi": "SQL Managed Instance",
+    "cosmosdb": "Azure Cosmos DB",
+    "cosmos": "Azure Cosmos DB",
+    "adf": "Azure Data Factory v2",
+    "data factory": "Azure Data Factory v2",
+    "postgres": "Azure Database for PostgreSQL",
+    "postgresql": "Azure Database for PostgreSQL",
+    "mysql": "Azure Database for MySQL",
+    "mariadb": "Azure Database for MariaDB",
+    "blob storage": "Storage",
+    "blob": "Storage",
+    "storage account": "Storage",
+    "storage accounts": "Storage",
+    "data lake storage": "Storage",
+    "adls": "Storage",
+    "files": "Storage",
+    "cdn": "Content Delivery Network",
+    "redis": "Redis Cache",
+    "cache for redis": "Redis Cache",
+    "monitor": "Azure Monitor",
+    "app insights": "Application Insights",
+    "log analytics workspace": "Log Analytics",
+    "defender": "Microsoft Defender for Cloud",
+    "defender for cloud": "Microsoft Defender for Cloud",
+    "security center": "Microsoft Defender for Cloud",
+    "openai": "Cognitive Services",
+    "ai services": "Cognitive Services",
+    "cognitive service": "Cognitive Services",
+    "event hub": "Event Hubs",
+    "service bus messaging": "Service Bus",
+    "vpn": "VPN Gateway",
+    "synapse": "Azure Synapse Analytics",
+    "databricks": "Azure Databricks",
+    "aci": "Container Instances",
+    "container apps": "Azure Container Apps",
+    "purview": "Azure Purview",
+    "fabric": "Microsoft Fabric",
+    "ml": "Machine Learning Studio",
+    "machine learning": "Machine Learning Studio",
+}
+
+# Ordinary phrases that only count as a service mention in free text after "Azure" or "Microsoft"
+AMBIGUOUS_MENTIONS = {"ai services", "cloud services", "data share", "machine learning", "media services",
+                      "phone numbers", "quantum computing", "security center", "sql server", "web app", "web apps"}
+
+# Bump when find_mentions or the resolution rules change, to invalidate services lists cached by version
+RESOLVER_RULES_VERSION = "2"
+
+MAX_MENTION_WORDS = 6
+
+
+def normalize_name(name):
+    """'Azure App-Service ' -> 'app service'."""
+    tokens = re.sub(r"[^a-z0-9]+", " ", (name or "").lower()).split()
+    return " ".join(token for token in tokens if token not in NOISE_WORDS)
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def dice(a, b):
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def word_overlap(query_words, entry_words):
+    """
+    Share of the words on both sides with a counterpart on the other side, allowing typos:
+    'nat gateway' vs 'vpn gateway' is 0.5, 'standard' vs 'standard page blob' is 0.5.
+    """
+    query_trigrams = [trigrams(word) for word in query_words]
+    entry_trigrams = [trigrams(word) for word in entry_words]
+    same = [[a == b or dice(a, b) >= WORD_MATCH_MIN_SCORE for b in entry_trigrams] for a in query_trigrams]
+    covered = sum(map(any, same)) + sum(map(any, zip(*same)))
+    return covered / (len(query_words) + len(entry_words))
+
+
+class ServiceResolver:
+    """
+    Resolves a service name written by the LLM to a catalog serviceName.
+
+    Lookups go, in order, through exact normalised service names, the synonym table,
+    exact product names, and a trigram index over service and product names scored by
+    Dice similarity times the share of words the name and the entry have in common. SKU names
+    only confirm a candidate: a fuzzy candidate offering the SKU given with the name
+    gains SERVICE_MATCH_SKU_BONUS, and a bare SKU name scores SKU_ONLY_SCORE. Every
+    answer carries a confidence score in [0, 1]; names scoring below
+    SERVICE_MATCH_MIN_SCORE resolve to None. Results are memoised, so repeated names
+    cost a dict lookup.
+    """
+
+    def __init__(self, vocabulary):
+        """:param vocabulary: (serviceName, productName, skuName) tuples of the catalog."""
+        vocabulary_rows = list(vocabulary)
+        self.services = {}
+        self.products = {}
+        sku_services = defaultdict(Counter)
+        for service_name, product_name, sku_name in vocabulary_rows:
+            if not service_name:
+                continue
+            self.services.setdefault(normalize_name(service_name), service_name)
+            if product_name:
+                self.products.setdefault(normalize_name(product_name), service_name)
+            if sku_name:
+                sku_services[normalize_name(sku_name)][service_name] += 1
+        # Services offering each SKU, most frequent first
+        self.skus = {sku: [service for service, _ in counts.most_common()] for sku, counts in sku_services.items()}
+
+        # Trigram postings over service names (weight 1) and product names (weight 0.95)
+        self.entries = []
+        self.postings = defaultdict(list)
+        for names, source, weight in ((self.services, "service", 1.0), (self.products, "product", 0.95)):
+            for normalized, service_name in names.items():
+                entry_trigrams = trigrams(normalized)
+                entry_id = len(self.entries)
+                self.entries.append((normalized, service_name, source, weight, len(entry_trigrams)))
+                for trigram in entry_trigrams:
+                    self.postings[trigram].append(entry_id)
+
+        # Phrases that name a service in free text (find_mentions)
+        self.mention_keywords = dict(self.services)
+        for synonym, service_name in SYNONYMS.items():
+            target = normalize_name(service_name)
+            if target in self.services:
+                self.mention_keywords.setdefault(synonym, self.services[target])
+
+        # Identifies the vocabulary, tables and rules, for caches of results derived from them
+        fingerprint = hashlib.sha256(RESOLVER_RULES_VERSION.encode("utf-8"))
+        for row in sorted(repr(tuple(row)) for row in vocabulary_rows):
+            fingerprint.update(row.encode("utf-8"))
+        fingerprint.update(repr((sorted(SYNONYMS.items()), sorted(AMBIGUOUS_MENTIONS))).encode("utf-8"))
+        self.version = fingerprint.hexdigest()[:16]
+
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+
+    @classmethod
+    def from_source(cls, source):
+        """A resolver over a PriceCatalog's or PriceStore's vocabulary."""
+        return cls(source.vocabulary())
+
+    def resolve(self, name, sku_name=None, min_score=SERVICE_MATCH_MIN_SCORE):
+        """
+        The best ServiceMatch for ``name``, or None when nothing scores ``min_score``.
+
+        :param sku_name: The SKU given with the name, if any; favours candidates offering it.
+        """
+        key = (name, sku_name)
+        match = self._memo.get(key)
+        if match is None:
+            match = self._resolve(name, sku_name)
+            with self._memo_lock:
+                if len(self._memo) > 10000:
+                    self._memo.clear()
+                self._memo[key] = match
+        return match if match.service_name and match.score >= min_score else None
+
+    def find_mentions(self, text):
+        """
+        Catalog services named verbatim in free text (service names and synonyms, longest
+        phrase first), in order of first mention. A single word only counts right after
+        "Azure" or "Microsoft" ('Azure Firewall', not 'firewall rules'), as do the
+        AMBIGUOUS_MENTIONS phrases; other multi-word names count on their own.
+        """
+        tokens = re.sub(r"[^a-z0-9]+", " ", (text or "").lower()).split()
+        mentions = []
+        position = 0
+        prefixed = False
+        while position < len(tokens):
+            if tokens[position] in NOISE_WORDS:
+                prefixed = True
+                position += 1
+                continue
+            phrase = self._longest_keyword(tokens, position)
+            if phrase and (prefixed or (" " in phrase and phrase not in AMBIGUOUS_MENTIONS)):
+                if self.mention_keywords[phrase] not in mentions:
+                    mentions.append(self.mention_keywords[phrase])
+            position += len(phrase.split()) if phrase else 1
+            prefixed = False
+        return mentions
+
+    def _longest_keyword(self, tokens, position):
+        """The longest mention keyword starting at ``tokens[position]``, or None."""
+        for length in range(min(MAX_MENTION_WORDS, len(tokens) - position), 0, -1):
+            words = tokens[position:position + length]
+            phrase = " ".join(words)
+            if phrase in self.mention_keywords and NOISE_WORDS.isdisjoint(words):
+                return phrase
+        return None
+
+    def _resolve(self, name, sku_name=None):
+        normalized = normalize_name(name)
+        if not normalized:
+            return ServiceMatch(None, 0.0, None, None)
+        if normalized in self.services:
+            return ServiceMatch(self.services[normalized], 1.0, normalized, "service")
+        synonym = normalize_name(SYNONYMS.get(normalized))
+        if synonym and synonym in self.services:
+            return ServiceMatch(self.services[synonym], 1.0, normalized, "synonym")
+        if normalized in self.products:
+            return ServiceMatch(self.products[normalized], 0.95, normalized, "product")
+
+        sku_services = set(self.skus.get(normalize_name(sku_name), ())) if sku_name else set()
+        query_trigrams = trigrams(normalized)
+        query_words = normalized.split()
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self.postings.get(trigram, ()))
+        best = ServiceMatch(None, 0.0, None, None)
+        for entry_id, count in shared.items():
+            entry_name, service_name, source, weight, entry_size = self.entries[entry_id]
+            bonus = SERVICE_MATCH_SKU_BONUS if service_name in sku_services else 0.0
+            score = weight * 2 * count / (len(query_trigrams) + entry_size)
+            if score + bonus <= best.score:
+                continue
+            score = min(score * word_overlap(query_words, entry_name.split()) + bonus, 0.9 if bonus else 1.0)
+            if score > best.score:
+                best = ServiceMatch(service_name, round(score, 3), entry_name, source)
+
+        if normalized in self.skus and best.score < SKU_ONLY_SCORE:
+            return ServiceMatch(self.skus[normalized][0], SKU_ONLY_SCORE, normalized, "sku")
+        return best
@@ -0,0 +1,140 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from decouple import config
+from django.conf import settings
+
+
+def default_cache_path(file_name):
+    """Path of a cache database under CACHE_DIR (``.cache`` in the project root by default)."""
+    cache_dir = config("CACHE_DIR", default=str(Path(settings.BASE_DIR) / ".cache"))
+    return str(Path(cache_dir) / file_name)
+
+
+class SQLiteCache:
+    """
+    Small persistent key/value cache on SQLite with per-entry TTL and LRU eviction.
+
+    Values are stored as JSON. Several caches can share one database file through
+    different namespaces, and WAL mode lets every worker process on the instance use
+    it concurrently. Hit and miss counters are kept per instance (per process).
+    """
+
+    def __init__(self, path, namespace, ttl_seconds, max_entries):
+        self.path = path
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def get(self, key):
+        """Return the cached value, or None when missing or expired."""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key)).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                                 (self.namespace, key))
+                self._count(hit=False)
+                return None
+
+            conn.execute("UPDATE cache_entries SET last_access = ? WHERE namespace = ? AND key = ?",
+                         (now, self.namespace, key))
+        self._count(hit=True)
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl_seconds=None):
+        now = time.time()
+        expires_at = now + (ttl_seconds or self.ttl_seconds)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), expires_at, now))
+
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % 100 == 1
+        if evict:
+            self.evict()
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones beyond max_entries."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND expires_at < ?",
+                         (self.namespace, time.time()))
+            conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                "SELECT key FROM cache_entries WHERE namespace = ? ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.namespace, self.namespace, self.max_entries))
+
+    def stats(self):
+        return {"namespace": self.namespace, "hits": self.hits, "misses": self.misses}
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            self._initialize(conn)
+        return _ClosingConnection(conn)
+
+    def _initialize(self, conn):
+        with self._lock:
+            if self._initialized:
+                return
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, last_access REAL NOT NULL, PRIMARY KEY (namespace, key))")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_entries_lru ON cache_entries (namespace, last_access)")
+            conn.commit()
+            self._initialized = True
+
+
+class _ClosingConnection:
+    """Context manager that commits (or rolls back) and always closes the connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.conn.close()
+        return False
+
+
+def open_cache(file_name, namespace, ttl_seconds, max_entries):
+    """Create a SQLiteCache under CACHE_DIR, making sure the directory exists."""
+    path = default_cache_path(file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return SQLiteCache(path, namespace, ttl_seconds, max_entries)
@@ -0,0 +1,118 @@
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from decouple import config
+
+from .graph_client import graph_client
+
+
+class ProjectStatusWriter:
+    """
+    Writes Project list fields (CurrentStep, LoggingStatus) from a background thread.
+
+    ``update`` only records the new values and returns at once. Pending values are kept
+    per project, so updates that arrive close together (within STATUS_COALESCE_SECONDS)
+    are sent as one PATCH, with the latest value of each field winning. A single writer
+    thread delivers the PATCHes in arrival order; a failed PATCH is put back with a due
+    time (exponential backoff) and retried then, while other projects keep being written.
+    """
+
+    def __init__(self, coalesce_seconds=None, max_attempts=None):
+        self.coalesce_seconds = coalesce_seconds if coalesce_seconds is not None else config(
+            "STATUS_COALESCE_SECONDS", default=0.5, cast=float)
+        self.max_attempts = max_attempts or config("STATUS_MAX_ATTEMPTS", default=3, cast=int)
+        self._pending = OrderedDict()  # project_id -> {field: value}
+        self._due = {}  # project_id -> time.monotonic() before which it is not sent
+        self._attempts = {}
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def update(self, project_id, fields):
+        """Queue field values for a project's list item."""
+        project_id = str(project_id)
+        with self._condition:
+            if project_id not in self._pending:
+                # Let a burst of updates collapse into one PATCH
+                self._due[project_id] = time.monotonic() + self.coalesce_seconds
+            self._pending.setdefault(project_id, {}).update(fields)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="project-status-writer", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def flush(self, timeout=30):
+        """Wait until everything queued so far is written; returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._pending or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                project_id = self._next_due()
+                while project_id is None:
+                    self._condition.wait(self._seconds_until_due())
+                    project_id = self._next_due()
+                fields = self._pending.pop(project_id)
+                self._due.pop(project_id, None)
+                self._in_flight += 1
+            try:
+                self._patch(project_id, fields)
+                self._attempts.pop(project_id, None)
+            except Exception as e:
+                self._retry_later(project_id, fields, e)
+            finally:
+                with self._condition:
+                    self._in_flight -= 1
+                    self._condition.notify_all()
+
+    def _next_due(self):
+        """The first pending project whose due time has come (caller holds the condition)."""
+        now = time.monotonic()
+        for project_id in self._pending:
+            if self._due.get(project_id, 0) <= now:
+                return project_id
+        return None
+
+    def _seconds_until_due(self):
+        if not self._pending:
+            return None
+        return max(min(self._due.get(project_id, 0) for project_id in self._pending) - time.monotonic(), 0)
+
+    def _patch(self, project_id, fields):
+        site_id = config("SITE_ID")
+        project_list_id = config("PROJECT_LIST")
+        update_url = f"/sites/{site_id}/lists/{project_list_id}/items/{project_id}/fields"
+        response = graph_client.patch(update_url, json=fields)
+        if response.status_code != 200:
+            raise Exception(f"Failed to update {', '.join(fields)}: {response.text}")
+
+    def _retry_later(self, project_id, fields, error):
+        attempts = self._attempts.get(project_id, 0) + 1
+        if attempts >= self.max_attempts:
+            self._attempts.pop(project_id, None)
+            logging.error(f"Giving up on status update {fields} for project {project_id}: {error}")
+            return
+
+        self._attempts[project_id] = attempts
+        logging.warning(f"Status update for project {project_id} failed (attempt {attempts}): {error}")
+        with self._condition:
+            # Values queued meanwhile are newer and win; the project keeps its place at the front
+            merged = dict(fields)
+            merged.update(self._pending.get(project_id, {}))
+            self._pending[project_id] = merged
+            self._pending.move_to_end(project_id, last=False)
+            self._due[project_id] = time.monotonic() + min(2 ** attempts, 10)
+
+
+status_writer = ProjectStatusWriter()
+atexit.register(status_writer.flush, 10)
@@ -1,3 +1,1224 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import httpx
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from . import common, copilot_pool, copilot_utils, cost_estimation_json, cost_services, drive_index, jobs, utils
+from .content_cache import ContentCache, ItemNotFound
+from .graph_client import GraphBatch, GraphClient
+from .html_extract import BOILERPLATE_PATTERN, extract_main_content
+from .metrics import REGISTRY, span
+from . import views
+from .models import DriveDeltaState, DriveItemIndex, Job
+from .pipeline import Pipeline
+from .price_catalog import PriceCatalog, get_price_catalog
+from .price_store import PriceStore, new_run_id
+from .price_table import PriceTable, summarize_costs
+from .service_resolver import ServiceResolver
+from .sqlite_cache import SQLiteCache
+from .status_writer import ProjectStatusWriter
+from .token_provider import SharedTokenStore, TokenProvider
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, content=b"", headers=None):
+        self.status_code = status_code
+        self.body = body or {}
+        self.text = json.dumps(self.body)
+        self.content = content
+        self.headers = headers or {}
+
+    def json(self):
+        return self.body
+
+
+class FakeGraph:
+    """Serves canned Graph responses by URL and records the URLs requested."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requested = []
+
+    def get(self, url, access_token=None, **kwargs):
+        self.requested.append(url)
+        return self.pages[url]
+
+
+class FakeClock:
+    """Stands in for time.monotonic and a limiter's Condition: waiting moves the clock on."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.waits = []
+
+    def __call__(self):
+        return self.now
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def wait(self, timeout):
+        self.waits.append(timeout)
+        self.now += timeout
+
+
+class ConversationPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.started = 0
+        self.expires_in = 3600
+
+        def start_session():
+            self.started += 1
+            return (f"conversation {self.started}", f"token {self.started}", self.expires_in), None
+
+        for patcher in (mock.patch.object(copilot_pool, "initiate_session_copilot", side_effect=start_session),
+                        mock.patch.object(copilot_pool, "initiate_conversation"),
+                        mock.patch.object(copilot_pool.ConversationPool, "_ensure_started")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_leases_come_from_the_pool_and_are_replaced(self):
+        pool = copilot_pool.ConversationPool(size=2, refresh_margin_seconds=300)
+        pool._fill()
+        self.assertEqual(pool.lease().conv_id, "conversation 1")
+        self.assertTrue(pool._wake.is_set())
+        pool._fill()
+        self.assertEqual(self.started, 3)
+        self.assertEqual([c.conv_id for c in pool._ready], ["conversation 2", "conversation 3"])
+
+    def test_empty_pool_starts_a_conversation_inline(self):
+        pool = copilot_pool.ConversationPool(size=1, refresh_margin_seconds=300)
+        self.assertEqual(pool.lease().conv_id, "conversation 1")
+        self.assertEqual(len(pool._ready), 0)
+
+    def test_disabled_pool_always_starts_inline(self):
+        pool = copilot_pool.ConversationPool(size=0, refresh_margin_seconds=300)
+        pool.lease()
+        pool.lease()
+        self.assertEqual(self.started, 2)
+        copilot_pool.ConversationPool._ensure_started.assert_not_called()
+
+    def test_nearly_expired_conversations_are_skipped(self):
+        pool = copilot_pool.ConversationPool(size=1, refresh_margin_seconds=300, min_ttl_seconds=60)
+        self.expires_in = 30
+        pool._fill()
+        self.expires_in = 3600
+        self.assertEqual(pool.lease().conv_id, "conversation 2")
+
+    def test_expiring_tokens_are_refreshed_and_failures_dropped(self):
+        pool = copilot_pool.ConversationPool(size=2, refresh_margin_seconds=300)
+        self.expires_in = 120
+        pool._fill()
+        refreshed = [("fresh token", 3600), Exception("conversation ended")]
+        with mock.patch.object(copilot_pool, "refresh_directline_token", side_effect=refreshed):
+            pool._refresh_expiring()
+        self.assertEqual([(c.conv_id, c.token) for c in pool._ready], [("conversation 1", "fresh token")])
+        self.assertGreater(pool._ready[0].ttl(), 300)
+
+
+class URLSummaryTests(SimpleTestCase):
+    def setUp(self):
+        self.memo = {}
+        self.pages = {}
+        self.fetched = []
+        self.active = self.max_active = 0
+        cache = mock.Mock(get=self.memo.get, set=self.memo.__setitem__)
+        for patcher in (mock.patch.object(common, "get_summary_cache", return_value=cache),
+                        mock.patch.dict(os.environ, {"URL_SUMMARY_CONCURRENCY": "2"})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def serve(self, request):
+        url = str(request.url)
+        self.fetched.append(url)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        if url not in self.pages:
+            return httpx.Response(404)
+        return httpx.Response(200, text=self.pages[url], headers={"content-type": "text/plain"})
+
+    def summarize(self, text, summarize_text=lambda client, content: f"about {content}"):
+        transport = httpx.MockTransport(self.serve)
+        async_client = httpx.AsyncClient
+        with mock.patch.object(common.httpx, "AsyncClient",
+                               lambda **kwargs: async_client(transport=transport, **kwargs)), \
+                mock.patch.object(common, "summarize_text_with_gpt", side_effect=summarize_text) as summarizer:
+            return common.get_summaries_from_text(None, text), summarizer
+
+    def test_urls_are_summarised_concurrently_in_order(self):
+        urls = [f"https://learn.microsoft.com/{index}" for index in range(5)]
+        self.pages = {url: f"page {url[-1]}" for url in urls[:4]}
+        summaries, _ = self.summarize("See " + ", ".join(urls) + ".")
+        self.assertEqual(summaries, "".join(f"Summary for {url}:\nabout page {url[-1]}\n\n" for url in urls[:4]))
+        self.assertEqual(self.max_active, 2)
+
+    def test_memoised_summary_is_reused_while_fresh(self):
+        url = "https://learn.microsoft.com/a"
+        self.pages = {url: "page"}
+        first, _ = self.summarize(url)
+        second, summarizer = self.summarize(url)
+        self.assertEqual(first, second)
+        self.assertEqual(self.fetched, [url])
+        summarizer.assert_not_called()
+
+    def test_stale_summary_is_reused_when_the_content_is_unchanged(self):
+        url = "https://learn.microsoft.com/a"
+        self.pages = {url: "page"}
+        self.summarize(url)
+        with mock.patch.dict(os.environ, {"URL_SUMMARY_FRESH_SECONDS": "0"}):
+            _, summarizer = self.summarize(url)
+            summarizer.assert_not_called()
+            self.pages[url] = "new page"
+            summaries, summarizer = self.summarize(url)
+        summarizer.assert_called_once()
+        self.assertIn("about new page", summaries)
+
+    def test_failed_summaries_are_not_memoised(self):
+        url = "https://learn.microsoft.com/a"
+        self.pages = {url: "page"}
+        summaries, _ = self.summarize(url, lambda client, content: "Error during summarization: timeout")
+        self.assertFalse(common.summaries_complete(summaries))
+        self.assertEqual(self.memo, {})
+
+
+class OCRRateLimitTests(SimpleTestCase):
+    def limiter(self, tokens_per_minute):
+        clock = FakeClock()
+        patcher = mock.patch("ai_app.common.time.monotonic", clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        limiter = common.TokenRateLimiter(tokens_per_minute)
+        limiter._condition = clock
+        return limiter, clock
+
+    def test_budget_is_spent_then_waits_for_the_refill(self):
+        limiter, clock = self.limiter(600)
+        limiter.acquire(600)
+        self.assertEqual(clock.waits, [])
+        limiter.acquire(300)
+        self.assertEqual(clock.waits, [30.0])
+
+    def test_idle_time_refills_up_to_capacity(self):
+        limiter, clock = self.limiter(600)
+        limiter.acquire(600)
+        clock.now += 3600
+        limiter.acquire(600)
+        self.assertEqual(clock.waits, [])
+        self.assertEqual(limiter.tokens, 0)
+
+    def test_oversized_request_is_capped_at_capacity(self):
+        limiter, clock = self.limiter(600)
+        limiter.acquire(5000)
+        self.assertEqual(clock.waits, [])
+
+    def test_failed_page_is_retried_within_the_budget(self):
+        send = mock.Mock(side_effect=[Exception("429"), "page text"])
+        with mock.patch.object(utils.CommonUtils, "send_image_to_gpt", send), \
+                mock.patch.object(utils.vision_rate_limiter, "acquire") as acquire, \
+                mock.patch("ai_app.utils.time.sleep") as sleep:
+            self.assertEqual(utils.ocr_page_with_retry(None, "image", "prompt", 3), "page text")
+        self.assertEqual(acquire.call_count, 2)
+        sleep.assert_called_once_with(2)
+
+    def test_pages_are_returned_by_number_and_images_released(self):
+        images = {page_number: mock.Mock() for page_number in (1, 2, 3)}
+        with mock.patch.object(utils, "iter_pdf_pages", return_value=iter(images.items())), \
+                mock.patch.object(utils, "ocr_page_with_retry",
+                                  side_effect=lambda client, image, prompt, page_number: f"page {page_number}"):
+            results = utils.ocr_pdf_pages("file.pdf", "prompt", None)
+        self.assertEqual(results, {1: "page 1", 2: "page 2", 3: "page 3"})
+        self.assertTrue(all(image.close.called for image in images.values()))
+
+
+class PDFRenderWindowTests(SimpleTestCase):
+    def render(self, page_numbers=None, page_count=0, window="2"):
+        calls = []
+
+        def convert(pdf_path, first_page, last_page, **options):
+            calls.append((first_page, last_page))
+            return [f"image {page}" for page in range(first_page, last_page + 1)]
+
+        with mock.patch.dict(os.environ, {"PDF_RENDER_WINDOW": window}), \
+                mock.patch.object(utils, "convert_from_path", side_effect=convert), \
+                mock.patch.object(utils, "pdfinfo_from_path", return_value={"Pages": page_count}):
+            pages = utils.iter_pdf_pages("file.pdf", page_numbers)
+            self.assertEqual(calls, [])
+            return list(pages), calls
+
+    def test_all_pages_are_rendered_a_window_at_a_time(self):
+        pages, calls = self.render(page_count=5)
+        self.assertEqual(pages, [(page, f"image {page}") for page in range(1, 6)])
+        self.assertEqual(calls, [(1, 2), (3, 4), (5, 5)])
+
+    def test_selected_pages_are_grouped_into_contiguous_ranges(self):
+        pages, calls = self.render(page_numbers=[2, 3, 4, 7, 9, 10], window="3")
+        self.assertEqual([page for page, _ in pages], [2, 3, 4, 7, 9, 10])
+        self.assertEqual(calls, [(2, 4), (7, 7), (9, 10)])
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "cache.sqlite3")
+        self.now = 1000.0
+        patcher = mock.patch("ai_app.sqlite_cache.time.time", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_values_round_trip_and_are_counted(self):
+        cache = SQLiteCache(self.path, "test", ttl_seconds=60, max_entries=10)
+        self.assertIsNone(cache.get("key"))
+        cache.set("key", {"answer": [1, 2]})
+        self.assertEqual(cache.get("key"), {"answer": [1, 2]})
+        self.assertEqual(cache.stats(), {"namespace": "test", "hits": 1, "misses": 1})
+
+    def test_entries_expire_after_their_ttl(self):
+        cache = SQLiteCache(self.path, "test", ttl_seconds=60, max_entries=10)
+        cache.set("default", "a")
+        cache.set("long", "b", ttl_seconds=600)
+        self.now += 61
+        self.assertIsNone(cache.get("default"))
+        self.assertEqual(cache.get("long"), "b")
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = SQLiteCache(self.path, "test", ttl_seconds=60, max_entries=2)
+        for key in ("a", "b", "c"):
+            self.now += 1
+            cache.set(key, key)
+        self.now += 1
+        cache.get("a")
+        cache.evict()
+        self.assertEqual([cache.get(key) for key in ("a", "b", "c")], ["a", None, "c"])
+
+    def test_namespaces_share_a_file_without_mixing(self):
+        first = SQLiteCache(self.path, "first", ttl_seconds=60, max_entries=1)
+        second = SQLiteCache(self.path, "second", ttl_seconds=60, max_entries=1)
+        first.set("key", "first")
+        second.set("key", "second")
+        first.evict()
+        self.assertEqual((first.get("key"), second.get("key")), ("first", "second"))
+
+
+class GraphClientTests(SimpleTestCase):
+    def client_with(self, responses):
+        client = GraphClient(max_retries=2, pool_size=1, http2=False)
+        sent = []
+
+        def send(method, url, headers, params, json, data, timeout):
+            sent.append(headers.get("Authorization"))
+            return responses.pop(0)
+
+        client._send = send
+        return client, sent
+
+    def test_throttled_request_honours_retry_after(self):
+        client, sent = self.client_with([FakeResponse(429, headers={"Retry-After": "3"}), FakeResponse(200)])
+        with mock.patch("ai_app.graph_client.time.sleep") as sleep:
+            response = client.get("/me", access_token="t1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(sent), 2)
+        sleep.assert_called_once_with(3.0)
+
+    def test_retries_stop_after_max_retries(self):
+        client, sent = self.client_with([FakeResponse(503, headers={"Retry-After": "0"}) for _ in range(4)])
+        with mock.patch("ai_app.graph_client.time.sleep"):
+            self.assertEqual(client.get("/me", access_token="t1").status_code, 503)
+        self.assertEqual(len(sent), 3)
+
+    def test_unauthorized_retries_once_with_a_fresh_token(self):
+        client, sent = self.client_with([FakeResponse(401), FakeResponse(401)])
+        with mock.patch("ai_app.graph_client.token_provider") as provider:
+            provider.get_token.return_value = "fresh"
+            self.assertEqual(client.get("/me", access_token="expired").status_code, 401)
+        provider.invalidate.assert_called_once()
+        self.assertEqual(sent, ["Bearer expired", "Bearer fresh"])
+
+    def test_pre_authenticated_urls_get_no_token(self):
+        client, sent = self.client_with([FakeResponse(200)])
+        client.get("https://tenant.sharepoint.com/download?tempauth=x", authenticate=False)
+        self.assertEqual(sent, [None])
+
+
+class GraphBatchTests(SimpleTestCase):
+    def execute(self, batch, status_for=lambda request, call: 200):
+        posted = []
+
+        def post(path, json=None, access_token=None):
+            posted.append(json["requests"])
+            responses = [{"id": r["id"], "status": status_for(r, len(posted)), "headers": {}, "body": {}}
+                         for r in json["requests"]]
+            return FakeResponse(200, {"responses": responses})
+
+        batch.client.post = post
+        with mock.patch("ai_app.graph_client.time.sleep"):
+            return batch.execute(access_token="t"), posted
+
+    def test_requests_are_sent_in_batches_of_twenty(self):
+        batch = GraphBatch(GraphClient(pool_size=1, http2=False))
+        for index in range(45):
+            batch.add("GET", f"/items/{index}")
+        results, posted = self.execute(batch)
+        self.assertEqual([len(chunk) for chunk in posted], [20, 20, 5])
+        self.assertEqual(len(results), 45)
+        self.assertEqual(posted[0][0]["url"], "/items/0")
+
+    def test_dependency_chains_stay_in_one_batch(self):
+        batch = GraphBatch(GraphClient(pool_size=1, http2=False))
+        for index in range(15):
+            batch.add("GET", f"/items/{index}")
+        first = batch.add("POST", "/items", body={"name": "a"})
+        for _ in range(9):
+            first = batch.add("GET", "/items/a", depends_on=first)
+        _, posted = self.execute(batch)
+        self.assertEqual([len(chunk) for chunk in posted], [15, 10])
+
+    def test_overlong_dependency_chain_is_refused(self):
+        batch = GraphBatch(GraphClient(pool_size=1, http2=False))
+        previous = None
+        for index in range(21):
+            previous = batch.add("GET", f"/items/{index}", depends_on=previous)
+        with self.assertRaises(ValueError):
+            self.execute(batch)
+
+    def test_throttled_request_and_its_dependents_are_retried(self):
+        batch = GraphBatch(GraphClient(max_retries=2, pool_size=1, http2=False))
+        done = batch.add("GET", "/items/done")
+        throttled = batch.add("GET", "/items/throttled", depends_on=done)
+        dependent = batch.add("GET", "/items/dependent", depends_on=throttled)
+
+        def status_for(request, call):
+            if call == 1 and request["id"] == throttled:
+                return 429
+            return 424 if call == 1 and request["id"] == dependent else 200
+
+        results, posted = self.execute(batch, status_for)
+        self.assertEqual(len(posted), 2)
+        self.assertEqual([r["id"] for r in posted[1]], [throttled, dependent])
+        self.assertNotIn("dependsOn", posted[1][0])
+        self.assertEqual(posted[1][1]["dependsOn"], [throttled])
+        self.assertTrue(all(result.ok for result in results.values()))
+
+
+class TokenProviderTests(SimpleTestCase):
+    def setUp(self):
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(work_dir.cleanup)
+        self.store_path = os.path.join(work_dir.name, "tokens.sqlite3")
+        self.store = SharedTokenStore(self.store_path)
+        self.fetches = []
+
+    def provider(self, lock_wait_seconds=1):
+        provider = TokenProvider(store=self.store, skew_seconds=60, lock_wait_seconds=lock_wait_seconds)
+
+        def fetch(scope):
+            self.fetches.append(scope)
+            return f"token-{len(self.fetches)}", time.time() + 3600
+
+        provider._fetch = fetch
+        return provider
+
+    def test_workers_share_one_refresh(self):
+        self.assertEqual(self.provider().get_token(), "token-1")
+        self.assertEqual(self.provider().get_token(), "token-1")
+        self.assertEqual(len(self.fetches), 1)
+
+    def test_tokens_are_not_stored_in_plaintext(self):
+        self.provider().get_token()
+        with open(self.store_path, "rb") as f:
+            self.assertNotIn(b"token-1", f.read())
+
+    def test_lock_is_only_released_by_its_owner(self):
+        self.assertTrue(self.store.acquire("key", "first", 10))
+        self.assertFalse(self.store.acquire("key", "second", 10))
+        self.store.release("key", "second")
+        self.assertFalse(self.store.acquire("key", "second", 10))
+        self.store.release("key", "first")
+        self.assertTrue(self.store.acquire("key", "second", 10))
+
+    def test_expired_lock_lapses(self):
+        self.assertTrue(self.store.acquire("key", "crashed", -1))
+        self.assertTrue(self.store.acquire("key", "second", 10))
+
+    def test_waiting_worker_keeps_foreign_lock(self):
+        provider = self.provider(lock_wait_seconds=0.3)
+        key = provider._cache_key("https://graph.microsoft.com/.default")
+        self.assertTrue(self.store.acquire(key, "other-worker", 10))
+
+        # The lock holder never publishes a token: fetch after the wait, leave its lock alone
+        self.assertEqual(provider.get_token(), "token-1")
+        self.assertFalse(self.store.acquire(key, "third-worker", 10))
+
+
+def drive_file(item_id, name, modified="2025-01-01T00:00:00Z"):
+    return {"id": item_id, "name": name, "file": {}, "eTag": f"e-{item_id}", "cTag": f"c-{item_id}",
+            "lastModifiedDateTime": modified}
+
+
+class DriveIndexSyncTests(TestCase):
+    drive = "drive-1"
+    full = "/drives/drive-1/root/delta"
+
+    def sync(self, pages):
+        graph = FakeGraph(pages)
+        with mock.patch.object(drive_index, "graph_client", graph):
+            drive_index.sync_drive(self.drive, "-")
+        return graph
+
+    def indexed(self):
+        return dict(DriveItemIndex.objects.filter(drive_id=self.drive).values_list("project_id", "item_id"))
+
+    def test_first_sync_follows_next_link_and_stores_delta_link(self):
+        graph = self.sync({
+            self.full: FakeResponse(200, {"value": [drive_file("a", "Discovery Questionnaire-70.docx")],
+                                          "@odata.nextLink": "page-2"}),
+            "page-2": FakeResponse(200, {"value": [drive_file("b", "Discovery Questionnaire-71.docx"),
+                                                   {"id": "folder", "name": "Archive-72", "folder": {}}],
+                                         "@odata.deltaLink": "delta-1"}),
+        })
+        self.assertEqual(graph.requested, [self.full, "page-2"])
+        self.assertEqual(self.indexed(), {"70": "a", "71": "b"})
+        self.assertEqual(DriveDeltaState.objects.get(drive_id=self.drive).delta_link, "delta-1")
+
+    def test_incremental_sync_applies_changes_and_deletions(self):
+        self.sync({self.full: FakeResponse(200, {
+            "value": [drive_file("a", "Discovery Questionnaire-70.docx"),
+                      drive_file("b", "Discovery Questionnaire-71.docx")],
+            "@odata.deltaLink": "delta-1"})})
+
+        graph = self.sync({"delta-1": FakeResponse(200, {
+            "value": [{"id": "a", "deleted": {"state": "deleted"}},
+                      drive_file("c", "Discovery Questionnaire-72.docx")],
+            "@odata.deltaLink": "delta-2"})})
+        self.assertEqual(graph.requested, ["delta-1"])
+        self.assertEqual(self.indexed(), {"71": "b", "72": "c"})
+        self.assertEqual(DriveDeltaState.objects.get(drive_id=self.drive).delta_link, "delta-2")
+
+    def test_expired_delta_token_resyncs_from_scratch(self):
+        self.sync({self.full: FakeResponse(200, {
+            "value": [drive_file("a", "Discovery Questionnaire-70.docx")], "@odata.deltaLink": "delta-1"})})
+
+        graph = self.sync({
+            "delta-1": FakeResponse(410, {"error": {"code": "resyncRequired"}}),
+            self.full: FakeResponse(200, {"value": [drive_file("b", "Discovery Questionnaire-71.docx")],
+                                          "@odata.deltaLink": "delta-2"}),
+        })
+        self.assertEqual(graph.requested, ["delta-1", self.full])
+        self.assertEqual(self.indexed(), {"71": "b"})
+        self.assertEqual(DriveDeltaState.objects.get(drive_id=self.drive).delta_link, "delta-2")
+
+    def test_lookup_of_missing_project_raises(self):
+        graph = FakeGraph({self.full: FakeResponse(200, {"value": [], "@odata.deltaLink": "delta-1"}),
+                           "delta-1": FakeResponse(200, {"value": [], "@odata.deltaLink": "delta-1"})})
+        with mock.patch.object(drive_index, "graph_client", graph):
+            with self.assertRaises(drive_index.ProjectFileNotFound):
+                drive_index.lookup(self.drive, "70", "-")
+
+
+HTML_FIXTURES = Path(__file__).parent / "testdata" / "html"
+
+
+class ContentCacheTests(SimpleTestCase):
+    def setUp(self):
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(work_dir.cleanup)
+        self.cache = ContentCache(work_dir.name, max_memory_bytes=1024, max_disk_bytes=4096)
+        self.requests = []
+        self.responses = []
+
+        def get(url, headers=None, access_token=None):
+            self.requests.append(dict(headers or {}))
+            return self.responses.pop(0)
+
+        patcher = mock.patch("ai_app.content_cache.graph_client", mock.Mock(get=get))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_known_tag_is_served_without_a_request(self):
+        self.responses = [FakeResponse(200, content=b"v1")]
+        self.assertEqual(self.cache.get_content("d", "i", tag="c1"), b"v1")
+        self.assertEqual(self.cache.get_content("d", "i", tag="c1"), b"v1")
+        self.assertEqual(len(self.requests), 1)
+
+    def test_changed_tag_revalidates_and_304_keeps_content(self):
+        self.responses = [FakeResponse(200, content=b"v1"), FakeResponse(304),
+                          FakeResponse(200, content=b"v2", headers={"ETag": "e2"})]
+        self.cache.get_content("d", "i", tag="c1")
+        self.assertEqual(self.cache.get_content("d", "i", tag="c2"), b"v1")
+        self.assertEqual(self.requests[1], {"If-None-Match": "c1"})
+        self.assertEqual(self.cache.get_content("d", "i"), b"v2")
+
+    def test_disk_tier_survives_a_new_cache(self):
+        self.responses = [FakeResponse(200, content=b"v1")]
+        self.cache.get_content("d", "i", tag="c1")
+        restarted = ContentCache(self.cache.directory, max_memory_bytes=1024, max_disk_bytes=4096)
+        self.assertEqual(restarted.get_content("d", "i", tag="c1"), b"v1")
+        self.assertEqual(len(self.requests), 1)
+
+    def test_missing_item_is_invalidated(self):
+        self.responses = [FakeResponse(200, content=b"v1"), FakeResponse(404), FakeResponse(200, content=b"v3")]
+        self.cache.get_content("d", "i", tag="c1")
+        with self.assertRaises(ItemNotFound):
+            self.cache.get_content("d", "i")
+        self.cache.get_content("d", "i", tag="c1")
+        self.assertEqual(self.requests[2], {})
+
+    def test_indexed_file_content_passes_the_indexed_ctag(self):
+        entry = DriveItemIndex(drive_id="d", project_id="70", item_id="i", ctag="c9")
+        with mock.patch.object(utils.drive_index, "lookup", return_value=entry), \
+                mock.patch.object(utils.content_cache, "get_content", return_value=b"docx") as get_content:
+            self.assertEqual(utils.get_indexed_file_content("token", "d", "70", "-"), b"docx")
+        get_content.assert_called_once_with("d", "i", tag="c9", access_token="token")
+
+
+class HtmlExtractTests(SimpleTestCase):
+    # Main text that must survive, and boilerplate that must not, per saved page
+    expectations = {
+        "learn_sharepoint_limits.html": (
+            ["# SharePoint limits",
+             "## Storage limits",
+             "storage for each site can be up to 25 TB",
+             "## Create a shared access signature",
+             "without sharing your account keys",
+             "## Protocol support",
+             "## Recommendations for Azure integration",
+             "Sync up to 300,000 files"],
+            ["cookies", "Skip to main content", "Share via", "Was this page helpful", "Table of contents",
+             "Additional resources", "Trademarks", "msDocs"],
+        ),
+        "learn_app_service_overview.html": (
+            ["# App Service overview",
+             "Built-in autoscale support",
+             "## Share your apps across regions",
+             "behind Azure Front Door"],
+            ["Share on LinkedIn", "Start free", "In this article", "Learn / Azure", "jquery", "cookies"],
+        ),
+        "blog_landing_zone.html": (
+            ["# Planning an Azure landing zone",
+             "consistent foundation for identity",
+             "Azure Firewall in the hub",
+             "Microsoft Entra ID groups"],
+            ["Popular posts", "Tweet", "Related posts", "Home Blog", "font-family"],
+        ),
+    }
+
+    def test_main_text_survives_on_saved_pages(self):
+        self.assertEqual(sorted(path.name for path in HTML_FIXTURES.glob("*.html")), sorted(self.expectations))
+        for name, (kept, removed) in self.expectations.items():
+            with self.subTest(page=name):
+                text, stats = extract_main_content((HTML_FIXTURES / name).read_text(encoding="utf-8"))
+                for fragment in kept:
+                    self.assertIn(fragment, text)
+                for fragment in removed:
+                    self.assertNotIn(fragment, text)
+                self.assertGreater(stats["saved_tokens"], 0)
+
+    def test_repeated_blocks_are_dropped(self):
+        text, _ = extract_main_content((HTML_FIXTURES / "learn_app_service_overview.html").read_text(encoding="utf-8"))
+        self.assertEqual(text.count("natively on Linux"), 1)
+
+    def test_boilerplate_pattern_matches_whole_words(self):
+        for marker in ["sharepoint-online-limits", "create-a-shared-access-signature", "protocol-support",
+                       "stock-info", "recommendations-for-azure"]:
+            self.assertIsNone(BOILERPLATE_PATTERN.search(marker), marker)
+        for marker in ["share-button-container", "breadcrumbs", "feedback-section", "cookie-consent", "toc"]:
+            self.assertIsNotNone(BOILERPLATE_PATTERN.search(marker), marker)
+
+
+class FakeDirectLineSession:
+    def __init__(self, activities):
+        self.activities = activities
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        return FakeResponse(200, {"activities": self.activities, "watermark": "1"})
+
+
+class CopilotResponseTests(SimpleTestCase):
+    def test_echoed_question_is_not_taken_as_the_answer(self):
+        activities = [
+            # Direct Line replaced our from.id: only the activity id identifies the echo
+            {"id": "conv|0001", "type": "message", "from": {"id": "dl_generated"}, "text": "The question, repeated"},
+            {"id": "conv|0002", "type": "message", "from": {"id": "bot"}, "replyToId": "conv|0001",
+             "text": "The answer"},
+            {"id": "conv|0003", "type": "endOfConversation", "from": {"id": "bot"}},
+        ]
+        with mock.patch.object(copilot_utils.requests, "Session", lambda: FakeDirectLineSession(activities)):
+            answer = copilot_utils.get_response_from_bot("token", "entra", "conv", "conv|0001", deadline_seconds=5)
+        self.assertEqual(answer, ("The answer", True))
+
+    def test_message_is_sent_with_lowercase_from(self):
+        response = FakeResponse(200, {"id": "conv|0001"})
+        with mock.patch.object(copilot_utils.requests, "request", return_value=response) as request:
+            self.assertEqual(copilot_utils.send_user_msg("token", "conv", "hello", "entra"), "conv|0001")
+        self.assertEqual(request.call_args.kwargs["json"]["from"], {"id": copilot_utils.USER_ID})
+
+    def test_complete_process_fails_when_the_message_is_not_accepted(self):
+        conversation = mock.Mock(token="token", conv_id="conv")
+        with mock.patch("ai_app.copilot_pool.conversation_pool") as pool, \
+                mock.patch.object(copilot_utils, "get_access_token", return_value="entra"), \
+                mock.patch.object(copilot_utils.requests, "request", return_value=FakeResponse(502, {})), \
+                mock.patch.object(copilot_utils, "get_response_from_bot") as get_response:
+            pool.lease.return_value = conversation
+            bot_response, success = copilot_utils.complete_process("hello")
+        self.assertFalse(success)
+        get_response.assert_not_called()
+
+
+class SolutionPlayFanOutTests(SimpleTestCase):
+    plays = json.dumps({"SolutionPlays": ["Data Platform", "Modern Work", "Security"]})
+
+    def fan_out(self, answers):
+        failed_plays = []
+        with mock.patch.object(copilot_utils, "get_solution_play_answer", side_effect=answers.get):
+            response, success = copilot_utils.complete_process_for_solution_plays(self.plays, failed_plays)
+        return response, success, failed_plays
+
+    def test_partial_answers_are_merged_and_failures_reported(self):
+        response, success, failed_plays = self.fan_out(
+            {"Data Platform": "https://learn.microsoft.com/a", "Modern Work": "", "Security": "https://b"})
+        self.assertTrue(success)
+        self.assertEqual(failed_plays, ["Modern Work"])
+        self.assertIn("Data Platform:", response)
+        self.assertNotIn("Modern Work:", response)
+
+    def test_no_answer_is_a_failure(self):
+        response, success, failed_plays = self.fan_out({"Data Platform": "", "Modern Work": "", "Security": ""})
+        self.assertFalse(success)
+        self.assertEqual(failed_plays, ["Data Platform", "Modern Work", "Security"])
+
+
+class SubmitJobTests(TestCase):
+    def test_inline_by_default_with_the_original_response(self):
+        with mock.patch.object(views, "run_wbs_job", return_value="SUCCESS"):
+            response = views.submit_job("wbs", {"project_id": "70"})
+        self.assertEqual((response.status_code, response.data), (200, "SUCCESS"))
+
+    def test_inline_failure_uses_the_endpoint_error_body(self):
+        with mock.patch.object(views, "run_sow_job", side_effect=Exception("boom")):
+            response = views.submit_job("sow", {"project_id": "70"}, error_body=lambda error: f"Error: {error}")
+        self.assertEqual((response.status_code, response.data), (500, "Error: boom"))
+
+    def test_stale_running_job_is_taken_over(self):
+        payload = {"project_id": "72"}
+        stale_since = timezone.now() - timedelta(hours=5)
+        dead = Job.objects.create(kind="wbs", payload=payload, dedup_key=jobs.request_key("wbs", payload),
+                                  status=Job.RUNNING, attempts=1, started_at=stale_since, heartbeat_at=stale_since)
+        with mock.patch.object(views, "run_wbs_job", return_value="SUCCESS") as handler:
+            response = views.submit_job("wbs", payload)
+        self.assertEqual((response.status_code, response.data), (200, "SUCCESS"))
+        handler.assert_called_once()
+        dead.refresh_from_db()
+        self.assertEqual(dead.status, Job.SUCCEEDED)
+
+    def test_inline_duplicate_waits_for_the_running_job(self):
+        payload = {"project_id": "73"}
+        running = Job.objects.create(kind="wbs", payload=payload, dedup_key=jobs.request_key("wbs", payload),
+                                     status=Job.RUNNING, attempts=1, heartbeat_at=timezone.now())
+
+        def finish(seconds):
+            Job.objects.filter(pk=running.pk).update(status=Job.SUCCEEDED, result="SUCCESS",
+                                                     finished_at=timezone.now())
+
+        with mock.patch.object(views, "run_wbs_job") as handler, \
+                mock.patch.object(jobs.time, "sleep", side_effect=finish):
+            response = views.submit_job("wbs", payload)
+        self.assertEqual((response.status_code, response.data), (200, "SUCCESS"))
+        handler.assert_not_called()
+
+    @mock.patch.dict(os.environ, {"JOB_QUEUE_ENABLED": "True"})
+    def test_queued_when_enabled(self):
+        response = views.submit_job("wbs", {"project_id": "71"})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Job.objects.get(job_id=response.data["job_id"]).status, Job.QUEUED)
+
+
+class ProjectStatusWriterTests(SimpleTestCase):
+    def writer(self, failing=()):
+        writer = ProjectStatusWriter(coalesce_seconds=0.05, max_attempts=3)
+        writer.patched = []
+
+        def patch(project_id, fields):
+            if project_id in failing:
+                raise Exception("503 Service Unavailable")
+            writer.patched.append((project_id, fields))
+
+        writer._patch = patch
+        return writer
+
+    def test_burst_is_coalesced_into_one_patch(self):
+        writer = self.writer()
+        writer.update(70, {"CurrentStep": "WBS"})
+        writer.update(70, {"LoggingStatus": "Cost Estimation - WBS"})
+        writer.update(70, {"CurrentStep": "WBS Review"})
+        self.assertTrue(writer.flush(5))
+        self.assertEqual(writer.patched, [("70", {"CurrentStep": "WBS Review",
+                                                  "LoggingStatus": "Cost Estimation - WBS"})])
+
+    def test_failing_project_does_not_hold_up_others(self):
+        writer = self.writer(failing={"70"})
+        writer.update(70, {"CurrentStep": "WBS"})
+        time.sleep(0.1)  # project 70 has failed once and waits for its retry
+        writer.update(71, {"CurrentStep": "SOW"})
+
+        deadline = time.monotonic() + 1
+        while not writer.patched and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(writer.patched, [("71", {"CurrentStep": "SOW"})])
+        self.assertIn("70", writer._pending)
+
+
+class FixturePriceServer:
+    """A local stand-in for the Retail Prices API serving pages of items from memory."""
+
+    def __init__(self, pages, failures=0):
+        self.pages = pages
+        self.failures = failures
+        self.queries = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                server.queries.append(query)
+                if server.failures:
+                    server.failures -= 1
+                    self.send_response(429)
+                    self.send_header("Retry-After", "0")
+                    self.end_headers()
+                    return
+                page = int(query.get("page", ["1"])[0])
+                body = {"Items": server.pages[page - 1],
+                        "NextPageLink": f"{server.url}?page={page + 1}" if page < len(server.pages) else None}
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/api/retail/prices"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def price_item(meter_id, price, effective, service="Virtual Machines", region="eastus", sku="D2s v3"):
+    return {"meterId": meter_id, "skuId": f"{meter_id}-sku", "type": "Consumption", "retailPrice": price,
+            "unitPrice": price, "tierMinimumUnits": 0.0, "effectiveStartDate": effective, "serviceName": service,
+            "armRegionName": region, "skuName": sku, "productName": f"{service} product", "unitOfMeasure": "1 Hour"}
+
+
+class IngestAzurePricesTests(SimpleTestCase):
+    def setUp(self):
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(work_dir.cleanup)
+        self.store_path = os.path.join(work_dir.name, "prices.sqlite3")
+
+    def ingest(self, pages, failures=0, server=None, **options):
+        if server is None:
+            server = FixturePriceServer(pages, failures)
+            self.addCleanup(server.close)
+        with mock.patch("ai_app.management.commands.ingest_azure_prices.random.random", return_value=0):
+            call_command("ingest_azure_prices", url=server.url, store=self.store_path, stdout=StringIO(), **options)
+        return server
+
+    def prices(self):
+        return {item["meterId"]: item["retailPrice"] for item in PriceStore(self.store_path).find()}
+
+    def test_full_run_follows_next_page_link(self):
+        server = self.ingest([[price_item("m1", 1.0, "2024-01-01T00:00:00Z")],
+                              [price_item("m2", 2.0, "2024-01-01T00:00:00Z", service="Storage")]])
+        self.assertEqual(len(server.queries), 2)
+        self.assertNotIn("$filter", server.queries[0])
+        self.assertEqual(self.prices(), {"m1": 1.0, "m2": 2.0})
+        store = PriceStore(self.store_path)
+        self.assertEqual([item["meterId"] for item in store.find(service_name="Storage", regions=["East US"])], ["m2"])
+        self.assertTrue(store.status()[0])
+
+    def test_refresh_only_requests_newer_prices(self):
+        self.ingest([[price_item("m1", 1.0, "2024-01-01T00:00:00Z"), price_item("m2", 2.0, "2024-01-01T00:00:00Z")]])
+        server = self.ingest([[price_item("m1", 1.5, "2099-01-01T00:00:00Z"),
+                               price_item("m2", 9.0, "2023-01-01T00:00:00Z")]])
+        self.assertIn("effectiveStartDate ge ", server.queries[0]["$filter"][0])
+        # A newer price replaces the stored one, an older one does not; unseen meters stay
+        self.assertEqual(self.prices(), {"m1": 1.5, "m2": 2.0})
+
+    def test_full_run_removes_retired_meters(self):
+        self.ingest([[price_item("m1", 1.0, "2024-01-01T00:00:00Z"), price_item("m2", 2.0, "2024-01-01T00:00:00Z")]])
+        server = self.ingest([[price_item("m1", 1.0, "2024-01-01T00:00:00Z")]], full=True)
+        self.assertNotIn("$filter", server.queries[0])
+        self.assertEqual(self.prices(), {"m1": 1.0})
+
+    def test_throttled_page_is_retried(self):
+        server = self.ingest([[price_item("m1", 1.0, "2024-01-01T00:00:00Z")]], failures=1)
+        self.assertEqual(len(server.queries), 2)
+        self.assertEqual(self.prices(), {"m1": 1.0})
+
+    def test_interrupted_run_resumes(self):
+        pages = [[price_item("m1", 1.0, "2024-01-01T00:00:00Z")], [price_item("m2", 2.0, "2024-01-01T00:00:00Z")]]
+        server = self.ingest(pages, max_pages=1)
+        self.assertEqual(self.prices(), {"m1": 1.0})
+        self.ingest(pages, server=server, resume=True)
+        # The resumed run continues from the stored NextPageLink
+        self.assertEqual([query.get("page") for query in server.queries], [None, ["2"]])
+        self.assertEqual(self.prices(), {"m1": 1.0, "m2": 2.0})
+
+    def test_other_currencies_are_refused(self):
+        with self.assertRaises(CommandError):
+            self.ingest([[price_item("m1", 0.9, "2024-01-01T00:00:00Z")]], currency="EUR")
+        self.assertFalse(PriceStore(self.store_path).exists())
+
+    def test_status_is_rechecked_after_interval(self):
+        store = PriceStore(self.store_path)
+        self.assertEqual(store.status(), (False, None))
+        self.ingest([[price_item("m1", 1.0, "2024-01-01T00:00:00Z")]])
+        with mock.patch.object(store, "exists", side_effect=AssertionError("store reopened")):
+            self.assertEqual(store.status(), (False, None))
+        with mock.patch("ai_app.price_store.PRICE_STORE_RECHECK_SECONDS", 0):
+            populated, last_run = store.status()
+        self.assertTrue(populated)
+        self.assertEqual(last_run, PriceStore(self.store_path).last_run())
+
+
+class PriceCatalogTests(SimpleTestCase):
+    items = [
+        price_item("m1", 0.1, "2024-01-01T00:00:00Z"),
+        price_item("m2", 0.2, "2024-01-01T00:00:00Z", region="westeurope"),
+        price_item("m3", 0.3, "2024-01-01T00:00:00Z", sku="D4s v3"),
+        {**price_item("m4", 0.05, "2024-01-01T00:00:00Z"), "type": "Reservation"},
+        price_item("m5", 5.0, "2024-01-01T00:00:00Z", service="Storage", sku="Hot LRS"),
+    ]
+
+    def meters(self, **filters):
+        return [item["meterId"] for item in PriceCatalog(self.items).find(**filters)]
+
+    def test_filters_combine_and_keep_the_price_sheet_order(self):
+        self.assertEqual(self.meters(service_name="Virtual Machines"), ["m1", "m2", "m3", "m4"])
+        self.assertEqual(self.meters(service_name="Virtual Machines", sku_name="D2s v3", price_type="Consumption"),
+                         ["m1", "m2"])
+        self.assertEqual(self.meters(service_name="Storage", sku_name="D2s v3"), [])
+        self.assertEqual(self.meters(), ["m1", "m2", "m3", "m4", "m5"])
+
+    def test_regions_match_in_any_spelling(self):
+        self.assertEqual(self.meters(regions=["East US"], sku_name="D2s v3"), ["m1", "m4"])
+        self.assertEqual(self.meters(regions=["West Europe", "eastus"], price_type="Consumption"),
+                         ["m1", "m2", "m3", "m5"])
+
+    def test_results_are_copies(self):
+        catalog = PriceCatalog(self.items)
+        catalog.find(service_name="Storage")[0]["retailPrice"] = 0
+        self.assertEqual(catalog.find(service_name="Storage")[0]["retailPrice"], 5.0)
+
+    def test_catalog_is_reloaded_only_when_the_file_changes(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            path = os.path.join(work_dir, "prices.json")
+            Path(path).write_text(json.dumps({"Items": self.items[:1]}))
+            first = get_price_catalog(path)
+            self.assertIs(get_price_catalog(path), first)
+
+            Path(path).write_text(json.dumps({"Items": self.items}))
+            os.utime(path, (time.time() + 10, time.time() + 10))
+            self.assertEqual(len(get_price_catalog(path).items), len(self.items))
+
+
+class PriceTableTests(SimpleTestCase):
+    items = [
+        price_item("m1", 0.1, "2024-01-01T00:00:00Z"),
+        price_item("m2", 0.3, "2024-01-01T00:00:00Z"),
+        price_item("m3", 0.2, "2024-01-01T00:00:00Z", region="westeurope"),
+        price_item("m4", 5.0, "2024-01-01T00:00:00Z", service="Storage", sku="Hot LRS"),
+    ]
+
+    def test_shared_table_summary_matches_the_records(self):
+        catalog = PriceCatalog(self.items)
+        records = catalog.find(service_name="Virtual Machines", regions=["East US"])
+        summary = summarize_costs(records)
+        self.assertEqual([(row["minUnitPrice"], row["medianUnitPrice"], row["maxUnitPrice"]) for row in summary],
+                         [(0.1, 0.2, 0.3)])
+        self.assertEqual(summarize_costs(records, lambda service: PriceTable.from_source(catalog, service)), summary)
+
+    def test_table_from_store_matches_catalog(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            store = PriceStore(os.path.join(work_dir, "prices.sqlite3"))
+            conn = store.connect()
+            with conn:
+                store.upsert(conn, self.items, new_run_id())
+            conn.close()
+            for service_name in ("Virtual Machines", "Storage"):
+                self.assertEqual(PriceTable.from_source(store, service_name).summarize(),
+                                 PriceTable.from_source(PriceCatalog(self.items), service_name).summarize())
+
+    def test_only_priced_services_are_loaded_and_kept(self):
+        catalog = PriceCatalog(self.items)
+        with mock.patch.object(cost_estimation_json, "get_price_source", return_value=catalog), \
+                mock.patch.object(cost_estimation_json, "PRICE_TABLE_MAX_SERVICES", 1), \
+                mock.patch.dict(cost_estimation_json._derived, clear=True):
+            self.assertEqual(len(cost_estimation_json.get_price_table("Virtual Machines")), 3)
+            self.assertEqual(len(cost_estimation_json.get_price_table("Storage")), 1)
+            self.assertEqual(list(cost_estimation_json._derived), [("price_table", "Storage")])
+
+
+class CatalogResolverTestCase(SimpleTestCase):
+    """Tests over the resolver of the bundled cost_estimation.json."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.catalog = PriceCatalog.from_file(Path(__file__).resolve().parents[1] / "cost_estimation.json")
+        cls.resolver = ServiceResolver.from_source(cls.catalog)
+
+
+class ServiceResolverTests(CatalogResolverTestCase):
+    def resolved(self, name, sku_name=None):
+        match = self.resolver.resolve(name, sku_name)
+        return match.service_name if match else None
+
+    def test_catalog_names_resolve_to_their_service(self):
+        for service_name in self.catalog.service_names():
+            self.assertEqual(self.resolved(service_name), service_name)
+        for service_name, product_name, _ in self.catalog.vocabulary():
+            if product_name:
+                self.assertEqual(self.resolved(product_name), service_name, product_name)
+
+    def test_misspelt_and_abbreviated_names(self):
+        self.assertEqual(self.resolved("Applicaton Gateway"), "Application Gateway")
+        self.assertEqual(self.resolved("Azure SQL Databse"), "SQL Database")
+        self.assertEqual(self.resolved("App Service"), "Azure App Service")
+        self.assertEqual(self.resolved("VMs"), "Virtual Machines")
+
+    def test_sku_names_alone_do_not_resolve(self):
+        for sku_name in ("Private Link", "Standard", "Premium", "Basic", "Free"):
+            self.assertIsNone(self.resolved(sku_name), sku_name)
+
+    def test_services_outside_the_catalog_do_not_resolve(self):
+        for name in ("NAT Gateway", "Virtual Network", "Azure Kubernetes Service", "Key Vault", "Azure DevOps"):
+            self.assertIsNone(self.resolved(name), name)
+
+    def test_sku_confirms_a_candidate(self):
+        self.assertIsNone(self.resolved("Event Hub Namespace"))
+        self.assertEqual(self.resolved("Event Hub Namespace", "Standard"), "Event Hubs")
+        self.assertIsNone(self.resolved("Event Hub Namespace", "Hot LRS"))
+
+
+class ServiceMentionTests(CatalogResolverTestCase):
+    review_text = ("We need support for firewall rules on our on-prem network and sentinel-like monitoring. "
+                   "Databricks notebooks, HDInsight legacy, ExpressRoute circuits.")
+
+    def test_ordinary_words_are_not_mentions(self):
+        self.assertEqual(self.resolver.find_mentions(self.review_text), [])
+
+    def test_prefixed_and_multi_word_names_are_mentions(self):
+        text = "Azure Firewall in front of App Service; logs in Log Analytics and Microsoft Sentinel. Azure SQL."
+        self.assertEqual(self.resolver.find_mentions(text),
+                         ["Azure Firewall", "Azure App Service", "Log Analytics", "Sentinel", "SQL Database"])
+
+    def test_services_list_asks_the_model_and_is_keyed_by_resolver_version(self):
+        cache = {}
+        fake_cache = mock.Mock(get=cache.get, set=cache.__setitem__)
+        ask_model = mock.Mock(return_value=[{"serviceName": "Azure Databricks"}])
+        with mock.patch.object(cost_services, "get_services_cache", return_value=fake_cache):
+            services = cost_services.get_services_list(self.review_text, self.resolver, ask_model)
+            self.assertEqual(services, [{"serviceName": "Azure Databricks"}])
+            ask_model.assert_called_once_with([])
+
+            cost_services.get_services_list(self.review_text, self.resolver, ask_model)
+            self.assertEqual(ask_model.call_count, 1)
+            with mock.patch.object(self.resolver, "version", "other catalog"):
+                cost_services.get_services_list(self.review_text, self.resolver, ask_model)
+            self.assertEqual(ask_model.call_count, 2)
+
+
+class FakeArtifactStore:
+    """An ArtifactStore that starts empty and records the stages it saves."""
+
+    def __init__(self):
+        self.saved = []
+
+    def input_hash(self, stage, inputs):
+        return stage
+
+    def load(self, stage, input_hash):
+        return False, None
+
+    def save(self, stage, input_hash, output):
+        self.saved.append(stage)
+
+
+class MemoryArtifactStore(FakeArtifactStore):
+    """A FakeArtifactStore that keeps what it saves, keyed by the stage inputs."""
+
+    def __init__(self):
+        super().__init__()
+        self.outputs = {}
+
+    def input_hash(self, stage, inputs):
+        return json.dumps(inputs, sort_keys=True)
+
+    def load(self, stage, input_hash):
+        key = (stage, input_hash)
+        return key in self.outputs, self.outputs.get(key)
+
+    def save(self, stage, input_hash, output):
+        super().save(stage, input_hash, output)
+        self.outputs[(stage, input_hash)] = output
+
+
+class PipelineTests(SimpleTestCase):
+    def test_stages_get_their_dependencies_and_run_in_order(self):
+        done = []
+        pipeline = Pipeline("test", max_workers=2, on_stage_done=done.append)
+        pipeline.add("a", lambda: 1)
+        pipeline.add("b", lambda a: a + 1, depends_on=["a"])
+        pipeline.add("c", lambda a, b: a + b, depends_on=["a", "b"])
+        self.assertEqual(pipeline.run(), {"a": 1, "b": 2, "c": 3})
+        self.assertEqual(done, ["a", "b", "c"])
+
+    def test_independent_stages_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+        pipeline = Pipeline("test", max_workers=2)
+        pipeline.add("left", barrier.wait)
+        pipeline.add("right", barrier.wait)
+        self.assertEqual(set(pipeline.run()), {"left", "right"})
+
+    def test_unknown_dependency_is_refused(self):
+        with self.assertRaises(ValueError):
+            Pipeline("test").add("b", lambda a: a, depends_on=["a"])
+
+    def test_failure_is_reraised_and_dependents_do_not_run(self):
+        dependent = mock.Mock()
+        pipeline = Pipeline("test", max_workers=2)
+        pipeline.add("a", mock.Mock(side_effect=RuntimeError("boom")))
+        pipeline.add("b", dependent, depends_on=["a"])
+        with self.assertRaisesMessage(RuntimeError, "boom"):
+            pipeline.run()
+        dependent.assert_not_called()
+
+    def test_checkpointed_stage_is_reused_for_the_same_inputs(self):
+        artifacts = MemoryArtifactStore()
+        stage = mock.Mock(return_value="output")
+
+        def run(value):
+            pipeline = Pipeline("test", artifacts=artifacts)
+            pipeline.add("input", lambda: value)
+            pipeline.add("stage", stage, depends_on=["input"], checkpoint=True)
+            return pipeline.run()["stage"], pipeline.reused
+
+        self.assertEqual(run(1), ("output", set()))
+        self.assertEqual(run(1), ("output", {"stage"}))
+        run(2)
+        self.assertEqual(stage.call_count, 2)
+
+    def test_checkpoint_predicate_skips_unwanted_outputs(self):
+        artifacts = MemoryArtifactStore()
+        pipeline = Pipeline("test", artifacts=artifacts)
+        pipeline.add("kept", lambda: "ok", checkpoint=True)
+        pipeline.add("dropped", lambda: "", checkpoint=bool)
+        pipeline.run()
+        self.assertEqual(artifacts.saved, ["kept"])
+
+
+class WBSPipelineTests(CatalogResolverTestCase):
+    questionnaire_text = "Hosting on Azure App Service with Event Hubs and Azure Firewall."
+
+    def run_pipeline(self, failed_plays=(), summaries="Summary for https://learn.microsoft.com/a:\nok\n\n"):
+        view = views.WBSDocumentView()
+        artifacts = FakeArtifactStore()
+        prompts = []
+
+        def copilot(solution_plays, failed):
+            failed.extend(failed_plays)
+            return "answer", True
+
+        with mock.patch.object(views, "get_discovery_questionnaire", return_value=(self.questionnaire_text, True)), \
+                mock.patch.object(views, "ArtifactStore", lambda pipeline, project_id: artifacts), \
+                mock.patch.object(views, "update_current_step"), \
+                mock.patch.object(views, "get_service_resolver", return_value=self.resolver), \
+                mock.patch.object(cost_services, "get_services_cache", return_value=mock.Mock(get=lambda key: None)), \
+                mock.patch.object(views, "get_service_app_records",
+                                  side_effect=lambda service_name: [{"serviceName": service_name}]), \
+                mock.patch.object(views, "gpt_response_for_sp", return_value=["Solution Play"]), \
+                mock.patch.object(views, "complete_process_for_solution_plays", side_effect=copilot), \
+                mock.patch.object(views, "get_summaries_from_text", return_value=summaries), \
+                mock.patch.object(views, "get_template", return_value="template.xlsx"), \
+                mock.patch.object(views.CommonUtils, "load_prompt_without_remarks",
+                                  side_effect=lambda questionnaire, *args: prompts.append(questionnaire) or "prompt"), \
+                mock.patch.object(view, "wbs_process", return_value=True):
+            results = view.build_pipeline("token", "70", "", None).run()
+        return results, prompts, artifacts.saved
+
+    def test_questionnaire_text_reaches_costs_and_prompt(self):
+        results, prompts, saved = self.run_pipeline()
+        self.assertEqual(results["questionnaire"], self.questionnaire_text)
+        self.assertEqual([cost["serviceName"] for cost in results["costs"]],
+                         ["Azure App Service", "Event Hubs", "Azure Firewall"])
+        self.assertEqual(prompts, [self.questionnaire_text])
+        self.assertEqual(sorted(saved), ["copilot", "costs", "solution_plays", "summaries"])
+
+    def test_partial_copilot_answer_and_failed_summaries_are_not_checkpointed(self):
+        _, _, saved = self.run_pipeline(failed_plays=["Security"],
+                                        summaries="Error retrieving content from https://a: timeout\n\n")
+        self.assertEqual(sorted(saved), ["costs", "solution_plays"])
+
+
+class MetricsTests(SimpleTestCase):
+    def sample(self, metric, **labels):
+        return REGISTRY.get_sample_value(metric, labels) or 0
+
+    def test_metrics_are_hidden_without_a_token(self):
+        with mock.patch.dict(os.environ, {"METRICS_TOKEN": ""}):
+            self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+    @mock.patch.dict(os.environ, {"METRICS_TOKEN": "scrape-secret"})
+    def test_metrics_require_the_bearer_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong").status_code, 401)
+
+        before = self.sample("ecf_http_request_seconds_count", endpoint="metrics", method="GET", status="200")
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape-secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"ecf_span_seconds", response.content)
+        # The middleware attributes the request to the resolved view name
+        self.assertEqual(self.sample("ecf_http_request_seconds_count", endpoint="metrics", method="GET",
+                                     status="200"), before + 1)
+
+    def test_span_records_duration_and_errors(self):
+        labels = {"endpoint": "none", "kind": "function", "name": "test_span"}
+        before = self.sample("ecf_span_seconds_count", **labels)
+        errors_before = self.sample("ecf_span_errors_total", **labels)
+        with span("function", "test_span"):
+            pass
+        with self.assertRaises(ValueError):
+            with span("function", "test_span"):
+                raise ValueError("boom")
+        self.assertEqual(self.sample("ecf_span_seconds_count", **labels), before + 2)
+        self.assertEqual(self.sample("ecf_span_errors_total", **labels), errors_before + 1)
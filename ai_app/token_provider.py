@@ -0,0 +1,230 @@
+import base64
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import requests
+from cryptography.fernet import Fernet, InvalidToken
+from decouple import config
+
+from .sqlite_cache import _ClosingConnection, default_cache_path
+
+GRAPH_SCOPE = "https://graph.microsoft.com/.default"
+
+
+class SharedTokenStore:
+    """
+    Tokens and refresh locks shared by every worker process on the instance, in SQLite.
+
+    Tokens are stored Fernet-encrypted with a key derived from the client secret, so the
+    file never holds a usable bearer token. A refresh lock is a row inserted atomically;
+    it carries its owner and an expiry, so only the owner releases it and a lock left by
+    a crashed worker lapses on its own.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config("TOKEN_STORE_PATH", default=default_cache_path("tokens.sqlite3"))
+        self._initialized = False
+
+    def get(self, key):
+        """(access_token, expires_at) or None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT token, expires_at FROM tokens WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return self._fernet(key).decrypt(row[0]).decode("utf-8"), row[1]
+        except InvalidToken:
+            # Written with another client secret
+            return None
+
+    def set(self, key, access_token, expires_at):
+        token = self._fernet(key).encrypt(access_token.encode("utf-8"))
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO tokens (key, token, expires_at) VALUES (?, ?, ?)",
+                         (key, token, expires_at))
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM tokens WHERE key = ?", (key,))
+
+    def acquire(self, key, owner, ttl_seconds):
+        """Take the refresh lock for ``key``; False while another live owner holds it."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM token_locks WHERE key = ? AND expires_at < ?", (key, now))
+            cursor = conn.execute("INSERT OR IGNORE INTO token_locks (key, owner, expires_at) VALUES (?, ?, ?)",
+                                  (key, owner, now + ttl_seconds))
+            return cursor.rowcount == 1
+
+    def release(self, key, owner):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM token_locks WHERE key = ? AND owner = ?", (key, owner))
+
+    @staticmethod
+    def _fernet(key):
+        secret = f"{config('CLIENT_SECRET')}|{key}".encode("utf-8")
+        return Fernet(base64.urlsafe_b64encode(hashlib.sha256(secret).digest()))
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, token BLOB NOT NULL, "
+                         "expires_at REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS token_locks (key TEXT PRIMARY KEY, owner TEXT NOT NULL, "
+                         "expires_at REAL NOT NULL)")
+            conn.commit()
+            self._initialized = True
+        return _ClosingConnection(conn)
+
+
+class TokenProvider:
+    """
+    Client-credentials token provider that caches one Entra ID access token per scope.
+
+    Tokens are kept in-process until shortly before ``expires_in`` and mirrored into a
+    SharedTokenStore so every gunicorn worker reuses the same token. Concurrent callers
+    asking for the same scope, in this process or another worker, wait on a single
+    refresh (single-flight) instead of each doing their own POST to
+    login.microsoftonline.com.
+    """
+
+    def __init__(self, store=None, skew_seconds=None, lock_wait_seconds=10):
+        self.store = store or SharedTokenStore()
+        self.skew_seconds = skew_seconds if skew_seconds is not None else config(
+            "TOKEN_EXPIRY_SKEW_SECONDS", default=300, cast=int)
+        self.lock_wait_seconds = lock_wait_seconds
+        self._tokens = {}  # scope -> (access_token, expires_at)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def get_token(self, scope=GRAPH_SCOPE):
+        """Return a valid access token for the scope, refreshing it only when needed."""
+        token = self._valid(self._tokens.get(scope))
+        if token:
+            return token
+
+        with self._lock_for(scope):
+            # Another thread may have refreshed the token while we were waiting
+            token = self._valid(self._tokens.get(scope))
+            if token:
+                return token
+
+            token = self._from_shared_cache(scope)
+            if token:
+                return token
+
+            return self._refresh(scope)
+
+    def invalidate(self, scope=GRAPH_SCOPE):
+        """Drop the cached token, e.g. after the API rejected it with a 401."""
+        self._tokens.pop(scope, None)
+        try:
+            self.store.delete(self._cache_key(scope))
+        except Exception as e:
+            logging.warning(f"Unable to invalidate shared token store: {e}")
+
+    def _refresh(self, scope):
+        key = self._cache_key(scope)
+        owner = uuid.uuid4().hex
+
+        # Cross-worker single-flight: whoever holds the lock fetches the token, the
+        # other workers wait for it to show up in the shared store
+        acquired = self._acquire(key, owner)
+        deadline = time.time() + self.lock_wait_seconds
+        while not acquired and time.time() < deadline:
+            time.sleep(0.2)
+            token = self._from_shared_cache(scope)
+            if token:
+                return token
+            acquired = self._acquire(key, owner)
+
+        try:
+            access_token, expires_at = self._fetch(scope)
+            self._tokens[scope] = (access_token, expires_at)
+            try:
+                self.store.set(key, access_token, expires_at)
+            except Exception as e:
+                logging.warning(f"Unable to write shared token store: {e}")
+            return access_token
+        finally:
+            if acquired:
+                self._release(key, owner)
+
+    def _acquire(self, key, owner):
+        try:
+            return self.store.acquire(key, owner, self.lock_wait_seconds)
+        except Exception as e:
+            # Without the shared store every worker refreshes on its own
+            logging.warning(f"Unable to lock shared token store: {e}")
+            return True
+
+    def _release(self, key, owner):
+        try:
+            self.store.release(key, owner)
+        except Exception as e:
+            logging.warning(f"Unable to unlock shared token store: {e}")
+
+    def _fetch(self, scope):
+        tenant_id = config("TENANT_ID")
+        url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
+        data = {
+            'grant_type': 'client_credentials',
+            'client_id': config("CLIENT_ID"),
+            'client_secret': config("CLIENT_SECRET"),
+            'scope': scope,
+        }
+        response = requests.post(url, data=data, timeout=30)
+        if response.status_code != 200:
+            raise Exception(f"Unable to get access token \n Error: {response.text}")
+
+        response_json = response.json()
+        expires_at = time.time() + int(response_json.get("expires_in", 3599))
+        return response_json.get("access_token"), expires_at
+
+    def _from_shared_cache(self, scope):
+        try:
+            entry = self.store.get(self._cache_key(scope))
+        except Exception as e:
+            logging.warning(f"Unable to read shared token store: {e}")
+            return None
+
+        token = self._valid(entry)
+        if token:
+            self._tokens[scope] = entry
+        return token
+
+    def _valid(self, entry):
+        if not entry:
+            return None
+        access_token, expires_at = entry
+        if time.time() < expires_at - self.skew_seconds:
+            return access_token
+        return None
+
+    def _lock_for(self, scope):
+        with self._locks_guard:
+            return self._locks.setdefault(scope, threading.Lock())
+
+    @staticmethod
+    def _cache_key(scope):
+        # Different app registrations must never share tokens
+        identity = f"{config('TENANT_ID')}|{config('CLIENT_ID')}|{scope}"
+        return "entra-token:" + hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+
+token_provider = TokenProvider()
+
+
+def get_access_token(scope=GRAPH_SCOPE):
+    """
+    Return a cached client-credentials access token (Graph scope by default).
+    """
+    return token_provider.get_token(scope)
@@ -1,7 +1,7 @@
 from django.urls import path
 from .views import (UploadFileToSharePointView, OAuthRedirectView, WBSDocumentView,
                     InitialFormResponseView, DiscoveryQuestionnaireAPIView,
-                    PromptResponseAPIView, SharePointFileParserView, SowApiView)
+                    PromptResponseAPIView, SharePointFileParserView, SowApiView, JobStatusView)
 
 urlpatterns = [
     path('upload-file/', UploadFileToSharePointView.as_view(), name='upload_file'),
@@ -12,5 +12,6 @@ urlpatterns = [
     path('prompt_response/', PromptResponseAPIView.as_view(), name='co-pilot-action'),
     path('sow/', SowApiView.as_view(), name='sow-generation'),
     path('taxonomy_json/', SharePointFileParserView.as_view(), name='taxonomy-parser-json'),
+    path('jobs/<uuid:job_id>/', JobStatusView.as_view(), name='job-status'),
 ]
 
@@ -2,50 +2,39 @@ import os
 import re
 import json
 import time
+import logging
 
-import requests
 from decouple import config
 from PyPDF2 import PdfReader
 from docx import Document
 import tempfile
-from .common import log_execution_time, CommonUtils
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from .common import log_execution_time, CommonUtils, vision_rate_limiter
+from . import drive_index
+from .content_cache import ItemNotFound, content_cache
+from .graph_client import graph_client
+from .status_writer import status_writer
+from .llm_cache import chat_completion
+from .token_provider import get_access_token
 import openai
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 import zipfile
 import xml.etree.ElementTree as ET
 
-def get_access_token():
-    """
-    Generate an access token using client credentials flow.
-    """
-    tenant_id = config("TENANT_ID")
-    url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
-    data = {
-        'grant_type': 'client_credentials',
-        'client_id': config("CLIENT_ID"),
-        'client_secret':config("CLIENT_SECRET"),
-        'scope': 'https://graph.microsoft.com/.default',
-    }
-    response = requests.post(url, data=data)
-    if response.status_code == 200:
-        return response.json().get('access_token')
-    else:
-        raise Exception(f"Unable to get access token \n Error: {response.text}")
-
 
 def upload_file_to_sharepoint(site_id, drive_id, folder_path, file_name, file_content):
     """
     Upload a file to SharePoint in the specified folder.
     """
     try:
-        access_token = get_access_token()
-        url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{drive_id}/root:/{folder_path}/{file_name}:/content"
+        url = f"/sites/{site_id}/drives/{drive_id}/root:/{folder_path}/{file_name}:/content"
         headers = {
-            'Authorization': f'Bearer {access_token}',
             'Content-Type': 'application/octet-stream',
         }
 
-        response = requests.put(url, headers=headers, data=file_content)
+        response = graph_client.put(url, headers=headers, data=file_content)
         if response.status_code in [200, 201]:
             return response.json()
         else:
@@ -59,9 +48,8 @@ def get_file_from_sharepoint(site_id, file_path, access_token):
     """
     Fetches a specific file from a predefined SharePoint path.
     """
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:/{file_path}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
+    url = f"/sites/{site_id}/drive/root:/{file_path}"
+    response = graph_client.get(url, access_token=access_token)
     if response.status_code == 200:
         return response.json()
     else:
@@ -73,11 +61,10 @@ def get_file_by_project_id(site_id, library_path, project_id, access_token):
     Fetches a file from a SharePoint document library where the project_id matches a file's metadata or name.
     """
     # Microsoft Graph API URL to list items in the library
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:/{library_path}:/children"
-    headers = {"Authorization": f"Bearer {access_token}"}
+    url = f"/sites/{site_id}/drive/root:/{library_path}:/children"
 
     # Fetch all items in the document library
-    response = requests.get(url, headers=headers)
+    response = graph_client.get(url, access_token=access_token)
     if response.status_code != 200:
         raise Exception(f"Failed to fetch files: {response.json()}")
 
@@ -94,11 +81,74 @@ def get_file_by_project_id(site_id, library_path, project_id, access_token):
 
 def extract_text_from_pdf(file_path):
     """Extract text from a PDF file."""
-    reader = PdfReader(file_path)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text()
-    return text
+    return extract_pdf_content(file_path)
+
+
+def get_page_form_values(page):
+    """Return 'field: value' lines for the filled form fields (widgets) on a PDF page."""
+    lines = []
+    seen = set()
+    for annotation in page.get("/Annots") or []:
+        try:
+            annotation = annotation.get_object()
+            if annotation.get("/Subtype") != "/Widget":
+                continue
+            # Radio buttons and checkboxes keep the name/value on the parent field
+            parent = annotation.get("/Parent")
+            parent = parent.get_object() if parent is not None else {}
+            name = annotation.get("/T") or parent.get("/T")
+            value = annotation.get("/V") or parent.get("/V")
+        except Exception:
+            continue
+
+        if not name or value in (None, "", "/Off") or name in seen:
+            continue
+        seen.add(name)
+        lines.append(f"{name}: {str(value).lstrip('/')}")
+    return lines
+
+
+def get_page_text_density(page, text):
+    """Non-whitespace characters per square inch of the page."""
+    width = float(page.mediabox.width) / 72
+    height = float(page.mediabox.height) / 72
+    area = max(width * height, 1)
+    return len("".join(text.split())) / area
+
+
+def extract_pdf_content(pdf_path, client=None, prompt=None):
+    """
+    Extract the content of a PDF, page by page, reading the text layer first.
+
+    Pages whose text layer (plus filled form fields) is below PDF_MIN_TEXT_DENSITY
+    characters per square inch are treated as scanned. With a client, only those
+    pages are sent to the vision model, so digitally filled PDFs need no vision calls.
+    Without one the text layer is returned as is.
+    """
+    reader = PdfReader(pdf_path)
+    min_density = config("PDF_MIN_TEXT_DENSITY", default=3.0, cast=float)
+    page_texts = {}
+    scanned_pages = []
+
+    for page_number, page in enumerate(reader.pages, start=1):
+        try:
+            text = page.extract_text() or ""
+        except Exception as e:
+            logging.warning(f"Unable to read the text layer of page {page_number}: {e}")
+            text = ""
+        form_values = get_page_form_values(page)
+        if form_values:
+            text = text + "\n" + "\n".join(form_values)
+
+        page_texts[page_number] = text.strip()
+        if client is not None and get_page_text_density(page, text) < min_density:
+            scanned_pages.append(page_number)
+
+    if scanned_pages:
+        logging.info(f"Sending {len(scanned_pages)} of {len(page_texts)} pages to the vision model")
+        page_texts.update(ocr_pdf_pages(pdf_path, prompt, client, scanned_pages))
+
+    return "\n\n".join(page_texts[page_number] for page_number in sorted(page_texts))
 
 
 def extract_text_from_docx(file_path):
@@ -131,44 +181,42 @@ def read_and_parse_documents(folder_path):
     return all_text, discovery_questionnaire_text
 
 
-def upload_questionnaire_to_sharepoint(file_path, project_id):
-    try:
-        access_token = get_access_token()
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
+def upload_and_tag_file(drive_id, file_name, file_path, fields, access_token=None):
+    """
+    Upload a file to the root of a SharePoint drive and set its list item columns.
 
-        site_id = config("SITE_ID")
-        discovery_drive = config("DISCOVERY_DRIVE")
-        # Upload the file
-        upload_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{discovery_drive}/root:/Discovery Questionnaire-{project_id}.docx:/content"
+    The upload is a single PUT followed by a single PATCH of the columns.
+    """
+    site_id = config("SITE_ID")
+    headers = {
+        "Content-Type": "application/json"
+    }
+    upload_url = f"/sites/{site_id}/drives/{drive_id}/root:/{file_name}:/content"
 
-        with open(file_path, "rb") as file:
-            response = requests.put(upload_url, headers=headers, data=file)
+    with open(file_path, "rb") as file:
+        response = graph_client.put(upload_url, headers=headers, data=file.read(), access_token=access_token)
 
-        if response.status_code not in [200, 201]:
-            raise Exception(f"Failed to upload file: {response.json()}")
+    if response.status_code not in [200, 201]:
+        raise Exception(f"Failed to upload file: {response.json()}")
 
-        # Extract the uploaded file's item ID
-        item_id = response.json().get("id")
+    # Extract the uploaded file's item ID
+    item = response.json()
+    item_id = item.get("id")
 
-        # Get existing columns
-        columns_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{discovery_drive}/items/{item_id}/listItem/fields"
-        fields_response = requests.get(columns_url, headers=headers)
+    columns_url = f"/sites/{site_id}/drives/{drive_id}/items/{item_id}/listItem/fields"
+    response = graph_client.patch(columns_url, headers=headers, json=fields, access_token=access_token)
 
-        if fields_response.status_code != 200:
-            raise Exception(f"Failed to fetch columns: {fields_response.json()}")
+    if response.status_code != 200:
+        raise Exception(f"Failed to update project_id: {response.json()}")
 
-        updated_project_id = {
-            "ProjectId":project_id
-        }
+    return item
 
-        # Update the columns
-        update_response = requests.patch(columns_url, headers=headers, json=updated_project_id)
 
-        if update_response.status_code != 200:
-            raise Exception(f"Failed to update project_id: {update_response.json()}")
+def upload_questionnaire_to_sharepoint(file_path, project_id):
+    try:
+        discovery_drive = config("DISCOVERY_DRIVE")
+        upload_and_tag_file(discovery_drive, f"Discovery Questionnaire-{project_id}.docx", file_path,
+                            {"ProjectId": project_id})
 
     except Exception as e:
         raise Exception(f"Error during SharePoint upload or update: {str(e)}")
@@ -176,93 +224,76 @@ def upload_questionnaire_to_sharepoint(file_path, project_id):
 
 def update_current_step(project_id, current_step, key="CurrentStep"):
     """
-    Updates the CurrentStep field in the Project list for the specified project_id.
+    Updates the CurrentStep (or another) field in the Project list for the specified project_id.
+    The write is queued on the status writer and does not block the caller.
     """
-    try:
-        access_token = get_access_token()
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
+    update_project_fields(project_id, {key: current_step})
 
-        site_id = config("SITE_ID")
-        project_list_id = config("PROJECT_LIST")
-        # Update URL for CurrentStep
-        update_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists/{project_list_id}/items/{project_id}/fields"
-        update_body = {key: current_step}
-
-        # PATCH request to update CurrentStep
-        response = requests.patch(update_url, headers=headers, json=update_body)
-
-        if response.status_code != 200:
-            raise Exception(f"Failed to update CurrentStep: {response.json()}")
 
-    except Exception as e:
-        raise Exception(f"Error updating CurrentStep: {str(e)}")
+def update_project_fields(project_id, fields):
+    """Queue several Project list fields, written together in one PATCH."""
+    status_writer.update(project_id, fields)
 
 
 def upload_sow_to_sharepoint(file_path, project_id):
     try:
-        access_token = get_access_token()
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-
-        site_id = config("SITE_ID")
         sow_drive = config("SOW_DRIVE")
-        # Upload the file
-        upload_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{sow_drive}/root:/SOW-{project_id}.docx:/content"
+        upload_and_tag_file(sow_drive, f"SOW-{project_id}.docx", file_path, {"ProjectId": project_id})
 
-        with open(file_path, "rb") as file:
-            response = requests.put(upload_url, headers=headers, data=file)
+    except Exception as e:
+        raise Exception(f"Error during SharePoint upload or update: {str(e)}")
 
-        if response.status_code not in [200, 201]:
-            raise Exception(f"Failed to upload file: {response.json()}")
+# Separator between the file name and the project id, e.g. 'Discovery Questionnaire-70.docx'
+DISCOVERY_DELIMITER = "-"
+INITIAL_FORM_DELIMITER = "_"
 
-        # Extract the uploaded file's item ID
-        item_id = response.json().get("id")
+# Query string that returns each drive item's list item columns with the listing itself
+EXPAND_FIELDS_PARAMS = {"$expand": "listItem($expand=fields)"}
 
-        # Get existing columns
-        columns_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{sow_drive}/items/{item_id}/listItem/fields"
-        fields_response = requests.get(columns_url, headers=headers)
 
-        if fields_response.status_code != 200:
-            raise Exception(f"Failed to fetch columns: {fields_response.json()}")
+def get_sharepoint_items(access_token, drive_url, params=None):
+    """Fetch items from the SharePoint drive URL."""
+    response = graph_client.get(drive_url, params=params, access_token=access_token)
+    response.raise_for_status()
+    return response.json()
 
-        updated_project_id = {
-            "ProjectId":project_id
-        }
 
-        # Update the columns
-        update_response = requests.patch(columns_url, headers=headers, json=updated_project_id)
+def get_items_fields(access_token, drive_id, items):
+    """
+    Return {item_id: list item fields} for drive items.
 
-        if update_response.status_code != 200:
-            raise Exception(f"Failed to update project_id: {update_response.json()}")
+    Uses the fields expanded into the listing when present; any item without them is
+    looked up in one Graph $batch call rather than one GET per item.
+    """
+    fields_by_id = {}
+    batch = graph_client.batch()
+    batch_ids = {}
 
-    except Exception as e:
-        raise Exception(f"Error during SharePoint upload or update: {str(e)}")
+    for item in items:
+        list_item = item.get("listItem")
+        if list_item and "fields" in list_item:
+            fields_by_id[item["id"]] = list_item["fields"]
+        else:
+            batch_ids[item["id"]] = batch.add("GET", f"/drives/{drive_id}/items/{item['id']}/listItem/fields")
 
-def get_sharepoint_items(access_token, drive_url):
-    """Fetch items from the SharePoint drive URL."""
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(drive_url, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    if batch_ids:
+        results = batch.execute(access_token=access_token)
+        for item_id, request_id in batch_ids.items():
+            if results[request_id].status_code == 200:
+                fields_by_id[item_id] = results[request_id].json()
 
-def get_taxonomy_item_id(access_token, items):
-    headers = {"Authorization": f"Bearer {access_token}",}
-    item_ids = [i["id"] for i in items["value"]]
-    download_urls = [i["@microsoft.graph.downloadUrl"] for i in items["value"]]
+    return fields_by_id
 
+
+def get_taxonomy_item_id(access_token, items):
     TAXONOMY_DRIVE_ID = config("TAXONOMY_DRIVE_ID")
-    for ind, item_id in enumerate(item_ids):
-        url = f"https://graph.microsoft.com/v1.0/drives/{TAXONOMY_DRIVE_ID}/items/{item_id}/listItem/fields"
-        response = requests.get(url, headers=headers)
-        values = response.json()
+    fields_by_id = get_items_fields(access_token, TAXONOMY_DRIVE_ID, items["value"])
+
+    for item in items["value"]:
+        values = fields_by_id.get(item["id"], {})
         if "isParsed" in values:
             if values["isParsed"] == False:
-                return item_id, download_urls[ind]
+                return item["id"], item["@microsoft.graph.downloadUrl"]
     return -1, ""
 
 
@@ -278,55 +309,104 @@ def get_taxonomy_item_id(access_token, items):
 def get_file_content(access_token, download_url):
     """Download the file content from the provided URL."""
     headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(download_url, headers=headers)
+    response = graph_client.get(download_url, headers=headers, authenticate=False)
     response.raise_for_status()
     return response.content
 
-def pdf_to_images(pdf_path):
-    images = None
+def poppler_kwargs():
     if os.name == "nt":
         # For windows
-        print('--- Windows ---')
-        images = convert_from_path(pdf_path, poppler_path=r'C:\poppler\poppler-24.08.0\Library\bin')
-    else:
-        # For Linux
-        print('--- Linux ---')
-        images = convert_from_path(pdf_path)
-    return images
+        return {"poppler_path": r'C:\poppler\poppler-24.08.0\Library\bin'}
+    return {}
 
-def process_pdf_with_gpt(pdf_path, prompt, client):
-    from .common import CommonUtils
-    results = []
-    images = pdf_to_images(pdf_path)
 
-    for i, image in enumerate(images):
-        print(f"Processing page {i + 1}...")
-        result = CommonUtils.send_image_to_gpt(client, image, prompt)
-        results.append(result)
+def iter_pdf_pages(pdf_path, page_numbers=None):
+    """
+    Render a PDF lazily, yielding (page_number, PIL image) a small window of pages at a time.
 
-    return "\n\n".join(results)
+    Only PDF_RENDER_WINDOW pages are rasterised per poppler call (split over
+    PDF_RENDER_THREADS pdftoppm processes), so memory does not grow with the page count.
+    DPI and greyscale rendering are configurable (PDF_RENDER_DPI, PDF_RENDER_GRAYSCALE).
 
-def get_pdf_file_content(access_token, download_url, client):
-    """Download the file content from the provided URL."""
-    PARAMS = {
-        "la": "en",
-        "hash": "5EA2DA7D1492D105375580EEF2FB088F"
+    :param page_numbers: 1-based pages to render, all pages when omitted.
+    """
+    if page_numbers is None:
+        page_count = pdfinfo_from_path(pdf_path, **poppler_kwargs())["Pages"]
+        page_numbers = range(1, page_count + 1)
+
+    window = config("PDF_RENDER_WINDOW", default=2, cast=int)
+    render_options = {
+        "dpi": config("PDF_RENDER_DPI", default=150, cast=int),
+        "grayscale": config("PDF_RENDER_GRAYSCALE", default=True, cast=bool),
+        "thread_count": config("PDF_RENDER_THREADS", default=2, cast=int),
+        **poppler_kwargs(),
     }
 
-    HEADERS = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_3_1) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Safari/605.1.15",
-        "Accept-Language": "en-GB,en;q=0.9,en-US;q=0.8,pt;q=0.7",
-        "Authorization": f"Bearer {access_token}"
-    }
+    # Group consecutive pages so each poppler call renders one contiguous range
+    batches = []
+    for page_number in page_numbers:
+        if batches and batches[-1][-1] == page_number - 1 and len(batches[-1]) < window:
+            batches[-1].append(page_number)
+        else:
+            batches.append([page_number])
+
+    for batch in batches:
+        images = convert_from_path(pdf_path, first_page=batch[0], last_page=batch[-1], **render_options)
+        for page_number, image in zip(batch, images):
+            yield page_number, image
+        del images
+
+
+def ocr_page_with_retry(client, image, prompt, page_number):
+    """OCR one page, retrying just this page with exponential backoff when the call fails."""
+    max_attempts = config("OCR_PAGE_MAX_ATTEMPTS", default=3, cast=int)
+    for attempt in range(1, max_attempts + 1):
+        vision_rate_limiter.acquire(config("OCR_TOKENS_PER_PAGE", default=2000, cast=int))
+        try:
+            logging.info(f"Processing page {page_number}...")
+            return CommonUtils.send_image_to_gpt(client, image, prompt)
+        except Exception as e:
+            logging.warning(f"Page {page_number} attempt {attempt} failed: {e}")
+            if attempt == max_attempts:
+                raise
+            time.sleep(2 ** attempt)  # Exponential backoff: 2s, 4s, 8s...
 
-    CHUNK = 32 * 1024
 
-    with requests.get(download_url, headers=HEADERS, params=PARAMS, stream=True) as response:
-        response.raise_for_status()
-        with open("temp.pdf", "wb") as output:
-            for data in response.iter_content(CHUNK):
-                output.write(data)
+def process_pdf_with_gpt(pdf_path, prompt, client, page_numbers=None):
+    """OCR PDF pages with the vision model and join the results in page order."""
+    results = ocr_pdf_pages(pdf_path, prompt, client, page_numbers)
+    return "\n\n".join(results[page_number] for page_number in sorted(results))
 
+
+def ocr_pdf_pages(pdf_path, prompt, client, page_numbers=None):
+    """
+    OCR pages with the vision model as soon as they are rendered, up to OCR_CONCURRENCY
+    pages at a time within the shared tokens-per-minute budget. Rendering waits while
+    the executor is saturated, so only a handful of page images exist at any moment.
+    Returns {page_number: text}.
+    """
+    concurrency = config("OCR_CONCURRENCY", default=4, cast=int)
+    in_flight = threading.BoundedSemaphore(concurrency)
+    futures = []
+
+    def ocr_page(image, page_number):
+        try:
+            return ocr_page_with_retry(client, image, prompt, page_number)
+        finally:
+            image.close()
+            in_flight.release()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for page_number, image in iter_pdf_pages(pdf_path, page_numbers):
+            in_flight.acquire()
+            futures.append((page_number, executor.submit(contextvars.copy_context().run, ocr_page,
+                                                         image, page_number)))
+        results = {page_number: future.result() for page_number, future in futures}
+
+    return results
+
+def extract_pdf_qna(pdf_content, client):
+    """Transcribe the questions and answers of a (scanned) PDF questionnaire."""
     prompt = """
     Please analyze the scanned questionnaire page and extract every question along with its corresponding answer(s). For multiple-choice questions, note that there are two types:
   • Radio button questions: Only one option is selected (indicated by a filled radio button).
@@ -344,18 +424,26 @@ def get_pdf_file_content(access_token, download_url, client):
     Ensure that your transcription accurately reflects all text from the page.
     """
 
-    all_qna = process_pdf_with_gpt("temp.pdf", prompt, client)
-    os.remove("temp.pdf")
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
+        temp_filename = temp_file.name
+        temp_file.write(pdf_content)
+
+    try:
+        all_qna = extract_pdf_content(temp_filename, client, prompt)
+    finally:
+        os.remove(temp_filename)
 
     return all_qna
 
 def parse_pdf_content(file_content):
     """Parse the content of a PDF file."""
-    with open("temp.pdf", "wb") as f:
-        f.write(file_content)
-    reader = PdfReader("temp.pdf")
-    content = "\n".join([page.extract_text() for page in reader.pages])
-    os.remove("temp.pdf")
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
+        temp_filename = temp_file.name
+        temp_file.write(file_content)
+    try:
+        content = extract_pdf_content(temp_filename)
+    finally:
+        os.remove(temp_filename)
     return content
 
 
@@ -367,24 +455,12 @@ def send_to_gpt(client, parsed_content):
         f"Please structure the JSON with keys named 'solution_plays' and include in the values the technical capabilities along with a description of each."
         f"Make sure to add all Solution Plays from the content into Json keys"
     )
-    response = client.chat.completions.create(
-        model=config("MODEL_NAME"),
-        # max_tokens=2000,
-        response_format={"type": "json_object"},
-        messages=[{"role": "user", "content": prompt}]
-    )
-    return response.choices[0].message.content
+    return chat_completion(client, [{"role": "user", "content": prompt}], response_format={"type": "json_object"})
 
 @log_execution_time
 def gpt_response_for_sp(client, prompt):
     deployment_name_model = config("DEPLOYMENT_NAME")
-    response = client.chat.completions.create(
-        model=config("MODEL_NAME"),
-        # max_tokens=350,
-        response_format={"type": "json_object"},
-        messages=[{"role": "user", "content": prompt}],
-    )
-    result = response.choices[0].message.content
+    result = chat_completion(client, [{"role": "user", "content": prompt}], response_format={"type": "json_object"})
     return result
 
 
@@ -396,10 +472,9 @@ def save_response_to_json(data, file_path):
 
 def set_is_parsed_false(access_token, item_id):
     TAXONOMY_DRIVE_ID = config("TAXONOMY_DRIVE_ID")
-    url = f"https://graph.microsoft.com/v1.0/drives/{TAXONOMY_DRIVE_ID}/items/{item_id}/listItem/fields"
-    headers = {"Authorization": f"Bearer {access_token}"}
+    url = f"/drives/{TAXONOMY_DRIVE_ID}/items/{item_id}/listItem/fields"
     fields = { "isParsed": "True" }
-    response = requests.patch(url,json=fields ,headers=headers)
+    response = graph_client.patch(url, json=fields, access_token=access_token)
     response.raise_for_status()
     if response.status_code == "200":
         return True
@@ -419,8 +494,8 @@ def read_json_file(file_path):
 
 def taxonomy_processing(client, access_token):
     TAXONOMY_DRIVE_ID = config("TAXONOMY_DRIVE_ID")
-    drive_url = f"https://graph.microsoft.com/v1.0/drives/{TAXONOMY_DRIVE_ID}/root/children"
-    items = get_sharepoint_items(access_token, drive_url)
+    drive_url = f"/drives/{TAXONOMY_DRIVE_ID}/root/children"
+    items = get_sharepoint_items(access_token, drive_url, params=EXPAND_FIELDS_PARAMS)
     if len(items) == 0:
         return "No Taxonomy file found (or) All files have already been processed!", "", False
 
@@ -521,38 +596,22 @@ def process_docx_content(binary_content: bytes) -> str:
     return document_content.strip()
 
 
-def get_file_down_url(access_token, items, project_id, delimiter):
-    headers = {"Authorization": f"Bearer {access_token}",}
-    item_values = items["value"]
-    target_ind = None
-    time.sleep(5)
-    for ind, elem in enumerate(item_values):
-        split_name_list =  elem["name"].split(delimiter)
-        if len(split_name_list) > 1:
-            sp_proj_id = int(re.findall(r"\d+", split_name_list[1])[0]) # ['filename', '70.docx']
-            # item_proj_id = int(split_name_list[1])
-            if sp_proj_id == int(project_id):
-                target_ind = ind
-                break
-
-    download_url = item_values[target_ind]["@microsoft.graph.downloadUrl"]
-    return download_url
-
 def get_initial_form_by_search(access_token, item_id, client):
     is_pdf = False
     is_docx = False
 
     init_form_drive=config("INITIAL_FORM_DRIVE")
-    url = f"https://graph.microsoft.com/v1.0/drives/{init_form_drive}/items/{item_id}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
+    url = f"/drives/{init_form_drive}/items/{item_id}"
+    response = graph_client.get(url, access_token=access_token)
     response = response.json()
 
-    download_url = response.get("@microsoft.graph.downloadUrl", None)
-    if not download_url:
-        raise "There was an issue while getting the Download URL from Sharepoint"
-
     item_name = response.get("name", None)
+    if not item_name:
+        raise Exception("There was an issue while getting the Initial Form from Sharepoint")
+
+    # The item's cTag tells the cache whether the stored copy is still current
+    binary_content = content_cache.get_content(init_form_drive, item_id, tag=response.get("cTag"),
+                                               access_token=access_token)
 
     if ".pdf" in item_name:
         is_pdf = True
@@ -563,17 +622,8 @@ def get_initial_form_by_search(access_token, item_id, client):
 
     if is_pdf:
         print("the Initial form is in PDF Format")
-        # Retry mechanism
-        max_attempts = 2
-        for attempt in range(1, max_attempts + 1):
-            try:
-                file_content = get_pdf_file_content(access_token, download_url, client)
-                break  # Success, exit the loop
-            except Exception as e:
-                print(f"Attempt {attempt} failed: {e}")
-                if attempt == max_attempts:
-                    raise  # Re-raise the exception if it's the last attempt
-                time.sleep(2 ** attempt)  # Exponential backoff: 2s, 4s, 8s...
+        # Failed pages are retried individually by ocr_page_with_retry
+        file_content = extract_pdf_qna(binary_content, client)
 
         # For testing (check the initial form content by saving in a file locally)
         with open('initial form text.txt', "w") as f:
@@ -582,44 +632,43 @@ def get_initial_form_by_search(access_token, item_id, client):
 
     elif is_docx:
         print("the Initial form is is DOCX Format")
-        binary_content = get_file_content(access_token, download_url)
         # file_content = process_docx_content(binary_content)
         file_content = str(extract_qna_from_docx(binary_content))
 
     return file_content
 
+def get_indexed_file_content(access_token, drive_id, project_id, delimiter):
+    """
+    Return the bytes of a project's file in a drive via the drive index and content cache.
+    Raises drive_index.ProjectFileNotFound when the drive has no file for the project.
+    """
+    entry = drive_index.lookup(drive_id, project_id, delimiter, access_token=access_token)
+    try:
+        # The indexed cTag lets an unchanged cached file skip the request entirely
+        return content_cache.get_content(drive_id, entry.item_id, tag=entry.ctag, access_token=access_token)
+    except ItemNotFound:
+        # The indexed file was deleted or replaced, resync and try once more
+        drive_index.sync_drive(drive_id, delimiter, access_token=access_token)
+        entry = drive_index.lookup(drive_id, project_id, delimiter, access_token=access_token)
+        return content_cache.get_content(drive_id, entry.item_id, tag=entry.ctag, access_token=access_token)
+
+
 def get_initial_form_content(access_token, project_id):
-    time.sleep(5)
     initial_form_drive = config("INITIAL_FORM_DRIVE")
-    drive_url = f"https://graph.microsoft.com/v1.0/drives/{initial_form_drive}/root/children"
-    #TODO: filter by project id and its download url
-    items = get_sharepoint_items(access_token, drive_url)
-    if len(items) == 0:
-        return "No files found!", False
-
-    download_url = get_file_down_url(access_token, items, project_id, delimiter="_")
-    file_content = get_file_content(access_token, download_url)
+    file_content = get_indexed_file_content(access_token, initial_form_drive, project_id, INITIAL_FORM_DELIMITER)
     return file_content, True
 
 @log_execution_time
 def get_discovery_questionnaire(access_token, project_id):
     DISCOVERY_DRIVE = config("DISCOVERY_DRIVE")
-    drive_url = f"https://graph.microsoft.com/v1.0/drives/{DISCOVERY_DRIVE}/root/children"
-    items = get_sharepoint_items(access_token, drive_url)
-
-    if len(items) == 0:
-        return "No files found!", False
-
-    download_url = get_file_down_url(access_token, items, project_id, delimiter="-")
-    binary_content = get_file_content(access_token, download_url)
+    binary_content = get_indexed_file_content(access_token, DISCOVERY_DRIVE, project_id, DISCOVERY_DELIMITER)
     file_content = process_docx_content(binary_content)
     return file_content, True
 
 
 def get_discovery_content(access_token, item_id):
-    url = f"https://graph.microsoft.com/v1.0/drives/b!g1RPFkGuNkGOxozZZFyUfcWTvdgFKoJFkMbW7oxfQJ7BI2nybhy9Qp-2Uu0XUmby/items/{item_id}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
+    url = f"/drives/b!g1RPFkGuNkGOxozZZFyUfcWTvdgFKoJFkMbW7oxfQJ7BI2nybhy9Qp-2Uu0XUmby/items/{item_id}"
+    response = graph_client.get(url, access_token=access_token)
     response = response.json()
     download_url = response.get("@microsoft.graph.downloadUrl", None)
     if not download_url:
@@ -632,18 +681,11 @@ def get_discovery_content(access_token, item_id):
 
 def get_project_name(access_token, project_id):
     try:
-        access_token = get_access_token()
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-
         site_id = config("SITE_ID")
         project_list_id = config("PROJECT_LIST")
-        url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists/{project_list_id}/items/{project_id}/fields"
+        url = f"/sites/{site_id}/lists/{project_list_id}/items/{project_id}/fields"
 
-        # PATCH request to update CurrentStep
-        response = requests.get(url, headers=headers)
+        response = graph_client.get(url, access_token=access_token)
         response_json = response.json()
         project_name = response_json.get("Title")
 
@@ -656,50 +698,43 @@ def get_project_name(access_token, project_id):
         raise Exception(f"Error getting Info for Project-{project_id}: {str(e)}")
 
 
-def get_template(access_token, template_type):
+def get_template(access_token, template_type, output_dir=None):
     """
     Downloads a template file (DOCX or XLSX) based on template_type ('SOW' or 'WBS').
-    Preserves formatting and permissions via download URL.
+    Preserves formatting and permissions via download URL. The file is written to
+    output_dir (the working directory by default).
     """
 
     templates_drive_id = config("TEMPLATES_DRIVE_ID")
-    url = f"https://graph.microsoft.com/v1.0/drives/{templates_drive_id}/root/children"
-    headers = {"Authorization": f"Bearer {access_token}"}
+    url = f"/drives/{templates_drive_id}/root/children"
 
-    response = requests.get(url, headers=headers)
+    response = graph_client.get(url, params=EXPAND_FIELDS_PARAMS, access_token=access_token)
     if response.status_code != 200:
         raise Exception(f"Failed to fetch files: {response.json()}")
 
     items = response.json().get("value", [])
+    fields_by_id = get_items_fields(access_token, templates_drive_id, items)
     target_item = None
 
     # Find the item that matches the template_type
     for item in items:
-        item_id = item["id"]
-        item_url = f"https://graph.microsoft.com/v1.0/drives/{templates_drive_id}/items/{item_id}/listItem"
-        item_response = requests.get(item_url, headers=headers)
-        if item_response.status_code != 200:
-            continue
-
-        item_details = item_response.json()
-        if item_details["fields"].get("template_type") == template_type:
+        if fields_by_id.get(item["id"], {}).get("template_type") == template_type:
             target_item = item
             break
 
     if not target_item:
         raise Exception(f"No template found for type: {template_type}")
 
-    download_url = target_item["@microsoft.graph.downloadUrl"]
     filename = target_item["name"]
     file_ext = os.path.splitext(filename)[1].lower()  # e.g., '.docx' or '.xlsx'
 
-    output_path =  filename
+    output_path = os.path.join(output_dir, filename) if output_dir else filename
 
-    file_download_response = requests.get(download_url)
-    if file_download_response.status_code != 200:
-        raise Exception("Failed to download the file.")
+    # The listing carries the current cTag, so an unchanged template is not downloaded again
+    content = content_cache.get_content(templates_drive_id, target_item["id"], tag=target_item.get("cTag"),
+                                        access_token=access_token)
 
     with open(output_path, "wb") as f:
-        f.write(file_download_response.content)
+        f.write(content)
 
     return output_path
@@ -1,6 +1,7 @@
 import re
 import time
 import logging
+import tempfile
 
 from PyPDF2 import PdfReader
 from django.http import JsonResponse
@@ -8,7 +9,8 @@ from rest_framework.views import APIView, View
 from rest_framework.response import Response
 from rest_framework import status
 
-from .cost_estimation_json import get_service_app_records
+from .cost_estimation_json import get_service_app_records, get_service_resolver
+from .cost_services import get_services_list, parse_services_list
 from .docx_processing import process_document
 from .utils import *
 from decouple import config
@@ -19,9 +21,14 @@ import openai
 from pathlib import Path
 from openai import AzureOpenAI
 from docx import Document
-from .copilot_utils import complete_process
+from .copilot_utils import complete_process_for_solution_plays
 from .wbs_utils import get_wbs_content, create_upload_wbs, read_tasks_from_excel
-from .common import CommonUtils, get_summaries_from_text, log_execution_time
+from .common import CommonUtils, get_summaries_from_text, log_execution_time, summaries_complete
+from .artifacts import ArtifactStore
+from .jobs import enqueue, wait_for
+from .metrics import record_token_usage, span
+from .models import Job
+from .pipeline import Pipeline
 
 # Initialize OpenAI client
 client = AzureOpenAI(
@@ -110,64 +117,148 @@ class WBSDocumentView(APIView):
     """
 
     http_method_names = ['get', 'head', 'post']
+
+    # LoggingStatus written to the Project list when a stage finishes
+    STAGE_LOGGING_STATUS = {
+        "costs": "Cost Estimation - WBS",
+        "copilot": "Copilot Response - WBS",
+    }
+
     def post(self, request):
         try:
 
             user_remarks = request.data.get("message")
-
-            access_token = get_access_token()
             project_id = request.data.get("project_id")
 
             wbs_item_id = request.data.get("wbs_item_id", None)
             print(f"user remarks: {user_remarks}, project idea: {project_id}, wbs item ID: {wbs_item_id}")
 
-            questionnaire_content = get_discovery_questionnaire(access_token, project_id)
+            return submit_job("wbs", {"message": user_remarks, "project_id": project_id,
+                                      "wbs_item_id": wbs_item_id})
+        except Exception as e:
+            return Response({"error": str(e)}, status=500)
 
-            costs = self.cost_estimation(questionnaire_content)
-            unique_services = []
+    def generate(self, job):
+        """Job handler: generate and upload the WBS."""
+        access_token = get_access_token()
+        payload = job.payload
+        # Every run works in its own directory, so concurrent runs never share files
+        with tempfile.TemporaryDirectory(prefix=f"wbs_{payload['project_id']}_") as work_dir:
+            pipeline = self.build_pipeline(access_token, payload["project_id"], payload["message"],
+                                           payload["wbs_item_id"], work_dir, job)
+            pipeline.run()
+        return "SUCCESS"
+
+    def build_pipeline(self, access_token, project_id, user_remarks, wbs_item_id, work_dir=None, job=None):
+        """
+        WBS generation as a stage graph: cost estimation, the existing WBS and the template
+        are fetched while the solution plays -> Copilot -> URL summaries chain is running.
 
-            if costs:
-                unique_services = list(set([c["serviceName"] for c in costs]))
-            update_current_step(project_id, "Cost Estimation - WBS", key="LoggingStatus")
+        The stages between the questionnaire and the final prompt are checkpointed per
+        project, so regenerating with remarks for an unchanged questionnaire only runs
+        the final generation.
+        """
+        with_remarks = user_remarks != ""
+
+        def on_stage_done(stage):
+            if stage in self.STAGE_LOGGING_STATUS:
+                update_current_step(project_id, self.STAGE_LOGGING_STATUS[stage], key="LoggingStatus")
+            if job is not None:
+                reused = " (reused)" if stage in pipeline.reused else ""
+                job.set_progress(f"WBS: {stage} done{reused}")
+
+        def costs(questionnaire):
+            return self.cost_estimation(questionnaire)
+
+        def solution_plays(questionnaire):
             prompt_zero = (f"Return all the solution plays in a list in json, The key must be 'SolutionPlays' and in values keep a list like ['Solution PLay1', 'Solution Play2']"
-                           f"Figure out Solution Plays from this filled Discovery Questionnaire Content{questionnaire_content}")
-            solution_plays_list = gpt_response_for_sp(client, prompt_zero)
-            copilot_prompt = f"""
-                                Solution plays: {solution_plays_list}
-                                Give all helpful MS Docs learning links along with Technical Topics name related to these Solution plays
-                                Make sure to add helpful links of relevant docs
-                            """
-            copilot_response, success = complete_process(copilot_prompt)
-            update_current_step(project_id, "Copilot Response - WBS", key="LoggingStatus")
-            summarized_content = get_summaries_from_text(client, copilot_response)
-            copilot_response = f"{copilot_response}\n Here is the more context: {summarized_content}"
-
-            if user_remarks != "":
-                wbs_data = get_wbs_content(access_token, wbs_item_id)
-                prompt = CommonUtils.load_prompt_with_remarks(user_remarks, copilot_response,
-                                                              questionnaire_content, wbs_data, unique_services)
-                self.wbs_process(access_token, prompt, project_id, costs)
-                return Response("SUCCESS", status=200)
+                           f"Figure out Solution Plays from this filled Discovery Questionnaire Content{questionnaire}")
+            return gpt_response_for_sp(client, prompt_zero)
 
-            prompt = CommonUtils.load_prompt_without_remarks(questionnaire_content, copilot_response, unique_services)
-            self.wbs_process(access_token, prompt, project_id, costs)
+        copilot_failed_plays = []
 
-            return Response("SUCCESS", status=200)
-        except Exception as e:
-            return Response({"error": str(e)}, status=500)
+        def copilot(solution_plays):
+            copilot_response, success = complete_process_for_solution_plays(solution_plays, copilot_failed_plays)
+            if not success:
+                logging.warning(f"Copilot request failed: {copilot_response}")
+                return ""
+            return copilot_response
+
+        def summaries(copilot):
+            return get_summaries_from_text(client, copilot)
 
-    def wbs_process(self, access_token, prompt, project_id, costs):
-        result = CommonUtils.gpt_response_json(client, prompt)
+        def generation(questionnaire, costs, copilot, summaries, template, existing_wbs=None):
+            unique_services = []
+            if costs:
+                unique_services = list(set([c["serviceName"] for c in costs]))
+
+            copilot_response = f"{copilot}\n Here is the more context: {summaries}"
+            if with_remarks:
+                prompt = CommonUtils.load_prompt_with_remarks(user_remarks, copilot_response,
+                                                              questionnaire, existing_wbs, unique_services)
+            else:
+                prompt = CommonUtils.load_prompt_without_remarks(questionnaire, copilot_response, unique_services)
+            return self.wbs_process(access_token, prompt, project_id, costs, template)
+
+        def questionnaire():
+            # get_discovery_questionnaire returns (text, found); the stages need the text
+            questionnaire_content, _ = get_discovery_questionnaire(access_token, project_id)
+            return questionnaire_content
+
+        pipeline = Pipeline("wbs", on_stage_done=on_stage_done, artifacts=ArtifactStore("wbs", project_id))
+        pipeline.add("questionnaire", questionnaire)
+        pipeline.add("costs", costs, depends_on=["questionnaire"], checkpoint=True)
+        pipeline.add("solution_plays", solution_plays, depends_on=["questionnaire"], checkpoint=True)
+        # Only complete answers are kept: a failed or partial Copilot answer, or summaries with
+        # error text, are asked for again on the next run
+        pipeline.add("copilot", copilot, depends_on=["solution_plays"],
+                     checkpoint=lambda output: bool(output) and not copilot_failed_plays)
+        pipeline.add("summaries", summaries, depends_on=["copilot"], checkpoint=summaries_complete)
+        pipeline.add("template", lambda: get_template(access_token, "WBS", work_dir))
+
+        generation_inputs = ["questionnaire", "costs", "copilot", "summaries", "template"]
+        if with_remarks:
+            pipeline.add("existing_wbs", lambda: get_wbs_content(access_token, wbs_item_id))
+            generation_inputs.append("existing_wbs")
+        pipeline.add("generation", generation, depends_on=generation_inputs)
+        return pipeline
+
+    def wbs_process(self, access_token, prompt, project_id, costs, template_path):
+        # Regenerating must produce a fresh WBS, so the final generation is never cached
+        result = CommonUtils.gpt_response_json(client, prompt, use_cache=False)
         update_current_step(project_id, "OpenA API Response- WBS", key="LoggingStatus")
-        template_path = get_template(access_token, "WBS")
         create_upload_wbs(access_token, result, project_id, costs, template_path)
-        update_current_step(project_id, "WBS Review")
-        update_current_step(project_id, "WBS uploaded - WBS", key="LoggingStatus")
+        update_project_fields(project_id, {"CurrentStep": "WBS Review", "LoggingStatus": "WBS uploaded - WBS"})
         return True
 
     @log_execution_time
     def cost_estimation(self, questionnaire_content):
-        costs = None
+        # The LLM's names rarely match the catalog exactly ("App Service" vs "Azure App Service")
+        resolver = get_service_resolver()
+        services_objects = get_services_list(
+            questionnaire_content, resolver,
+            lambda named_services: self.request_services_list(questionnaire_content, named_services))
+
+        resolved_services = []
+        for services_object in services_objects:
+            service = services_object["serviceName"]
+            match = resolver.resolve(service, services_object.get("skuName"))
+            if match is None:
+                logging.warning(f"No catalog service matches '{service}'")
+                continue
+            if match.service_name != service:
+                logging.info(f"Resolved '{service}' to '{match.service_name}' ({match.source}, score {match.score})")
+            if match.service_name not in resolved_services:
+                resolved_services.append(match.service_name)
+
+        total_costs = []
+        for service in resolved_services:
+            cost_list = get_service_app_records(service_name=service)
+            total_costs.extend(cost_list)
+
+        return total_costs
+
+    def request_services_list(self, questionnaire_content, named_services):
         cost_estimation_prompt = """
         Provide a detailed cost estimation for the following Azure services (only East US)
         For each service, include:
@@ -200,17 +291,15 @@ class WBSDocumentView(APIView):
     - The sample serviceName, skuName, region, and tier are just example/reference
     - Make sure the service and skuName must be available in that region under that tier
     - The services will be used to estimate cost, so make sure that we have Microsoft list of services
+    - Only include services this Discovery Questionnaire needs
         """
+        cost_estimation_prompt += f"\nDiscovery Questionnaire Content: {questionnaire_content}"
+        if named_services:
+            cost_estimation_prompt += f"\nThe questionnaire already names these services: {', '.join(named_services)}"
 
-        total_costs = []
-        result_json = eval(CommonUtils.gpt_response_json(client, cost_estimation_prompt))
-        services_objects = result_json.get("servicesList", None)
-        services = [i["serviceName"] for i in services_objects]
-        for service in services:
-            cost_list = get_service_app_records(service_name=service)
-            total_costs.extend(cost_list)
-
-        return total_costs
+        # Cached per questionnaire by get_services_list, so the prompt cache is not needed
+        result = CommonUtils.gpt_response_json(client, cost_estimation_prompt, use_cache=False)
+        return parse_services_list(result)
 
 
 class OAuthRedirectView(View):
@@ -259,10 +348,25 @@ class DiscoveryQuestionnaireAPIView(APIView):
     http_method_names = ['get',  'post']
 
     def post(self, request, *args, **kwargs):
-        user_remarks = request.data.get("message")
+        try:
+            return submit_job("discovery_questionnaire", {
+                "message": request.data.get("message"),
+                "project_id": request.data.get("project_id"),
+                "item_id": request.data.get("item_id"),
+            })
+        except Exception as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+    def generate(self, job):
+        """Job handler: generate the discovery questionnaire and upload it to SharePoint."""
+        user_remarks = job.payload.get("message")
         access_token = get_access_token()
-        project_id = request.data.get("project_id")
-        item_id = request.data.get("item_id")
+        project_id = job.payload.get("project_id")
+        item_id = job.payload.get("item_id")
+        job.set_progress("Reading the initial form")
         project_name = get_project_name(access_token, project_id)
         initial_form_content = get_initial_form_by_search(access_token, item_id, client)
 
@@ -278,89 +382,72 @@ class DiscoveryQuestionnaireAPIView(APIView):
         folder_path = Path(".")
 
         if not folder_path.exists() or not folder_path.is_dir():
-            return Response(
-                {"error": "The 'Dummy Docs' folder does not exist."},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-
-        try:
-            # Read and parse documents
-            client_n_project_prompt = f"From this Initial Form content, give me all the information for client like name, email, project date and other relevant info, etc, {initial_form_content}"
-            client_n_project_info = CommonUtils.gpt_response(client, client_n_project_prompt)
-            client_n_project_info = f"Project Name: {project_name}\n {client_n_project_prompt}"
-
-
-            all_text, discovery_questionnaire_text = read_and_parse_documents(folder_path)
-            prompt_zero = f"Return all the solution plays in a list in json, The key must be 'SolutionPlays' and in values keep a list like ['Solution Play1', 'Solution Play2'], find Solution Plays from here: {initial_form_content}"
-            solution_plays_list = gpt_response_for_sp(client, prompt_zero)
-            copilot_prompt = f"""
-                    Solution plays: {solution_plays_list}
-                    Give all helpful MS Docs learning links along with Technical Topics name related to these Solution plays
-                    Make sure to add helpful links of relevant docs
-                """
-            copilot_response, success = complete_process(copilot_prompt)
-            with open('copilot_response.txt', 'w') as f:
-                f.write(str(copilot_response))
-                f.close()
-
-
-            prompt = f""""
-                Based on the following discovery questionnaire, generate a new discovery questionnaire tailored specifically for the Solution Play(s) mentioned in this list: {solution_plays_list}\n 
-                \n\nSample Discovery Questionnaire (this is just an example):\n{discovery_questionnaire_text}\n\n
-                For context, here is the Initial Form response with the transcript:\n\n {copilot_response} \n
-                Here is some more context which has solution plays: \n{taxonomy_json}\n
-                User Notes (must be followed if provided): {user_remarks}\n
-
-                Instructions:
-                - Make sure to complete the discovery questionnaire focusing exclusively on the Solution Play(s) mentioned in the Form Response and User Notes
-                - Questions should be relevant to the Solution Play(s) mentioned.
-                - Use clear numbering for each question and proper formatting for multiple-choice options (e.g., (1), (2), etc.).
-                - Ensure that the structure and format of the sample discovery questionnaire are followed precisely.
-                - Output only the questionnaire content, formatted as a numbered list with properly labeled options in Docx format
-                - Add the constraints, timeline, benefits and important aspects of the project too.
-                - Add at least 20+ questions
-                - Fill all the basic questions based on the info: {client_n_project_info}
-                - Here is the complete initial for response for better context: {initial_form_content}
-                """
-
-            deployment_name_model = config("DEPLOYMENT_NAME")
+            raise Exception("The 'Dummy Docs' folder does not exist.")
+
+        # Read and parse documents
+        client_n_project_prompt = f"From this Initial Form content, give me all the information for client like name, email, project date and other relevant info, etc, {initial_form_content}"
+        client_n_project_info = CommonUtils.gpt_response(client, client_n_project_prompt)
+        client_n_project_info = f"Project Name: {project_name}\n {client_n_project_prompt}"
+
+
+        job.set_progress("Asking Copilot about the solution plays")
+        all_text, discovery_questionnaire_text = read_and_parse_documents(folder_path)
+        prompt_zero = f"Return all the solution plays in a list in json, The key must be 'SolutionPlays' and in values keep a list like ['Solution Play1', 'Solution Play2'], find Solution Plays from here: {initial_form_content}"
+        solution_plays_list = gpt_response_for_sp(client, prompt_zero)
+        copilot_response, success = complete_process_for_solution_plays(solution_plays_list)
+        with open('copilot_response.txt', 'w') as f:
+            f.write(str(copilot_response))
+            f.close()
+
+
+        prompt = f""""
+            Based on the following discovery questionnaire, generate a new discovery questionnaire tailored specifically for the Solution Play(s) mentioned in this list: {solution_plays_list}\n 
+            \n\nSample Discovery Questionnaire (this is just an example):\n{discovery_questionnaire_text}\n\n
+            For context, here is the Initial Form response with the transcript:\n\n {copilot_response} \n
+            Here is some more context which has solution plays: \n{taxonomy_json}\n
+            User Notes (must be followed if provided): {user_remarks}\n
+
+            Instructions:
+            - Make sure to complete the discovery questionnaire focusing exclusively on the Solution Play(s) mentioned in the Form Response and User Notes
+            - Questions should be relevant to the Solution Play(s) mentioned.
+            - Use clear numbering for each question and proper formatting for multiple-choice options (e.g., (1), (2), etc.).
+            - Ensure that the structure and format of the sample discovery questionnaire are followed precisely.
+            - Output only the questionnaire content, formatted as a numbered list with properly labeled options in Docx format
+            - Add the constraints, timeline, benefits and important aspects of the project too.
+            - Add at least 20+ questions
+            - Fill all the basic questions based on the info: {client_n_project_info}
+            - Here is the complete initial for response for better context: {initial_form_content}
+            """
+
+        job.set_progress("Generating the questionnaire")
+        deployment_name_model = config("DEPLOYMENT_NAME")
+        with span("openai", "chat"):
             response = client.chat.completions.create(
                 model=config("MODEL_NAME"),
                 # max_tokens=10000,
                 messages=[{"role": "user", "content": prompt}]
             )
-            result = response.choices[0].message.content.strip()
+        record_token_usage("chat", getattr(response, "usage", None))
+        result = response.choices[0].message.content.strip()
 
-            new_doc = Document()
+        new_doc = Document()
 
-            result = re.sub(r'\*', '', result)
+        result = re.sub(r'\*', '', result)
 
-            # Add LLM-generated content to the new document
-            new_doc.add_paragraph(result, style='Normal')
+        # Add LLM-generated content to the new document
+        new_doc.add_paragraph(result, style='Normal')
 
-            # Save the generated questionnaire
-            output_file_path = folder_path / "Generated_Discovery_Questionnaire.docx"
+        # Save the generated questionnaire in a directory of its own (concurrent runs never collide)
+        with tempfile.TemporaryDirectory(prefix=f"questionnaire_{project_id}_") as work_dir:
+            output_file_path = Path(work_dir) / "Generated_Discovery_Questionnaire.docx"
             new_doc.save(output_file_path)
 
             # Upload to SharePoint
             upload_questionnaire_to_sharepoint(output_file_path, project_id)
             update_current_step(project_id, "Questionnaire Review")
 
-            # Remove the file after successful submission
-            os.remove(output_file_path)
-
-            return Response(
-                {
-                    "message": "Generated discovery questionnaire successfully."
-                },
-                status=status.HTTP_200_OK,
-            )
+        return {"message": "Generated discovery questionnaire successfully."}
 
-        except Exception as e:
-            return Response(
-                {"error": str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            )
 
 
 class PromptResponseAPIView(APIView):
@@ -422,24 +509,92 @@ class SowApiView(APIView):
 
     def post(self, request):
         try:
-            project_id = request.data.get("project_id")
-            wbs_item_id = request.data.get("wbs_item_id")
-            initial_form_item_id = request.data.get("initial_form_item_id")
-            access_token = get_access_token()
-            input_file = get_template(access_token, "SOW")
+            return submit_job("sow", {
+                "project_id": request.data.get("project_id"),
+                "wbs_item_id": request.data.get("wbs_item_id"),
+                "initial_form_item_id": request.data.get("initial_form_item_id"),
+            }, error_body=lambda error: f"Error: {error}")
+        except Exception as e:
+            return Response(f"Error: {str(e)}", status=500)
 
-            output_file = f"SOW_{project_id}.docx"
+    def generate(self, job):
+        """Job handler: fill the SOW template and upload it to SharePoint."""
+        project_id = job.payload.get("project_id")
+        wbs_item_id = job.payload.get("wbs_item_id")
+        initial_form_item_id = job.payload.get("initial_form_item_id")
+        access_token = get_access_token()
+
+        # Every run works in its own directory, so concurrent runs never share files
+        with tempfile.TemporaryDirectory(prefix=f"sow_{project_id}_") as work_dir:
+            input_file = get_template(access_token, "SOW", work_dir)
+
+            job.set_progress("Generating the SOW")
+            output_file = os.path.join(work_dir, f"SOW_{project_id}.docx")
             process_document(input_file, output_file, access_token, project_id, initial_form_item_id, wbs_item_id)
             print(f"Processed document saved as '{output_file}'.")
 
             # Upload to SharePoint
+            job.set_progress("Uploading the SOW")
             upload_sow_to_sharepoint(output_file, project_id)
             update_current_step(project_id, "SOW Review")
 
-            # Delete output SOW document after SP upload
-            os.remove(output_file)
-            os.remove(input_file)
+        return "Success"
 
-            return Response("Success", status=200)
-        except Exception as e:
-            return Response(f"Error: {str(e)}", status=500)
+
+class JobStatusView(APIView):
+    """
+    Status, progress and result of a generation job.
+    """
+    http_method_names = ['get']
+
+    def get(self, request, job_id):
+        job = Job.objects.filter(job_id=job_id).first()
+        if job is None:
+            return Response({"error": "Job not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job.as_dict(), status=status.HTTP_200_OK)
+
+
+def submit_job(kind, payload, error_body=lambda error: {"error": error}):
+    """
+    Run generation work as a Job (so identical requests are de-duplicated).
+
+    By default (JOB_QUEUE_ENABLED=False) the job runs inside the request and the endpoint
+    keeps its original contract: 200 with the handler's result, or 500 with
+    ``error_body(error)``. A request identical to one still running waits for that job's
+    result (jobs.wait_for), so it gets the same 200 or 500 and never a 202.
+
+    With JOB_QUEUE_ENABLED=True, which needs ``manage.py run_jobs`` running next to the web
+    app (the deploy workflow does not start it), the endpoint answers 202 with ``job_id``, ``status``, ``status_url`` and
+    ``deduplicated``; clients poll ``status_url`` (JobStatusView) for the progress, result
+    or error. A job that is already finished answers 200 (result) or 500 (error) at once.
+    """
+    job, created = enqueue(kind, payload)
+    if not config("JOB_QUEUE_ENABLED", default=False, cast=bool):
+        # There is no worker: run the job here, or wait for the identical request running it
+        job = wait_for(job)
+        if job.status == Job.SUCCEEDED:
+            return Response(job.result, status=status.HTTP_200_OK)
+        return Response(error_body(job.error or f"{job} did not finish in time"),
+                        status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    response = {"job_id": str(job.job_id), "status": job.status, "status_url": f"/ai_app/jobs/{job.job_id}/",
+                "deduplicated": not created}
+    if job.status == Job.SUCCEEDED:
+        response["result"] = job.result
+        return Response(response, status=status.HTTP_200_OK)
+    if job.status == Job.FAILED:
+        response["error"] = job.error
+        return Response(response, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return Response(response, status=status.HTTP_202_ACCEPTED)
+
+
+def run_wbs_job(job):
+    return WBSDocumentView().generate(job)
+
+
+def run_sow_job(job):
+    return SowApiView().generate(job)
+
+
+def run_discovery_questionnaire_job(job):
+    return DiscoveryQuestionnaireAPIView().generate(job)
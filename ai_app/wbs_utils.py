@@ -1,37 +1,25 @@
 import tempfile
 import time
 from decimal import Decimal
-import requests
-import re
 import os
-from pathlib import Path
-from docx import Document
 from decouple import config
 import openpyxl
 from .common import log_execution_time
-from .utils import get_file_content, process_docx_content
+from .cost_estimation_json import get_price_table
+from .content_cache import content_cache
+from .price_table import summarize_costs
+from .utils import upload_and_tag_file
 
 
 @log_execution_time
 def get_wbs_content(access_token, item_id):
     wbs_drive_id = config("WBS_DRIVE")
-    url = f"https://graph.microsoft.com/v1.0/drives/{wbs_drive_id}/items/{item_id}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
-    response = response.json()
-    download_url = response.get("@microsoft.graph.downloadUrl", None)
-    if not download_url:
-        raise "There was an issue while getting the Download URL from Sharepoint"
-
-    # Download the file
-    file_response = requests.get(download_url)
-    if file_response.status_code != 200:
-        raise Exception("Failed to download the WBS file from SharePoint")
+    file_content = content_cache.get_content(wbs_drive_id, item_id, access_token=access_token)
 
     # Save the file locally
     with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as temp_file:
         temp_filename = temp_file.name
-        temp_file.write(file_response.content)
+        temp_file.write(file_content)
 
     # Read the Excel content
     wbs_content = read_tasks_from_excel(temp_filename)
@@ -44,42 +32,9 @@ def get_wbs_content(access_token, item_id):
 
 def upload_wbs_to_sharepoint(access_token, file_path, project_id):
     try:
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-
-        site_id = config("SITE_ID")
         wbs_drive_id = config("WBS_DRIVE")
-        # Upload the file
-        upload_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{wbs_drive_id}/root:/WBS-{project_id}.xlsx:/content"
-
-        with open(file_path, "rb") as file:
-            response = requests.put(upload_url, headers=headers, data=file)
-
-        if response.status_code not in [200, 201]:
-            raise Exception(f"Failed to upload file: {response.json()}")
-
-        # Extract the uploaded file's item ID
-        item_id = response.json().get("id")
-
-        # Get existing columns
-        columns_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{wbs_drive_id}/items/{item_id}/listItem/fields"
-        print(columns_url)
-        fields_response = requests.get(columns_url, headers=headers)
-
-        if fields_response.status_code != 200:
-            raise Exception(f"Failed to fetch columns: {fields_response.json()}")
-
-        updated_project_id = {
-            "ProjetID":project_id
-        }
-
-        # Update the columns
-        update_response = requests.patch(columns_url, headers=headers, json=updated_project_id)
-
-        if update_response.status_code != 200:
-            raise Exception(f"Failed to update project_id: {update_response.json()}")
+        upload_and_tag_file(wbs_drive_id, f"WBS-{project_id}.xlsx", file_path, {"ProjetID": project_id},
+                            access_token=access_token)
 
     except Exception as e:
         raise Exception(f"Error during SharePoint upload or update: {str(e)}")
@@ -138,13 +93,14 @@ def save_cost_dict_list_to_excel(data_list, file_path):
         # If the file doesn't exist, create a new workbook
         wb = openpyxl.Workbook()
 
+    # Headers are the first dictionary's keys
+    headers = list(data_list[0].keys()) if data_list else []
+
     # Check if 'Cost Breakdown' sheet exists, otherwise create it
     if "Cost Breakdown" in wb.sheetnames:
         ws = wb["Cost Breakdown"]
     else:
         ws = wb.create_sheet(title="Cost Breakdown")
-        # Write headers based on the first dictionary keys
-        headers = list(data_list[0].keys())
         ws.append(headers)
 
     # Append rows from the list of dictionaries
@@ -162,7 +118,8 @@ def save_cost_dict_list_to_excel(data_list, file_path):
 def create_upload_wbs(access_token, result, project_id, costs, template_path):
     output_file_path = create_file(result, project_id, template_path)
     # save_costs_to_existing_excel(costs, output_file_path)
-    save_cost_dict_list_to_excel(costs, output_file_path)
+    # One row per service, SKU and region instead of every raw price record
+    save_cost_dict_list_to_excel(summarize_costs(costs, get_price_table), output_file_path)
 
     # Upload to SharePoint
     upload_wbs_to_sharepoint(access_token, output_file_path, project_id)
@@ -215,7 +172,8 @@ def add_tasks_to_excel(file_path, phases_data, project_id, sheet_name="Eng WBS")
                     sheet[f"{task_col}{row}"] = task  # Task title
 
         # Save the updated file
-        file_name = f"wbs_{project_id}.xlsx"
+        # Next to the template, so concurrent runs (each with its own directory) never collide
+        file_name = os.path.join(os.path.dirname(file_path), f"wbs_{project_id}.xlsx")
         time.sleep(4)
         wb.save(file_name)
         print(f"Data successfully added to '{sheet_name}' in {file_name}")